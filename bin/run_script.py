@@ -7,6 +7,13 @@ sys.path.insert(
     0, os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../libs")
 )
 
+if __name__ == "__main__":
+    from _scriptlauncher import launch_in_warm_process
+
+    exit_code = launch_in_warm_process()
+    if exit_code is not None:
+        sys.exit(exit_code)
+
 from _script import run_script
 from _shutil import prepend_to_path, setup_logger, update_env_var_explorer
 
@@ -6,6 +6,13 @@ sys.path.insert(
     0, os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../libs")
 )
 
+if __name__ == "__main__":
+    from _scriptlauncher import launch_in_warm_process
+
+    exit_code = launch_in_warm_process()
+    if exit_code is not None:
+        sys.exit(exit_code)
+
 from _script import start_script
 from _shutil import get_env_bool, prepend_to_path, update_env_var_explorer
 
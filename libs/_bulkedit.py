@@ -0,0 +1,347 @@
+import difflib
+import hashlib
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from _script import get_data_dir
+
+# Bump the version whenever the layout of the journal changes, so that stale
+# journals are never replayed.
+BULK_EDIT_JOURNAL_VERSION = 2
+
+_STAGED_FILE_SUFFIX = ".bulkedit.tmp"
+
+
+def get_bulk_edit_dir() -> str:
+    return os.path.join(get_data_dir(), "bulk_edit")
+
+
+def _get_journal_file() -> str:
+    return os.path.join(get_bulk_edit_dir(), "journal.json")
+
+
+def _get_backup_dir() -> str:
+    return os.path.join(get_bulk_edit_dir(), "backup")
+
+
+def _get_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _write_file_atomic(file: str, data: bytes):
+    tmp_file = file + _STAGED_FILE_SUFFIX
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+    if os.path.exists(file):
+        shutil.copymode(file, tmp_file)
+    os.replace(tmp_file, file)
+
+
+def read_text_files(
+    files: Iterable[str],
+    on_progress: Optional[Callable[[str], None]] = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Read files in parallel and yield `(file, content)` in the same order as
+    `files`. Line endings are preserved and non UTF-8 files are skipped.
+    """
+
+    def read(file: str) -> Optional[str]:
+        try:
+            with open(file, "r", encoding="utf-8", newline="") as f:
+                return f.read()
+        except (OSError, UnicodeDecodeError) as ex:
+            logging.warning(f"Skip file {file}: {ex}")
+            return None
+
+    files = list(files)
+    with ThreadPoolExecutor() as executor:
+        for i, (file, content) in enumerate(zip(files, executor.map(read, files))):
+            if on_progress is not None and i % 20 == 0:
+                on_progress("searching (%d/%d)" % (i + 1, len(files)))
+            if content is not None:
+                yield file, content
+
+
+class BulkEdit:
+    """
+    A set of file rewrites and renames that are applied as one transaction.
+
+    New file contents are staged in temp files next to the target files, so
+    that nothing is changed if staging fails. Before the staged files are
+    committed with atomic renames, a journal with backups of the original files
+    is written to the data dir. An interrupted commit is completed or rolled
+    back on the next bulk edit, and the last committed bulk edit can be undone.
+    """
+
+    def __init__(self):
+        # File path -> (original content, new content)
+        self.__writes: Dict[str, Tuple[bytes, bytes]] = {}
+        # (source path, destination path), applied after all writes.
+        self.__renames: List[Tuple[str, str]] = []
+
+    def is_empty(self) -> bool:
+        return not self.__writes and not self.__renames
+
+    def get_files_to_write(self) -> List[str]:
+        return list(self.__writes.keys())
+
+    def write(self, file: str, content: str):
+        if file in self.__writes:
+            old_data = self.__writes[file][0]
+        else:
+            with open(file, "rb") as f:
+                old_data = f.read()
+
+        data = content.encode("utf-8")
+        if data == old_data:
+            self.__writes.pop(file, None)
+        else:
+            self.__writes[file] = (old_data, data)
+
+    def rename(self, src: str, dst: str):
+        if os.path.exists(dst):
+            raise FileExistsError(f'Destination already exists: "{dst}"')
+        self.__renames.append((src, dst))
+
+    def replace_str(
+        self,
+        old: str,
+        new: str,
+        files: Iterable[str],
+        on_progress: Optional[Callable[[str], None]] = None,
+    ):
+        """Replace all occurrences of `old` with `new` in `files`."""
+        for file, content in read_text_files(files, on_progress=on_progress):
+            if old in content:
+                self.write(file, content.replace(old, new))
+
+    def get_diff(self) -> List[str]:
+        """Returns the unified diff of all changes without applying them."""
+        lines: List[str] = []
+        for file, (old_data, data) in self.__writes.items():
+            lines.extend(
+                line.rstrip("\r\n")
+                for line in difflib.unified_diff(
+                    old_data.decode("utf-8", errors="replace").splitlines(),
+                    data.decode("utf-8", errors="replace").splitlines(),
+                    fromfile=file,
+                    tofile=file,
+                    lineterm="",
+                )
+            )
+        for src, dst in self.__renames:
+            lines.append(f"rename {src} => {dst}")
+        return lines
+
+    def commit(self):
+        recover_bulk_edit()
+        if self.is_empty():
+            return
+
+        # Stage all new contents first, nothing is changed if this fails.
+        staged_files: List[str] = []
+        try:
+            for file, (_, data) in self.__writes.items():
+                tmp_file = file + _STAGED_FILE_SUFFIX
+                staged_files.append(tmp_file)
+                with open(tmp_file, "wb") as f:
+                    f.write(data)
+                shutil.copymode(file, tmp_file)
+
+            # Back up the original contents and write the journal.
+            backup_dir = _get_backup_dir()
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            os.makedirs(backup_dir)
+            writes = []
+            for i, (file, (old_data, data)) in enumerate(self.__writes.items()):
+                with open(os.path.join(backup_dir, str(i)), "wb") as f:
+                    f.write(old_data)
+                writes.append([file, str(i), _get_hash(data), _get_hash(old_data)])
+            journal = {
+                "version": BULK_EDIT_JOURNAL_VERSION,
+                "state": "pending",
+                "writes": writes,
+                "renames": self.__renames,
+            }
+            _save_journal(journal)
+        except Exception:
+            for tmp_file in staged_files:
+                _remove_file(tmp_file)
+            raise
+
+        # Apply the changes, roll back if anything goes wrong.
+        try:
+            for file in self.__writes.keys():
+                os.replace(file + _STAGED_FILE_SUFFIX, file)
+            for src, dst in self.__renames:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.rename(src, dst)
+        except Exception:
+            _rollback(journal)
+            raise
+
+        journal["state"] = "committed"
+        _save_journal(journal)
+
+
+def _save_journal(journal):
+    journal_file = _get_journal_file()
+    tmp_file = journal_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(journal, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, journal_file)
+
+
+def _load_journal():
+    try:
+        with open(_get_journal_file(), "r", encoding="utf-8") as f:
+            journal = json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+
+    if journal.get("version") != BULK_EDIT_JOURNAL_VERSION:
+        return None
+    return journal
+
+
+def _remove_file(file: str):
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+
+
+def _get_written_files(journal) -> Dict[str, bool]:
+    """
+    Returns whether each written file has its new content (True) or still its
+    original content (False). Raises an exception without changing anything if
+    any file has neither, i.e. it has been modified since.
+    """
+    renamed_to = dict(journal["renames"])
+    written: Dict[str, bool] = {}
+    modified_files: List[str] = []
+    for file, _, hash, original_hash in journal["writes"]:
+        # Written files may have been renamed afterwards.
+        path = file
+        dst = renamed_to.get(file)
+        if dst is not None and not os.path.exists(file) and os.path.exists(dst):
+            path = dst
+
+        try:
+            with open(path, "rb") as f:
+                current_hash: Optional[str] = _get_hash(f.read())
+        except FileNotFoundError:
+            current_hash = None
+
+        if current_hash == hash:
+            written[file] = True
+        elif current_hash == original_hash:
+            written[file] = False
+        else:
+            modified_files.append(path)
+
+    if modified_files:
+        raise Exception(
+            "File has been modified since the bulk edit: "
+            + ", ".join(f'"{file}"' for file in modified_files)
+        )
+    return written
+
+
+def _rollback(journal):
+    written = _get_written_files(journal)
+
+    # Undo the renames first since files are written before they are renamed.
+    for src, dst in reversed(journal["renames"]):
+        if os.path.exists(dst) and not os.path.exists(src):
+            os.rename(dst, src)
+
+    backup_dir = _get_backup_dir()
+    for file, backup_name, _, _ in journal["writes"]:
+        _remove_file(file + _STAGED_FILE_SUFFIX)
+        # Files that have not been replaced yet are left untouched.
+        if written[file]:
+            with open(os.path.join(backup_dir, backup_name), "rb") as f:
+                _write_file_atomic(file, f.read())
+
+    _remove_file(_get_journal_file())
+    shutil.rmtree(backup_dir, ignore_errors=True)
+
+
+def _roll_forward(journal):
+    for file, _, _, _ in journal["writes"]:
+        _remove_file(file + _STAGED_FILE_SUFFIX)
+    for src, dst in journal["renames"]:
+        if os.path.exists(src) and not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+
+    journal["state"] = "committed"
+    _save_journal(journal)
+
+
+def recover_bulk_edit() -> bool:
+    """
+    Complete the last bulk edit if its commit has been interrupted after all
+    files have been written, and roll it back otherwise. Returns True if
+    anything has been recovered. Raises an exception without changing
+    anything if any file has been modified since.
+    """
+    journal = _load_journal()
+    if journal is None or journal["state"] != "pending":
+        return False
+
+    try:
+        written = _get_written_files(journal)
+    except Exception as ex:
+        raise Exception(
+            f"Cannot recover the interrupted bulk edit: {ex}. Remove"
+            f' "{_get_journal_file()}" to discard it.'
+        )
+
+    if all(written.values()):
+        logging.warning("Completing the interrupted bulk edit.")
+        _roll_forward(journal)
+    else:
+        logging.warning("Rolling back the interrupted bulk edit.")
+        _rollback(journal)
+    return True
+
+
+def get_last_bulk_edit_summary() -> Optional[str]:
+    journal = _load_journal()
+    if journal is None or journal["state"] != "committed":
+        return None
+
+    summary = "%d files modified" % len(journal["writes"])
+    for src, dst in journal["renames"]:
+        summary += f", {os.path.basename(src)} => {os.path.basename(dst)}"
+    return summary
+
+
+def undo_last_bulk_edit():
+    """
+    Restore all files changed by the last committed bulk edit. Raises an
+    exception if any of them has been changed since.
+    """
+    journal = _load_journal()
+    if journal is None or journal["state"] != "committed":
+        raise Exception("Nothing to undo.")
+
+    for src, dst in journal["renames"]:
+        if not os.path.exists(dst):
+            raise Exception(f'Cannot undo, file is missing: "{dst}"')
+        if os.path.exists(src):
+            raise Exception(f'Cannot undo, file already exists: "{src}"')
+
+    try:
+        _get_written_files(journal)
+    except Exception as ex:
+        raise Exception(f"Cannot undo: {ex}")
+
+    _rollback(journal)
@@ -5,11 +5,11 @@ import re
 import shutil
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from _bulkedit import BulkEdit, read_text_files, recover_bulk_edit
 from _editor import is_vscode_installed, open_code_editor, open_in_vscode
 from _script import (
     Script,
     get_absolute_script_path,
-    get_all_scripts,
     get_data_dir,
     get_default_script_config,
     get_my_script_root,
@@ -22,6 +22,7 @@ from _script import (
 )
 from _shutil import load_yaml, quote_arg, save_yaml
 from _template import render_template_file
+from _trigramindex import find_scripts_containing
 from utils.clip import set_clip
 from utils.menu import Menu
 from utils.menu.dictedit import DictEditMenu
@@ -281,34 +282,26 @@ def replace_script_str(
     if not dry_run and matched_files is not None:
         files = matched_files
     else:
-        files = list(get_all_scripts())
-
-    for i, file in enumerate(files):
         if on_progress is not None:
-            if i % 20 == 0:
-                on_progress("searching (%d/%d)" % (i + 1, len(files)))
+            on_progress("updating index...")
+        files = find_scripts_containing(old)
 
-        with open(file, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
+    if not dry_run:
+        # All files are rewritten in one transaction.
+        bulk_edit = BulkEdit()
+        bulk_edit.replace_str(old, new, files=files, on_progress=on_progress)
+        bulk_edit.commit()
+        return modified_lines
 
-        dirty = False
-        for i, line in enumerate(lines):
-            if old in line:
-                if dry_run:
-                    modified_lines.append(
-                        (get_relative_script_path(file), i + 1, lines[i])
-                    )
-                else:
-                    lines[i] = line.replace(old, new)
-                dirty = True
+    for file, content in read_text_files(files, on_progress=on_progress):
+        if old not in content:
+            continue
 
-        if dirty:
-            if matched_files is not None:
-                matched_files.append(file)
-            if not dry_run:
-                s = "\n".join(lines)
-                with open(file, "w", encoding="utf-8") as f:
-                    f.write(s)
+        for i, line in enumerate(content.splitlines()):
+            if old in line:
+                modified_lines.append((get_relative_script_path(file), i + 1, line))
+        if matched_files is not None:
+            matched_files.append(file)
 
     return modified_lines
 
@@ -318,6 +311,9 @@ def rename_script(
     on_progress: Optional[Callable[[str], None]] = None,
     replace_all_occurrence: bool = False,
 ):
+    # Roll back the last rename if it has been interrupted.
+    recover_bulk_edit()
+
     script_rel_path = get_relative_script_path(script_full_path)
 
     matched_files: List[str] = []
@@ -338,20 +334,32 @@ def rename_script(
     if not new_script_rel_path:
         return False
 
+    bulk_edit = BulkEdit()
+
+    # Replace script string
+    if replace_all_occurrence:
+        bulk_edit.replace_str(
+            script_rel_path,
+            new_script_rel_path,
+            files=matched_files,
+            on_progress=on_progress,
+        )
+
     # Rename script
     new_script_full_path = get_absolute_script_path(new_script_rel_path)
-    os.makedirs(os.path.dirname(new_script_full_path), exist_ok=True)
-    os.rename(script_full_path, new_script_full_path)
+    bulk_edit.rename(script_full_path, new_script_full_path)
 
     # Rename config file if any
     config_file = get_script_config_file_path(script_full_path)
     new_config_file = get_script_config_file_path(new_script_full_path)
     if os.path.exists(config_file):
-        os.rename(config_file, new_config_file)
+        bulk_edit.rename(config_file, new_config_file)
 
-    # Replace script string
-    if replace_all_occurrence:
-        replace_script_str(
-            script_rel_path, new_script_rel_path, matched_files=matched_files
-        )
+    if bulk_edit.get_files_to_write():
+        w = Menu(prompt="apply changes", items=bulk_edit.get_diff())
+        w.exec()
+        if w.is_cancelled:
+            return False
+
+    bulk_edit.commit()
     return True
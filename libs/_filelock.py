@@ -1,53 +1,177 @@
+import bisect
+import logging
 import os
 import sys
 import tempfile
+import threading
 import time
+from typing import IO, Dict, List, Optional, Union
+
+# Upper bounds (in milliseconds) of the buckets of the lock time histograms.
+_HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000]
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_HISTOGRAM_BUCKETS_MS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, secs: float):
+        ms = secs * 1000
+        self.counts[bisect.bisect_left(_HISTOGRAM_BUCKETS_MS, ms)] += 1
+        self.total += secs
+        self.max = max(self.max, secs)
+
+    def __str__(self) -> str:
+        n = sum(self.counts)
+        if n == 0:
+            return "n=0"
+
+        buckets: List[str] = []
+        for i, count in enumerate(self.counts):
+            if count > 0:
+                bound = (
+                    f"<={_HISTOGRAM_BUCKETS_MS[i]}ms"
+                    if i < len(_HISTOGRAM_BUCKETS_MS)
+                    else f">{_HISTOGRAM_BUCKETS_MS[-1]}ms"
+                )
+                buckets.append(f"{bound}:{count}")
+        return "n=%d avg=%.1fms max=%.1fms [%s]" % (
+            n,
+            self.total / n * 1000,
+            self.max * 1000,
+            " ".join(buckets),
+        )
+
+
+class _LockStats:
+    def __init__(self) -> None:
+        self.wait_time = _Histogram()
+        self.hold_time = _Histogram()
+        self.timeouts = 0
+
+
+_lock_stats: Dict[str, _LockStats] = {}
+_lock_stats_lock = threading.Lock()
+
+
+def _get_lock_stats(name: str) -> _LockStats:
+    with _lock_stats_lock:
+        if name not in _lock_stats:
+            _lock_stats[name] = _LockStats()
+        return _lock_stats[name]
+
+
+def dump_lock_stats(level=logging.INFO):
+    """Write the wait and hold time histograms of all file locks to the log."""
+    with _lock_stats_lock:
+        for name, stats in sorted(_lock_stats.items()):
+            logging.log(level, f"FileLock({name}): wait: {stats.wait_time}")
+            logging.log(level, f"FileLock({name}): hold: {stats.hold_time}")
+            if stats.timeouts:
+                logging.log(level, f"FileLock({name}): timeouts: {stats.timeouts}")
 
 
 class FileLock:
-    def __init__(self, name) -> None:
-        self.fh = None
+    """
+    Inter-process lock backed by a file in the temp dir.
+
+    On Linux and macOS the lock blocks in the kernel until it is acquired, and
+    can be held in shared mode by multiple readers at the same time. If
+    `timeout` (in seconds) is specified, TimeoutError is raised when the lock
+    cannot be acquired in time.
+    """
+
+    def __init__(self, name, shared=False, timeout: Optional[float] = None) -> None:
+        # File descriptor on Windows, file object otherwise.
+        self.fh: Optional[Union[int, IO[str]]] = None
         self.name = name
+        self.shared = shared
+        self.timeout = timeout
+        self.__acquired_time = 0.0
 
     def __enter__(self):
-        while True:
-            lock_file = os.path.join(tempfile.gettempdir(), "filelock_%s" % self.name)
-            if sys.platform == "win32":
-                try:
-                    if os.path.exists(lock_file):
-                        os.remove(lock_file)
-                    self.fh = os.open(
-                        lock_file,
-                        os.O_CREAT  # create file if not exists
-                        | os.O_EXCL
-                        | os.O_RDWR,  # open for read and write
-                    )
-                    break
-                except FileExistsError:
-                    time.sleep(0.1)
-                except EnvironmentError as err:
-                    if err.errno == 13:
-                        time.sleep(0.1)
-                    else:
-                        raise
+        lock_file = os.path.join(tempfile.gettempdir(), "filelock_%s" % self.name)
+        stats = _get_lock_stats(self.name)
 
+        start_time = time.time()
+        try:
+            if sys.platform == "win32":
+                self.__lock_win(lock_file, start_time)
             else:
-                import fcntl
-
-                try:
-                    self.fh = open(lock_file, "w")
-                    fcntl.lockf(self.fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    break
-                except EnvironmentError as err:
-                    if self.fh is not None:
-                        time.sleep(0.1)
-                    else:
-                        raise
+                self.__lock_posix(lock_file, start_time)
+        except TimeoutError:
+            with _lock_stats_lock:
+                stats.timeouts += 1
+            raise
 
+        self.__acquired_time = time.time()
+        with _lock_stats_lock:
+            stats.wait_time.add(self.__acquired_time - start_time)
         return self.fh
 
+    def __wait(self, start_time: float, delay: float) -> float:
+        # Exponential backoff capped at 100ms, used where the lock cannot block
+        # in the kernel.
+        if self.timeout is not None and time.time() - start_time > self.timeout:
+            raise TimeoutError(f'Timed out waiting for file lock "{self.name}".')
+        time.sleep(delay)
+        return min(delay * 2, 0.1)
+
+    def __lock_win(self, lock_file: str, start_time: float):
+        delay = 0.001
+        while True:
+            try:
+                if os.path.exists(lock_file):
+                    os.remove(lock_file)
+                self.fh = os.open(
+                    lock_file,
+                    os.O_CREAT  # create file if not exists
+                    | os.O_EXCL
+                    | os.O_RDWR,  # open for read and write
+                )
+                return
+            except FileExistsError:
+                delay = self.__wait(start_time, delay)
+            except EnvironmentError as err:
+                if err.errno == 13:
+                    delay = self.__wait(start_time, delay)
+                else:
+                    raise
+
+    def __lock_posix(self, lock_file: str, start_time: float):
+        import fcntl
+
+        fh = open(lock_file, "a+")
+        self.fh = fh
+        op = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        try:
+            if self.timeout is None:
+                # Block in the kernel until the lock is released.
+                fcntl.flock(fh, op)
+            else:
+                delay = 0.001
+                while True:
+                    try:
+                        fcntl.flock(fh, op | fcntl.LOCK_NB)
+                        return
+                    except BlockingIOError:
+                        delay = self.__wait(start_time, delay)
+        except BaseException:
+            fh.close()
+            self.fh = None
+            raise
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if sys.platform == "win32":
+        hold_time = time.time() - self.__acquired_time
+        assert self.fh is not None
+        if isinstance(self.fh, int):
             os.close(self.fh)
         else:
             self.fh.close()
+        self.fh = None
+
+        stats = _get_lock_stats(self.name)
+        with _lock_stats_lock:
+            stats.hold_time.add(hold_time)
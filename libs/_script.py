@@ -1,10 +1,8 @@
-import ctypes
 import glob
 import json
 import locale
 import logging
 import os
-import platform
 import re
 import shlex
 import shutil
@@ -13,18 +11,21 @@ import sys
 import tempfile
 import threading
 import time
-from dataclasses import dataclass
 from enum import IntEnum
 from functools import lru_cache
-from pathlib import Path
-from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
-
-import yaml
-from _android import setup_android_env
-from _cpp import setup_cmake
-from _editor import open_code_editor
-from _filelock import FileLock
-from _pkgmanager import require_package
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
 from _shutil import (
     CONEMU_INSTALL_DIR,
     IgnoreSigInt,
@@ -52,12 +53,10 @@ from _shutil import (
     wrap_args_conemu,
     write_temp_file,
 )
-from _template import render_template
-from utils.clip import get_clip, get_selection
-from utils.term.alacritty import is_alacritty_installed, wrap_args_alacritty
+from _variablestore import VariableStore
+from utils.multiregex import compile_pattern
 from utils.timed import timed
 from utils.tmux import is_in_tmux
-from utils.venv import activate_python_venv, get_venv_python_executable
 
 SCRIPT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
@@ -90,6 +89,18 @@ if sys.platform == "win32":
 
 VARIABLE_NAME_EXCLUDE = {"HOME", "PATH"}
 
+_VARIABLE_NAME_PATT = re.compile(r"\b([A-Z_$][A-Z_$0-9]{5,})\b")
+# Search all environmental variable names using regular expressions.
+# For example: "env: ENV_VAR_NAME".
+_ENV_VARIABLE_NAME_PATT = re.compile("env: " + _VARIABLE_NAME_PATT.pattern)
+
+# Rendering changes the working directory of the whole process, and scheduled
+# scripts are rendered on worker threads.
+_render_lock = threading.RLock()
+
+# Script path -> (mtime, variable names found in the script file)
+_variable_names_cache: Dict[str, Tuple[float, List[str]]] = {}
+
 
 class BackgroundProcessOutputType(IntEnum):
     LOG_PIPE = 1
@@ -137,6 +148,8 @@ def get_data_dir() -> str:
                 )
 
     else:
+        import platform
+
         data_dir = os.path.abspath("%s/../tmp/data/%s" % (SCRIPT_ROOT, platform.node()))
     os.makedirs(data_dir, exist_ok=True)
     return data_dir
@@ -163,8 +176,7 @@ def get_script_dirs_config_file():
     return config_json_file
 
 
-@dataclass
-class ScriptDirectory:
+class ScriptDirectory(NamedTuple):
     name: str
     path: str  # absolute path of script directory
 
@@ -366,45 +378,24 @@ def get_variable_file():
     return variable_file_v2
 
 
-def get_all_variables() -> Dict[str, str]:
-    file = get_variable_file()
+@lru_cache(maxsize=None)
+def get_variable_store() -> VariableStore:
+    return VariableStore(get_variable_file())
 
-    with FileLock("access_variable"):
-        if not os.path.exists(file):
-            return {}
 
-        with open(file, "r", encoding="utf-8") as f:
-            return json.load(f)
+def get_all_variables() -> Dict[str, str]:
+    return get_variable_store().get_all()
 
 
 def get_variable(name):
-    with FileLock("access_variable"):
-        f = get_variable_file()
-        if not os.path.exists(f):
-            return
-
-        with open(get_variable_file(), "r") as f:
-            variables = json.load(f)
-
-        if name not in variables:
-            return
-
-        return variables[name]
+    return get_variable_store().get(name)
 
 
 def set_variable(name: str, val: str, set_env_var=True):
     logging.debug("set variable: %s=%s" % (name, val))
     assert val is not None
 
-    with FileLock("access_variable"):
-        file = get_variable_file()
-        with open(file, "r", encoding="utf-8") as f:
-            variables = json.load(f)
-
-        variables[name] = val
-
-        with open(file, "w", encoding="utf-8") as f:
-            json.dump(variables, f, indent=2)
+    get_variable_store().update({name: val})
 
     if set_env_var:
         os.environ[name] = val
@@ -416,11 +407,7 @@ def set_variable_value(variables: Dict[str, str], name: str, value: str):
 
 
 def update_variables(variables: Dict[str, str]):
-    config_file = get_variable_file()
-    with FileLock("access_variable"):
-        data = load_json(config_file, default={})
-        data.update(variables)
-        save_json(config_file, data)
+    get_variable_store().update(variables)
 
 
 def read_setting(setting, name, val):
@@ -466,7 +453,9 @@ def input2(message, name):
 def get_python_path(script_path=None):
     python_path = []
 
-    script_root = str(Path(__file__).resolve().parent.parent / "scripts")
+    script_root = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "scripts"
+    )
     python_path.append(script_root)
     python_path.append(os.path.join(script_root, "r"))
 
@@ -667,8 +656,34 @@ class LogPipe(threading.Thread):
 
 
 class Script:
-    def __init__(self, script_path: str, name=None):
-        if not os.path.isfile(script_path):
+    # There can be thousands of scripts, keep them compact.
+    __slots__ = (
+        "cfg",
+        "console_title",
+        "ext",
+        "mtime",
+        "name",
+        "override_variables",
+        "ps",
+        "real_ext",
+        "real_script_path",
+        "script_path",
+        "script_rel_path",
+        "variable_names",
+    )
+
+    def __init__(
+        self,
+        script_path: str,
+        name=None,
+        mtime: Optional[float] = None,
+        cfg: Optional["ScriptConfig"] = None,
+        variable_names: Optional[List[str]] = None,
+    ):
+        # `mtime` and `cfg` are provided when the script is restored from the
+        # script index, in which case the script file is not accessed at all.
+        restored = mtime is not None and cfg is not None
+        if not restored and not os.path.isfile(script_path):
             raise Exception("Script file does not exist.")
 
         script_path = os.path.abspath(script_path)
@@ -700,12 +715,21 @@ class Script:
             self.real_script_path = None
             self.real_ext = None
 
-        self.mtime = 0.0
-        self.refresh_script()
+        if mtime is not None and cfg is not None:
+            self.mtime: float = mtime
+            self.cfg: "ScriptConfig" = cfg
+            self.variable_names = variable_names
+        else:
+            self.mtime = 0.0
+            self.variable_names = None
+            self.refresh_script()
 
     def match_pattern(self, text: str):
         patt = self.cfg["matchClipboard"]
-        return patt and re.search(patt, text) is not None
+        if not patt:
+            return False
+        regex = compile_pattern(patt)
+        return regex is not None and regex.search(text) is not None
 
     def is_running(self) -> bool:
         return self.ps is not None and self.ps.poll() is None
@@ -716,20 +740,13 @@ class Script:
     def refresh_script(self) -> bool:
         assert self.script_path
 
-        mtime = os.path.getmtime(self.script_path)
-
-        script_config_file = get_script_config_file(self.script_path)
-        if script_config_file:
-            mtime = max(mtime, os.path.getmtime(script_config_file))
-        default_script_config_file = get_default_script_config_path(self.script_path)
-        if os.path.exists(default_script_config_file):
-            mtime = max(mtime, os.path.getmtime(default_script_config_file))
-
+        mtime = get_script_mtime(self.script_path)
         if mtime > self.mtime:
             self.mtime = mtime
 
             # Reload script config
             self.cfg = self.load_config()
+            self.variable_names = None
 
             return True
         else:
@@ -800,16 +817,18 @@ class Script:
         if source is None:
             source = self.get_script_source()
 
-        cwd = os.getcwd()
+        from _template import render_template
+
         script_path = self.get_script_path()
         script_dir = os.path.dirname(script_path)
-        if script_dir:
-            os.chdir(script_dir)
-
-        result = render_template(source, variables, file_locator=find_script)
-
-        os.chdir(cwd)
-        return result
+        with _render_lock:
+            cwd = os.getcwd()
+            if script_dir:
+                os.chdir(script_dir)
+            try:
+                return render_template(source, variables, file_locator=find_script)
+            finally:
+                os.chdir(cwd)
 
     def set_override_variables(self, variables):
         self.override_variables = variables
@@ -988,6 +1007,8 @@ class Script:
         logging.debug(f"close_on_exit={close_on_exit}")
 
         if ext == ".md" or ext == ".txt":
+            from _editor import open_code_editor
+
             open_code_editor(script_path)
             return True
 
@@ -1000,6 +1021,8 @@ class Script:
                 arg_list += self.cfg["args"].split()
 
             if self.cfg["args.passSelectionAsFile"]:
+                from utils.clip import get_selection
+
                 selection = get_selection()
                 temp_file = write_temp_file(selection, ".txt")
                 arg_list.append(temp_file)
@@ -1013,14 +1036,20 @@ class Script:
                 arg_list.append(text)
 
             elif self.cfg["args.passSelection"]:
+                from utils.clip import get_selection
+
                 selection = get_selection()
                 arg_list.append(selection)
 
             elif self.cfg["args.passClipboard"]:
+                from utils.clip import get_clip
+
                 clipboard = get_clip()
                 arg_list.append(clipboard)
 
             elif self.cfg["args.passClipboardAsFile"]:
+                from utils.clip import get_clip
+
                 clipboard = get_clip()
                 temp_file = write_temp_file(clipboard, ".txt")
                 arg_list.append(temp_file)
@@ -1058,6 +1087,8 @@ class Script:
         use_shell_execute_win32 = False
 
         if self.cfg["adk"]:
+            from _android import setup_android_env
+
             setup_android_env(
                 env=env,
                 jdk_version=self.cfg["adk.jdk_version"],
@@ -1067,6 +1098,8 @@ class Script:
             )
 
         if self.cfg["cmake"]:
+            from _cpp import setup_cmake
+
             setup_cmake(env=env, cmake_version=self.cfg["cmake.version"])
 
         setup_env_var(env)
@@ -1235,6 +1268,8 @@ class Script:
 
         elif ext == ".py" or ext == ".ipynb":
             if self.cfg["venv.name"]:
+                from utils.venv import get_venv_python_executable
+
                 python_exec = get_venv_python_executable(self.cfg["venv.name"])
             else:
                 python_exec = sys.executable
@@ -1370,6 +1405,8 @@ class Script:
 
         # venv
         if self.cfg["venv.name"]:
+            from utils.venv import activate_python_venv
+
             activate_python_venv(self.cfg["venv.name"], env)
         else:
             # If Python is running in a virtual environment (venv), ensure that the
@@ -1378,6 +1415,8 @@ class Script:
 
         # Install dependant packages
         if self.cfg["packages"]:
+            from _pkgmanager import require_package
+
             packages = self.cfg["packages"].split()
             for pkg in packages:
                 require_package(pkg, wsl=self.cfg["wsl"], env=env)
@@ -1507,6 +1546,8 @@ class Script:
                         elif self.cfg["terminal"] == "alacritty" and shutil.which(
                             "alacritty"
                         ):
+                            from utils.term.alacritty import wrap_args_alacritty
+
                             arg_list = wrap_args_alacritty(
                                 arg_list,
                                 title=self.get_window_title(),
@@ -1609,10 +1650,11 @@ class Script:
                                 no_wait = True
                                 open_in_terminal = True
 
-                            elif (
-                                term_emulator == "alacritty"
-                                and is_alacritty_installed()
+                            elif term_emulator == "alacritty" and shutil.which(
+                                "alacritty"
                             ):
+                                from utils.term.alacritty import wrap_args_alacritty
+
                                 arg_list = wrap_args_alacritty(
                                     arg_list,
                                     title=self.get_window_title(),
@@ -1653,6 +1695,8 @@ class Script:
                     popen_extra_args["start_new_session"] = True
 
             if sys.platform == "win32" and use_shell_execute_win32:
+                import ctypes
+
                 SW_SHOWNORMAL = 1
                 lpParameters = _args_to_str(arg_list[1:], shell_type="cmd")
                 logging.debug(
@@ -1726,19 +1770,14 @@ class Script:
             return True
 
     def get_variable_names(self) -> List[str]:
-        VARIABLE_NAME_PATT = r"\b([A-Z_$][A-Z_$0-9]{5,})\b"
+        if self.variable_names is None:
+            self.variable_names = self._parse_variable_names()
+        return self.variable_names
+
+    def _parse_variable_names(self) -> List[str]:
         if self.cfg["variableNames"] == "auto":
             if self.ext in SCRIPT_EXTENSIONS:
-                with open(self.script_path, "r", encoding="utf-8") as f:
-                    s = f.read()
-
-                    # Search all environmental variable names using regular expressions.
-                    # For example: "env: ENV_VAR_NAME".
-                    variable_names = re.findall("env: " + VARIABLE_NAME_PATT, s)
-
-                    # Fallback to matching all uppercase names.
-                    if len(variable_names) == 0:
-                        variable_names = re.findall(VARIABLE_NAME_PATT, s)
+                variable_names = _get_variable_names_in_file(self.script_path)
             else:
                 return []
         else:
@@ -1765,6 +1804,46 @@ class Script:
         update_json(config_file, {self.script_path: time.time()})
 
 
+def _get_variable_names_in_file(file: str) -> List[str]:
+    mtime = os.path.getmtime(file)
+    cached = _variable_names_cache.get(file)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(file, "r", encoding="utf-8") as f:
+        s = f.read()
+
+    variable_names = _ENV_VARIABLE_NAME_PATT.findall(s)
+
+    # Fallback to matching all uppercase names.
+    if len(variable_names) == 0:
+        variable_names = _VARIABLE_NAME_PATT.findall(s)
+
+    _variable_names_cache[file] = (mtime, variable_names)
+    return variable_names
+
+
+def update_variable_names(scripts: List[Script]):
+    """
+    Extract the variable names of all scripts in one pass, so that
+    `Script.get_variable_names()` does not need to read any file afterwards.
+    This is meant to be run on a background thread.
+    """
+    for script in scripts:
+        if script.variable_names is not None:
+            continue
+
+        mtime = script.mtime
+        try:
+            variable_names = script._parse_variable_names()
+        except (OSError, UnicodeDecodeError):
+            continue
+
+        # Discard the result if the script has been reloaded in the meantime.
+        if script.mtime == mtime:
+            script.variable_names = variable_names
+
+
 def get_script_variables(script: Script) -> Dict[str, str]:
     all_variables = get_all_variables()
     script_variables: Dict[str, str] = {}
@@ -1849,6 +1928,8 @@ def start_script(
 
     # Set console window title (for windows only)
     if console_title and sys.platform == "win32":
+        import ctypes
+
         # Save previous title
         MAX_BUFFER = 260
         saved_title = (ctypes.c_char * MAX_BUFFER)()
@@ -1905,51 +1986,106 @@ def run_script(
 
 
 def get_default_script_config() -> Dict[str, Any]:
-    return {
-        "adk.jdk_version": "",
-        "adk": False,
-        "args.passClipboard": False,
-        "args.passClipboardAsFile": False,
-        "args.passSelectedDir": False,
-        "args.passSelectedFile": False,
-        "args.passSelection": False,
-        "args.passSelectionAsFile": False,
-        "args.passUserInput": False,
-        "args": "",
-        "autoRun": False,
-        "background": False,
-        "closeOnExit": True,
-        "cmake.version": "",
-        "cmake": False,
-        "cmdline": "",
-        "commandWrapper": True,
-        "conda": "",
-        "globalHotkey": "",
-        "hotkey": "",
-        "matchClipboard": "",
-        "minimized": False,
-        "msys2": False,
-        "newWindow": True,
-        "packages.pip": "",
-        "packages": "",
-        "reloadScriptsAfterRun": False,
-        "restartInstance": False,
-        "runAsAdmin": False,
-        "runAtStartup": False,
-        "runEveryNSec": "",
-        "runpy": True,
-        "singleInstance": True,
-        "tee": False,
-        "template": None,
-        "terminal": "alacritty",
-        "title": "",
-        "updateSelectedScriptAccessTime": False,
-        "variableNames": "auto",
-        "venv.name": "",
-        "webApp": False,
-        "workingDir": "",
-        "wsl": False,
-    }
+    return _DEFAULT_SCRIPT_CONFIG.copy()
+
+
+class ScriptConfig(Mapping[str, Any]):
+    """
+    Config of a script: its own overrides on top of the defaults, which are
+    shared by all scripts in the same folder instead of being copied into each
+    script. Setting a value overrides it for this script only.
+    """
+
+    __slots__ = ("overrides", "defaults", "__owns_overrides")
+
+    def __init__(
+        self,
+        overrides: Optional[Dict[str, Any]] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+    ):
+        self.overrides = overrides if overrides else _NO_OVERRIDES
+        self.defaults = defaults if defaults is not None else _DEFAULT_SCRIPT_CONFIG
+        self.__owns_overrides = False
+
+    def __setitem__(self, key: str, value: Any):
+        # The overrides may be shared with the config file cache, copy them
+        # before the first change.
+        if not self.__owns_overrides:
+            self.overrides = dict(self.overrides)
+            self.__owns_overrides = True
+        self.overrides[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        overrides = self.overrides
+        if key in overrides:
+            return overrides[key]
+        return self.defaults[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.defaults
+        for key in self.overrides:
+            if key not in self.defaults:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self.defaults) + sum(
+            1 for key in self.overrides if key not in self.defaults
+        )
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+_NO_OVERRIDES: Dict[str, Any] = {}
+
+
+_DEFAULT_SCRIPT_CONFIG: Dict[str, Any] = {
+    "adk.jdk_version": "",
+    "adk": False,
+    "args.passClipboard": False,
+    "args.passClipboardAsFile": False,
+    "args.passSelectedDir": False,
+    "args.passSelectedFile": False,
+    "args.passSelection": False,
+    "args.passSelectionAsFile": False,
+    "args.passUserInput": False,
+    "args": "",
+    "autoRun": False,
+    "background": False,
+    "closeOnExit": True,
+    "cmake.version": "",
+    "cmake": False,
+    "cmdline": "",
+    "commandWrapper": True,
+    "conda": "",
+    "globalHotkey": "",
+    "hotkey": "",
+    "matchClipboard": "",
+    "minimized": False,
+    "msys2": False,
+    "newWindow": True,
+    "packages.pip": "",
+    "packages": "",
+    "reloadScriptsAfterRun": False,
+    "restartInstance": False,
+    "runAsAdmin": False,
+    "runAtStartup": False,
+    "runEveryNSec": "",
+    "runpy": True,
+    "schedule.catchUp": "once",
+    "schedule": "",
+    "singleInstance": True,
+    "tee": False,
+    "template": None,
+    "terminal": "alacritty",
+    "title": "",
+    "updateSelectedScriptAccessTime": False,
+    "variableNames": "auto",
+    "venv.name": "",
+    "webApp": False,
+    "workingDir": "",
+    "wsl": False,
+}
 
 
 def get_script_config_file_path(script_path: str) -> str:
@@ -1960,14 +2096,131 @@ def get_default_script_config_path(script_path: str) -> str:
     return os.path.join(os.path.dirname(script_path), "default.config.yaml")
 
 
-def get_script_folder_level_config(script_path: str) -> Optional[Dict[str, Any]]:
-    config_file_path = get_default_script_config_path(script_path)
-    if os.path.exists(config_file_path):
-        with open(config_file_path, "r") as f:
-            return yaml.load(f.read(), Loader=yaml.FullLoader)
+def _load_yaml_config(s: str) -> Any:
+    import yaml
+
+    # Use the C-accelerated YAML loader if PyYAML is built with libyaml.
+    return yaml.load(s, Loader=getattr(yaml, "CFullLoader", yaml.FullLoader))
+
+
+# Config file path -> (mtime, parsed config)
+_config_file_cache: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+# Folder path -> (mtime of "default.config.yaml", default config merged with the
+# folder-level config)
+_folder_config_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+_persistent_config_cache: Optional[Dict[str, Any]] = None
+_persistent_config_cache_dirty = False
+
+script_config_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def _get_script_config_cache_file() -> str:
+    return os.path.join(get_data_dir(), "script_config_cache.json")
+
+
+def load_script_config_cache():
+    """
+    Load the precompiled config cache from the data dir, so that the config
+    files that have not been modified since are not parsed again.
+    """
+    global _persistent_config_cache
+
+    if _persistent_config_cache is None:
+        _persistent_config_cache = load_json(
+            _get_script_config_cache_file(), default={}
+        )
+
+
+def save_script_config_cache():
+    global _persistent_config_cache_dirty
+
+    if _persistent_config_cache is None or not _persistent_config_cache_dirty:
+        return
+
+    # Forget about the config files that have been removed.
+    data = {k: v for k, v in _persistent_config_cache.items() if os.path.exists(k)}
+    tmp_file = _get_script_config_cache_file() + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_file, _get_script_config_cache_file())
+    _persistent_config_cache_dirty = False
+
+
+def is_json_safe(value: Any) -> bool:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return True
+    elif isinstance(value, list):
+        return all(is_json_safe(v) for v in value)
+    elif isinstance(value, dict):
+        return all(isinstance(k, str) and is_json_safe(v) for k, v in value.items())
     else:
+        return False
+
+
+def _load_config_file(file: str) -> Optional[Dict[str, Any]]:
+    global _persistent_config_cache_dirty
+
+    try:
+        mtime = os.path.getmtime(file)
+    except FileNotFoundError:
+        _config_file_cache.pop(file, None)
         return None
 
+    cached = _config_file_cache.get(file)
+    if cached is not None and cached[0] == mtime:
+        script_config_cache_stats["hits"] += 1
+        return cached[1]
+
+    if _persistent_config_cache is not None:
+        persistent_cached = _persistent_config_cache.get(file)
+        if persistent_cached is not None and persistent_cached["mtime"] == mtime:
+            script_config_cache_stats["hits"] += 1
+            _config_file_cache[file] = (mtime, persistent_cached["config"])
+            return persistent_cached["config"]
+
+    script_config_cache_stats["misses"] += 1
+    with open(file, "r") as f:
+        config = _load_yaml_config(f.read())
+    _config_file_cache[file] = (mtime, config)
+
+    # Configs that would not come back the same from JSON, e.g. with dates,
+    # tuples or non-string keys, are parsed every time.
+    if _persistent_config_cache is not None and is_json_safe(config):
+        _persistent_config_cache[file] = {"mtime": mtime, "config": config}
+        _persistent_config_cache_dirty = True
+
+    return config
+
+
+def get_script_folder_level_config(script_path: str) -> Optional[Dict[str, Any]]:
+    return _load_config_file(get_default_script_config_path(script_path))
+
+
+def _get_folder_config(script_path: str) -> Dict[str, Any]:
+    """
+    Returns the default config merged with the folder-level config, which is
+    shared by all scripts in the same folder and must not be modified.
+    """
+    config_file_path = get_default_script_config_path(script_path)
+    folder_level_config = _load_config_file(config_file_path)
+    mtime = (
+        _config_file_cache[config_file_path][0]
+        if folder_level_config is not None
+        else -1.0
+    )
+
+    folder = os.path.dirname(script_path)
+    cached = _folder_config_cache.get(folder)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    config = get_default_script_config()
+    if folder_level_config is not None:
+        config.update(folder_level_config)
+    _folder_config_cache[folder] = (mtime, config)
+    return config
+
 
 def get_script_config_file(script_path: str) -> Optional[str]:
     f = get_script_config_file_path(script_path)
@@ -1977,24 +2230,27 @@ def get_script_config_file(script_path: str) -> Optional[str]:
     return None
 
 
-def load_script_config(script_path) -> Dict[str, Any]:
-    # Load script default config.
-    config = get_default_script_config()
-
-    # Load script folder-level config.
-    folder_level_config = get_script_folder_level_config(script_path)
-    if folder_level_config is not None:
-        config.update(folder_level_config)
+def get_script_mtime(script_path: str) -> float:
+    """Latest mtime of the script file and its script- and folder-level configs."""
+    mtime = os.path.getmtime(script_path)
+    for config_file in (
+        get_script_config_file_path(script_path),
+        get_default_script_config_path(script_path),
+    ):
+        try:
+            mtime = max(mtime, os.path.getmtime(config_file))
+        except FileNotFoundError:
+            pass
+    return mtime
 
-    # Load the script-level config.
-    script_config_file = get_script_config_file(script_path)
-    if script_config_file:
-        with open(script_config_file, "r") as f:
-            script_level_config = yaml.load(f.read(), Loader=yaml.FullLoader)
-        if script_level_config is not None:
-            config.update(script_level_config)
 
-    return config
+def load_script_config(script_path) -> ScriptConfig:
+    # Script-level config on top of the default config overridden by the
+    # folder-level config, both of which are shared.
+    return ScriptConfig(
+        _load_config_file(get_script_config_file_path(script_path)),
+        _get_folder_config(script_path),
+    )
 
 
 def update_script_config(kvp, script_file):
@@ -2078,34 +2334,43 @@ def get_default_script_dir_config():
     return {"includeExts": ""}
 
 
-def get_scripts_recursive(directory, include_exts=[]) -> Iterator[str]:
+def get_script_dir_include_exts(directory) -> List[str]:
     dir_config = load_json(
         os.path.join(directory, script_dir_config_file),
         default=get_default_script_dir_config(),
     )
-    include_exts += dir_config["includeExts"].split()
+    return dir_config["includeExts"].split()
+
+
+def should_ignore_script_dir(
+    dir: str, file: str, dir_entries: Optional[Set[str]] = None
+) -> bool:
+    if (
+        file == "tmp"
+        or file == "generated"
+        or file == ".venv"
+        or file == "node_modules"
+    ):
+        return True
 
-    def should_ignore(dir, file):
-        if (
-            file == "tmp"
-            or file == "generated"
-            or file == ".venv"
-            or file == "node_modules"
-        ):
-            return True
+    # Ignore folder starting with `_`
+    if file.startswith("_"):
+        return True
 
-        # Ignore folder starting with `_`
-        if file.startswith("_"):
-            return True
+    # Ignore folder if `<folder>.ignore` exists
+    if dir_entries is not None:
+        return file + ".ignore" in dir_entries
+    elif os.path.exists(os.path.join(dir, file + ".ignore")):
+        return True
 
-        # Ignore folder if `<folder>.ignore` exists
-        if os.path.exists(os.path.join(dir, file + ".ignore")):
-            return True
+    return False
 
-        return False
+
+def get_scripts_recursive(directory, include_exts=[]) -> Iterator[str]:
+    include_exts += get_script_dir_include_exts(directory)
 
     for root, dirs, files in os.walk(directory, topdown=True):
-        dirs[:] = [d for d in dirs if not should_ignore(root, d)]
+        dirs[:] = [d for d in dirs if not should_ignore_script_dir(root, d)]
 
         for file in files:
             ext = os.path.splitext(file)[1].lower()
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from _script import (
+    SCRIPT_EXTENSIONS,
+    Script,
+    ScriptConfig,
+    get_data_dir,
+    get_default_script_config,
+    get_script_dir_include_exts,
+    get_script_directories,
+    get_script_mtime,
+    is_json_safe,
+    should_ignore_script_dir,
+)
+
+# Bump the version whenever the layout of the index file changes, so that stale
+# index files are discarded instead of being misinterpreted.
+SCRIPT_INDEX_VERSION = 1
+
+
+def get_script_index_file() -> str:
+    return os.path.join(get_data_dir(), "script_index.json")
+
+
+class ScriptIndex:
+    """
+    Persistent index of all scripts that lives in the data dir.
+
+    For each directory, the index keeps the directory mtime and its entries so
+    that unchanged directories do not need to be listed again. For each script,
+    it keeps the mtime, config overrides and variable names so that the script
+    list can be rebuilt on a cold start without touching individual files.
+    """
+
+    def __init__(self, index_file: Optional[str] = None):
+        self.index_file = index_file if index_file else get_script_index_file()
+
+        # Directory path -> {"mtime": float, "dirs": [str], "files": [str]}
+        self.__dirs: Dict[str, Dict[str, Any]] = {}
+        # Script path -> {"mtime": float, "cfg": {...}, "vars": [str] | None}
+        self.__scripts: Dict[str, Dict[str, Any]] = {}
+
+        # Directories that were (re-)listed during the last walk.
+        self.__changed_dirs: Set[str] = set()
+        self.__dirty = False
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return
+
+        if data.get("version") != SCRIPT_INDEX_VERSION:
+            logging.info("Script index version mismatch, rebuilding.")
+            return
+
+        self.__dirs = data["dirs"]
+        self.__scripts = data["scripts"]
+
+    def save(self):
+        if not self.__dirty:
+            return
+
+        # Write to a temp file first and atomically replace the index, so that
+        # a crash never leaves a partially written index behind.
+        tmp_file = self.index_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "version": SCRIPT_INDEX_VERSION,
+                        "dirs": self.__dirs,
+                        "scripts": self.__scripts,
+                    },
+                    f,
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_file, self.index_file)
+            self.__dirty = False
+        except (OSError, TypeError, ValueError) as ex:
+            # The index is only a cache, the scripts are loaded from the files
+            # until it can be written.
+            logging.warning(f"Failed to save script index: {ex}")
+        finally:
+            try:
+                os.remove(tmp_file)
+            except FileNotFoundError:
+                pass
+
+    def __list_dir(self, dir: str) -> Optional[Dict[str, Any]]:
+        try:
+            mtime = os.stat(dir).st_mtime
+        except FileNotFoundError:
+            return None
+
+        entry = self.__dirs.get(dir)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+
+        dirs: List[str] = []
+        files: List[str] = []
+        try:
+            with os.scandir(dir) as it:
+                for e in it:
+                    if e.is_dir():
+                        # Same as `os.walk()`, do not follow symlinks to
+                        # directories.
+                        if not e.is_symlink():
+                            dirs.append(e.name)
+                    else:
+                        files.append(e.name)
+        except OSError:
+            return None
+
+        entry = {"mtime": mtime, "dirs": sorted(dirs), "files": sorted(files)}
+        self.__dirs[dir] = entry
+        self.__changed_dirs.add(dir)
+        self.__dirty = True
+        return entry
+
+    def __get_scripts_recursive(
+        self, directory: str, visited_dirs: Set[str]
+    ) -> Iterator[str]:
+        include_exts = get_script_dir_include_exts(directory)
+
+        stack = [directory]
+        while stack:
+            root = stack.pop()
+            entry = self.__list_dir(root)
+            if entry is None:
+                continue
+            visited_dirs.add(root)
+
+            entries = set(entry["files"])
+            entries.update(entry["dirs"])
+            stack.extend(
+                os.path.join(root, d)
+                for d in reversed(entry["dirs"])
+                if not should_ignore_script_dir(root, d, dir_entries=entries)
+            )
+
+            for file in entry["files"]:
+                # Hide files starting with '_'
+                if file.startswith("_"):
+                    continue
+
+                ext = os.path.splitext(file)[1].lower()
+                if ext not in SCRIPT_EXTENSIONS and ext not in include_exts:
+                    continue
+
+                yield os.path.join(root, file)
+
+    def get_all_scripts(self) -> Iterator[str]:
+        """
+        Same as `_script.get_all_scripts()`, except that only the directories
+        whose mtime has changed since the last walk are listed again.
+        """
+        self.__changed_dirs.clear()
+
+        visited_dirs: Set[str] = set()
+        for d in get_script_directories():
+            yield from self.__get_scripts_recursive(d.path, visited_dirs)
+
+        # Forget about the directories that no longer exist.
+        for dir in list(self.__dirs.keys()):
+            if dir not in visited_dirs:
+                del self.__dirs[dir]
+                self.__dirty = True
+
+    def restore_script(self, script_path: str) -> Optional[Script]:
+        """
+        Rebuild the script from the index without reading the script file.
+        Returns None if the script is not indexed, or if its directory, the
+        script or its config files have changed since the index was written.
+        """
+        if os.path.dirname(script_path) in self.__changed_dirs:
+            return None
+
+        entry = self.__scripts.get(script_path)
+        if entry is None:
+            return None
+
+        # Files edited in place do not change the directory mtime.
+        try:
+            if get_script_mtime(script_path) > entry["mtime"]:
+                return None
+        except FileNotFoundError:
+            return None
+
+        return Script(
+            script_path,
+            mtime=entry["mtime"],
+            cfg=ScriptConfig(entry["cfg"]),
+            variable_names=entry["vars"],
+        )
+
+    def update_scripts(self, scripts: List[Script]):
+        default_config = get_default_script_config()
+
+        scripts_: Dict[str, Dict[str, Any]] = {}
+        for script in scripts:
+            cfg = {
+                k: v
+                for k, v in script.cfg.items()
+                if k not in default_config or default_config[k] != v
+            }
+            # Scripts whose config would not come back the same from JSON, e.g.
+            # with dates, are not indexed and are always loaded from the files.
+            if not is_json_safe(cfg):
+                continue
+
+            scripts_[script.script_path] = {
+                "mtime": script.mtime,
+                "cfg": cfg,
+                "vars": script.variable_names,
+            }
+
+        if scripts_ != self.__scripts:
+            self.__scripts = scripts_
+            self.__dirty = True
@@ -0,0 +1,390 @@
+"""
+Warm launcher for `bin/start_script.py` and `bin/run_script.py`.
+
+Starting a fresh interpreter for every hotkey press spends most of its time
+importing `_script` and its dependencies. The launcher service is a
+single-threaded process started by the myscripts daemon that imports them once
+and then forks a child per request, which runs the requested entry script with
+the caller's argv, environment, working directory and standard streams. The
+client only needs the standard library, and falls back to running the script
+itself whenever the service is not available.
+
+The forked process keeps the interpreter state of the service: its `sys.path`,
+its interpreter flags and the modules it has already imported. Requests from
+a different interpreter, with different flags or with different values of
+the environment variables in `_STARTUP_ENV_VARS` are rejected, and the client
+runs the script itself. Other state that the preloaded modules derive from the
+environment when they are imported is not compared.
+
+This module must not import anything outside of the standard library at the
+module level, since it is imported by the client before `_script`.
+"""
+
+import marshal
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional
+
+if TYPE_CHECKING:
+    import subprocess
+
+_HEADER = struct.Struct("I")
+
+# Set in the forked child, so that the entry script does not try to launch
+# itself again.
+_in_warm_process = False
+
+# Environment variables that are only read when the interpreter starts or when
+# the modules preloaded by the service are imported. They decide where modules
+# are imported from, so the forked process cannot pick up different values.
+_STARTUP_ENV_VARS = (
+    "PYTHONHOME",
+    "PYTHONNOUSERSITE",
+    "PYTHONPATH",
+    "PYTHONSAFEPATH",
+    "PYTHONUSERBASE",
+    "PYTHONUTF8",
+    "PYTHONWARNINGS",
+    # Read by `_shutil` when it is imported.
+    "_DEBUG",
+    "_LOG",
+)
+
+
+def _get_startup_env(env: Mapping[str, str]) -> List[Optional[str]]:
+    return [env.get(name) for name in _STARTUP_ENV_VARS]
+
+
+def _get_launcher_socket_dir() -> str:
+    # Unix socket paths are limited to about 100 characters, so the data dir
+    # cannot be used. `tempfile` is avoided since it is slow to import.
+    base_dir = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    return os.path.join(base_dir, "myscripts-%d" % os.getuid())
+
+
+def get_launcher_socket_path() -> str:
+    return os.path.join(_get_launcher_socket_dir(), "launcher.sock")
+
+
+def _is_private_dir(path: str) -> bool:
+    """
+    Whether the directory is owned by the current user and nobody else can
+    access it, so that other users cannot create or replace the socket in it.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and st.st_mode & 0o077 == 0
+    )
+
+
+def _is_peer_current_user(conn: socket.socket) -> bool:
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True  # the private socket dir has to do
+    creds = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid == os.getuid()
+
+
+def is_launcher_supported() -> bool:
+    return sys.platform != "win32" and hasattr(socket, "send_fds")
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+    buf = b""
+    while len(buf) < size:
+        data = conn.recv(size - len(buf))
+        if not data:
+            raise ConnectionError("Connection closed by peer.")
+        buf += data
+    return buf
+
+
+def _send_message(conn: socket.socket, message: Dict[str, Any]):
+    # Only the current user can connect to the socket, and `json` is slow to
+    # import.
+    data = marshal.dumps(message)
+    conn.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_message(conn: socket.socket) -> Dict[str, Any]:
+    (size,) = _HEADER.unpack(_recv_exactly(conn, _HEADER.size))
+    return marshal.loads(_recv_exactly(conn, size))
+
+
+def launch_in_warm_process() -> Optional[int]:
+    """
+    Run the current entry script (`sys.argv`) in a process forked from the
+    launcher service and wait for it to finish. Returns its exit code, or None
+    if the service is not available and the caller should run the script
+    itself.
+    """
+    if _in_warm_process or not is_launcher_supported():
+        return None
+
+    # The forked process has no controlling terminal, so interactive runs from
+    # a terminal keep using the current process.
+    if os.isatty(0):
+        return None
+
+    # The streams and the environment are handed over to the service, make sure
+    # that it is run by the current user.
+    if not _is_private_dir(_get_launcher_socket_dir()):
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(get_launcher_socket_path())
+        if not _is_peer_current_user(conn):
+            conn.close()
+            return None
+        socket.send_fds(conn, [b"\0"], [0, 1, 2])
+        _send_message(
+            conn,
+            {
+                "argv": [os.path.abspath(sys.argv[0])] + sys.argv[1:],
+                "cwd": os.getcwd(),
+                "env": dict(os.environ),
+                "executable": sys.executable,
+                "flags": tuple(sys.flags),
+            },
+        )
+        pid = _recv_message(conn)["pid"]
+    except (OSError, EOFError, ValueError, KeyError):
+        # The service is not running, is being restarted or has rejected the
+        # request.
+        conn.close()
+        return None
+
+    # Deliver signals to the whole process group like a terminal would.
+    def forward_signal(sig, _):
+        try:
+            os.killpg(pid, sig)
+        except OSError:
+            pass
+
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, forward_signal)
+
+    try:
+        return _recv_message(conn)["exitCode"]
+    except (OSError, EOFError, ValueError, KeyError):
+        # The process has been killed before it could report its exit code.
+        return 1
+    finally:
+        conn.close()
+
+
+def _get_module_mtimes() -> Dict[str, float]:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    mtimes: Dict[str, float] = {}
+    for module in list(sys.modules.values()):
+        file = getattr(module, "__file__", None)
+        if file and os.path.abspath(file).startswith(root):
+            try:
+                mtimes[file] = os.path.getmtime(file)
+            except OSError:
+                pass
+    return mtimes
+
+
+def _is_any_module_modified(mtimes: Dict[str, float]) -> bool:
+    for file, mtime in mtimes.items():
+        try:
+            if os.path.getmtime(file) != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def _reopen_std_streams():
+    # Streams were set up for the fds of the launcher, re-create them so that
+    # buffering and encoding match the new fds.
+    for name, fd, mode in (("stdin", 0, "r"), ("stdout", 1, "w"), ("stderr", 2, "w")):
+        stream = getattr(sys, name)
+        try:
+            stream.flush()
+        except (OSError, ValueError):
+            pass
+        setattr(
+            sys,
+            name,
+            open(
+                fd,
+                mode,
+                encoding="utf-8",
+                errors="backslashreplace" if fd == 2 else "strict",
+                buffering=1 if fd == 2 or os.isatty(fd) else -1,
+                closefd=False,
+            ),
+        )
+
+
+def _run_request(conn: socket.socket):
+    """Runs in the forked child and never returns."""
+    import runpy
+    import traceback
+
+    global _in_warm_process
+
+    exit_code = 1
+    try:
+        _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+        request = _recv_message(conn)
+        if (
+            len(fds) != 3
+            or request["executable"] != sys.executable
+            or request["flags"] != tuple(sys.flags)
+            or _get_startup_env(request["env"]) != _get_startup_env(os.environ)
+        ):
+            os._exit(1)  # the client runs the script itself
+
+        for i, fd in enumerate(fds):
+            os.dup2(fd, i)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        _reopen_std_streams()
+
+        # Start with the same signal dispositions as a fresh interpreter,
+        # in a new process group that receives the signals of the client.
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for sig in (signal.SIGTERM, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_DFL)
+        os.setpgrp()
+
+        _send_message(conn, {"pid": os.getpid()})
+
+        _in_warm_process = True
+        sys.argv = request["argv"]
+        try:
+            runpy.run_path(sys.argv[0], run_name="__main__")
+            exit_code = 0
+        except SystemExit as ex:
+            if ex.code is None:
+                exit_code = 0
+            elif isinstance(ex.code, int):
+                exit_code = ex.code
+            else:
+                print(ex.code, file=sys.stderr)
+                exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _send_message(conn, {"exitCode": exit_code})
+        except BaseException:
+            pass
+        os._exit(exit_code)
+
+
+def serve():
+    """
+    Listen on the launcher socket until stdin is closed, i.e. the daemon that
+    started the service has exited.
+    """
+    import select
+
+    # Import the modules needed by the entry scripts once, they are shared by
+    # all forked processes.
+    import _script  # noqa: F401
+    import _shutil  # noqa: F401
+
+    module_mtimes = _get_module_mtimes()
+
+    sock_dir = _get_launcher_socket_dir()
+    try:
+        os.mkdir(sock_dir, 0o700)
+    except OSError:
+        pass
+    if not _is_private_dir(sock_dir):
+        # Another user may have created the directory, clients fall back to
+        # running the scripts themselves.
+        return
+
+    sock_path = get_launcher_socket_path()
+    try:
+        os.remove(sock_path)
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(sock_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+
+    # Let the kernel reap the forked processes.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    try:
+        while True:
+            readable, _, _ = select.select([server, sys.stdin], [], [])
+            if sys.stdin in readable and not os.read(sys.stdin.fileno(), 1024):
+                break
+            if server not in readable:
+                continue
+
+            conn, _ = server.accept()
+            if _is_any_module_modified(module_mtimes):
+                # Restart to pick up the changes, the client falls back to
+                # running the script itself in the meantime.
+                conn.close()
+                server.close()
+                os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)])
+
+            if os.fork() == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                _run_request(conn)
+            conn.close()
+    finally:
+        try:
+            os.remove(sock_path)
+        except OSError:
+            pass
+
+
+def start_launcher_service() -> Optional["subprocess.Popen[bytes]"]:
+    """
+    Start the launcher service in the background. It stops automatically when
+    the returned process object is garbage collected or the current process
+    exits.
+    """
+    import subprocess
+
+    if not is_launcher_supported():
+        return None
+
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    # Serve from the imported module instead of `__main__`, so that entry
+    # scripts importing this module see the state set in the forked process.
+    import _scriptlauncher
+
+    _scriptlauncher.serve()
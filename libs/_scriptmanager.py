@@ -1,37 +1,66 @@
-import bisect
 import logging
 import os
-import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
 from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from _script import (
+    SCRIPT_EXTENSIONS,
     Script,
     execute_script_autorun,
     get_all_script_access_time,
-    get_all_scripts,
     get_data_dir,
     get_my_script_root,
+    get_script_dir_include_exts,
+    get_script_directories,
     get_script_history_file,
+    load_script_config_cache,
+    save_script_config_cache,
+    script_config_cache_stats,
+    should_ignore_script_dir,
+    update_variable_names,
 )
+from _scriptindex import ScriptIndex
+from _scriptscheduler import ScriptScheduler
+from _scriptwatcher import ScriptWatcher
 from _shutil import (
     clear_env_var_explorer,
     get_ahk_exe,
-    load_json,
     pause,
     refresh_env_vars,
     save_json,
     start_process,
     update_env_var_explorer,
 )
-from _template import render_template_file
+from _template import load_template_file
 from _term import clear_terminal
+from utils.multiregex import MultiPatternMatcher, get_multi_pattern_matcher
 
 MYSCRIPT_GLOBAL_HOTKEY = os.path.join(get_data_dir(), "GlobalHotkey.ahk")
 
+# Hotkey definitions of the last registration. Registering the same hotkeys
+# again is a no-op, so that reloading scripts does not touch the hotkey daemon
+# unless a hotkey has changed.
+_registered_global_hotkeys: Optional[str] = None
+_registered_keyboard_hooks: Dict[str, str] = {}
+_keyboard_hook_scripts: Dict[str, Script] = {}
+
+
+def _write_file_if_changed(file: str, s: str) -> bool:
+    try:
+        with open(file, "r", encoding="utf-8") as f:
+            if f.read() == s:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+
+    with open(file, "w", encoding="utf-8") as f:
+        f.write(s)
+    return True
+
 
 def add_keyboard_hooks(keyboard_hooks):
     if sys.platform != "linux":
@@ -43,6 +72,8 @@ def add_keyboard_hooks(keyboard_hooks):
 
 
 def register_global_hotkeys_linux(scripts: List[Script]):
+    global _registered_global_hotkeys
+
     if not shutil.which("sxhkd"):
         logging.warning("sxhkd is not installed, skip global hotkey registration.")
         return
@@ -75,10 +106,18 @@ def register_global_hotkeys_linux(scripts: List[Script]):
                 f" {script.script_path}\n\n"
             )
 
-    with open(os.path.expanduser("~/.sxhkdrc"), "w") as f:
-        f.write(s)
-    subprocess.call(["pkill", "-USR1", "sxhkd"])
-    start_process(["sxhkd", "-c", os.path.expanduser("~/.sxhkdrc")])
+    if s == _registered_global_hotkeys:
+        return
+
+    sxhkdrc = os.path.expanduser("~/.sxhkdrc")
+    changed = _write_file_if_changed(sxhkdrc, s)
+    if subprocess.call(["pgrep", "-x", "sxhkd"], stdout=subprocess.DEVNULL) == 0:
+        if changed:
+            # Let the running daemon reload the config file.
+            subprocess.call(["pkill", "-USR1", "-x", "sxhkd"])
+    else:
+        start_process(["sxhkd", "-c", sxhkdrc])
+    _registered_global_hotkeys = s
 
 
 def _to_ahk_hotkey(hotkey: str):
@@ -92,6 +131,8 @@ def _to_ahk_hotkey(hotkey: str):
 
 
 def register_global_hotkeys_win(scripts: List[Script]):
+    global _registered_global_hotkeys
+
     def wrap_hotkey_def_with_context_expr(hotkey_def: str, expr: str):
         return f"#If {expr}\n    {hotkey_def}\n#If\n\n"
 
@@ -136,9 +177,9 @@ def register_global_hotkeys_win(scripts: List[Script]):
 
     match_clipboard = sorted(match_clipboard, key=lambda x: x[1])  # sort by name
 
-    render_template_file(
-        os.path.join(get_my_script_root(), "GlobalHotkey.ahk"),
-        MYSCRIPT_GLOBAL_HOTKEY,
+    s = load_template_file(
+        os.path.join(get_my_script_root(), "GlobalHotkey.ahk")
+    ).render(
         context={
             "PYTHON_EXEC": sys.executable,
             "START_SCRIPT": os.path.abspath("bin/start_script.py"),
@@ -149,10 +190,20 @@ def register_global_hotkeys_win(scripts: List[Script]):
             .replace("'", '"'),
         },
     )
+    if s == _registered_global_hotkeys:
+        return
 
-    subprocess.Popen(
-        [get_ahk_exe(), MYSCRIPT_GLOBAL_HOTKEY], close_fds=True, shell=True
-    )
+    # Also start AutoHotkey on the first registration, since it may not be
+    # running. The script has "#SingleInstance, Force", so the new process
+    # replaces the running one.
+    if (
+        _write_file_if_changed(MYSCRIPT_GLOBAL_HOTKEY, s)
+        or _registered_global_hotkeys is None
+    ):
+        subprocess.Popen(
+            [get_ahk_exe(), MYSCRIPT_GLOBAL_HOTKEY], close_fds=True, shell=True
+        )
+    _registered_global_hotkeys = s
 
 
 def execute_script(
@@ -186,15 +237,28 @@ def execute_script(
 
 
 def register_global_hotkeys_mac(scripts: List[Script], no_gui=False):
-    keyboard_hooks = {}
+    global _registered_keyboard_hooks
+
+    # Hotkey -> script path
+    hotkeys: Dict[str, str] = {}
     for script in scripts:
         hotkey = script.cfg["globalHotkey"]
         if hotkey and script.is_supported():
-            logging.info("GlobalHotkey: %s: %s" % (hotkey, script.name))
-            keyboard_hooks[hotkey] = lambda script=script: execute_script(
-                script, no_gui=no_gui
-            )
+            hotkeys[hotkey] = script.script_path
+            # Reloaded scripts may be new objects, hooks look up the latest one.
+            _keyboard_hook_scripts[script.script_path] = script
+
+    if hotkeys == _registered_keyboard_hooks:
+        return
+
+    keyboard_hooks = {}
+    for hotkey, script_path in hotkeys.items():
+        logging.info("GlobalHotkey: %s: %s" % (hotkey, script_path))
+        keyboard_hooks[hotkey] = lambda script_path=script_path: execute_script(
+            _keyboard_hook_scripts[script_path], no_gui=no_gui
+        )
     add_keyboard_hooks(keyboard_hooks)
+    _registered_keyboard_hooks = hotkeys
 
 
 def register_global_hotkeys(scripts, no_gui=False):
@@ -206,22 +270,59 @@ def register_global_hotkeys(scripts, no_gui=False):
         register_global_hotkeys_mac(scripts, no_gui=no_gui)
 
 
-def _get_next_scheduled_script_run_time_file():
-    return os.path.join(get_data_dir(), "next_scheduled_script_run_time.json")
+def _is_visible_script(file: str) -> bool:
+    """
+    Check if the file would be returned by `get_all_scripts()`, without walking
+    the script directories.
+    """
+    if not os.path.isfile(file):
+        return False
+
+    # Hide files starting with '_'
+    if os.path.basename(file).startswith("_"):
+        return False
+
+    for d in get_script_directories():
+        if not file.startswith(d.path + os.path.sep):
+            continue
+
+        ext = os.path.splitext(file)[1].lower()
+        if ext not in SCRIPT_EXTENSIONS and ext not in get_script_dir_include_exts(
+            d.path
+        ):
+            return False
+
+        parent_dir = d.path
+        for name in os.path.relpath(os.path.dirname(file), d.path).split(os.path.sep):
+            if name == ".":
+                break
+            if should_ignore_script_dir(parent_dir, name):
+                return False
+            parent_dir = os.path.join(parent_dir, name)
+
+        return True
+
+    return False
 
 
 class ScriptManager:
     def __init__(self, start_daemon=True, startup=False):
-        self.next_scheduled_script_run_time: Dict[str, float] = load_json(
-            _get_next_scheduled_script_run_time_file(), default={}
-        )
         self.start_daemon = start_daemon
         self.scripts_autorun: List[Script] = []
         self.scripts: List[Script] = []
         self.startup = startup
-
-        self.__match_scripts: List[Tuple[re.Pattern, Script]] = []
-        self.__scheduled_script: List[Script] = []
+        self.script_index = ScriptIndex()
+        load_script_config_cache()
+
+        self.__match_scripts: List[Tuple[str, Script]] = []
+        self.__clipboard_matcher = MultiPatternMatcher([])
+        self.__last_clipboard_match: Tuple[str, Set[Script]] = ("", set())
+        self.scheduler = ScriptScheduler()
+        if start_daemon:
+            self.scheduler.start()
+        self.__script_watcher = ScriptWatcher()
+        self.__variable_names_thread: Optional[threading.Thread] = None
+        self.__should_update_variable_names = False
 
     def update_script_access_time(self):
         access_time = get_all_script_access_time()
@@ -234,11 +335,133 @@ class ScriptManager:
 
     def sort_scripts(self):
         self.update_script_access_time()
-        self.scripts[:] = sorted(
-            self.scripts,
-            key=lambda script: script.mtime,
-            reverse=True,
-        )
+        self.scripts.sort(key=lambda script: script.mtime, reverse=True)
+
+    def __on_script_reloaded(self, script: Script, autorun: bool):
+        should_run_script = False
+        if script.cfg["autoRun"] and script.is_supported():
+            if script not in self.scripts_autorun:
+                self.scripts_autorun.append(script)
+            if autorun:
+                should_run_script = True
+        elif script in self.scripts_autorun:
+            # `autoRun` has been turned off.
+            self.scripts_autorun.remove(script)
+
+        if script.cfg["runAtStartup"] and self.startup:
+            logging.info("runAtStartup: %s" % script.name)
+            should_run_script = True
+
+        # Check if auto run script
+        if should_run_script:
+            execute_script_autorun(script)
+
+    def __remove_script(self, script: Script):
+        self.scripts.remove(script)
+        if script in self.scripts_autorun:
+            self.scripts_autorun.remove(script)
+        self.scheduler.remove_script(script)
+
+    def start_watching_scripts(self) -> bool:
+        if self.__script_watcher.is_started():
+            return True
+
+        return self.__script_watcher.start([d.path for d in get_script_directories()])
+
+    def is_watching_scripts(self) -> bool:
+        return self.__script_watcher.is_started()
+
+    def update_scripts(self, changed_paths: Set[str], autorun=True) -> bool:
+        """
+        Incrementally apply changes of the given files or directories, which
+        can be added, removed, renamed or modified scripts and config files.
+        """
+        script_dict = {script.script_path: script for script in self.scripts}
+        changed_files: Set[str] = set()
+
+        for path in changed_paths:
+            name = os.path.basename(path)
+            if name == "default.config.yaml":
+                # Folder-level config applies to all scripts in the same folder.
+                dir = os.path.dirname(path)
+                changed_files.update(
+                    f for f in script_dict if os.path.dirname(f) == dir
+                )
+
+            elif name.endswith(".config.yaml"):
+                prefix = path[: -len(".config.yaml")]
+                changed_files.update(
+                    f for f in script_dict if os.path.splitext(f)[0] == prefix
+                )
+
+            elif name.endswith(".ignore") or not os.path.isfile(path):
+                # The path can be a removed script, or a directory which has
+                # been created, removed, renamed or ignored. Rescan it and
+                # remove the scripts that are gone.
+                dir = path[: -len(".ignore")] if name.endswith(".ignore") else path
+                changed_files.add(dir)
+                changed_files.update(
+                    f for f in script_dict if f.startswith(dir + os.path.sep)
+                )
+                for root, dirs, files in os.walk(dir, topdown=True):
+                    dirs[:] = [d for d in dirs if not should_ignore_script_dir(root, d)]
+                    changed_files.update(os.path.join(root, f) for f in files)
+
+            else:
+                changed_files.add(path)
+
+        any_script_reloaded = False
+        for file in changed_files:
+            script = script_dict.get(file)
+            if not _is_visible_script(file):
+                if script is not None:
+                    self.__remove_script(script)
+                    any_script_reloaded = True
+                continue
+
+            if script is None:
+                script = Script(file)
+                self.scripts.append(script)
+                reloaded = True
+            else:
+                reloaded = script.refresh_script()
+
+            if reloaded:
+                any_script_reloaded = True
+                self.scheduler.update_script(script)
+                self.__on_script_reloaded(script, autorun=autorun)
+
+        if any_script_reloaded:
+            self.script_index.update_scripts(self.scripts)
+            self.script_index.save()
+            save_script_config_cache()
+
+        return any_script_reloaded
+
+    def process_script_changes(
+        self,
+        on_register_hotkeys: Optional[Callable[[Dict[str, Script]], None]] = None,
+    ) -> bool:
+        """
+        Apply the changes reported by the script watcher. Returns True if any
+        script has been added, removed or reloaded.
+        """
+        changed_paths = self.__script_watcher.read_changes()
+        if changed_paths is None:
+            # Some file system events are lost, fall back to full reload.
+            self.refresh_all_scripts(on_register_hotkeys=on_register_hotkeys)
+            return True
+
+        if not changed_paths:
+            return False
+
+        if self.update_scripts(changed_paths, autorun=self.start_daemon):
+            self.__on_scripts_reloaded(on_register_hotkeys=on_register_hotkeys)
+            self.sort_scripts()
+            self.update_variable_names_in_background()
+            return True
+        else:
+            return False
 
     def reload_scripts(
         self,
@@ -248,12 +471,12 @@ class ScriptManager:
         script_dict = {script.script_path: script for script in self.scripts}
         self.scripts.clear()
         self.scripts_autorun.clear()
-        self.__scheduled_script.clear()
+        self.scheduler.clear()
 
         clear_env_var_explorer()
 
         any_script_reloaded = False
-        for i, file in enumerate(get_all_scripts()):
+        for i, file in enumerate(self.script_index.get_all_scripts()):
             if i % 20 == 0:
                 if on_progress is not None:
                     on_progress()
@@ -262,29 +485,25 @@ class ScriptManager:
                 script = script_dict[file]
                 reloaded = script.refresh_script()
             else:
-                script = Script(file)
+                # On a cold start, try to restore the script from the index
+                # instead of reading the script file and its config files.
+                restored_script = self.script_index.restore_script(file)
+                script = restored_script if restored_script else Script(file)
                 reloaded = True
 
-            if script.cfg["runEveryNSec"]:
-                self.__scheduled_script.append(script)
+            self.scheduler.update_script(script)
 
             if reloaded:
                 any_script_reloaded = True
-                should_run_script = False
-                if script.cfg["autoRun"] and script.is_supported():
-                    self.scripts_autorun.append(script)
-                    if autorun:
-                        should_run_script = True
+                self.__on_script_reloaded(script, autorun=autorun)
 
-                if script.cfg["runAtStartup"] and self.startup:
-                    logging.info("runAtStartup: %s" % script.name)
-                    should_run_script = True
+            self.scripts.append(script)
 
-                # Check if auto run script
-                if should_run_script:
-                    execute_script_autorun(script)
-
-            bisect.insort(self.scripts, script)
+        # Sort once instead of inserting each script into the sorted list.
+        self.scripts.sort()
+        self.script_index.update_scripts(self.scripts)
+        self.script_index.save()
+        save_script_config_cache()
 
         return any_script_reloaded
 
@@ -293,13 +512,29 @@ class ScriptManager:
         for script in self.scripts:
             patt = script.cfg["matchClipboard"]
             if patt:
-                self.__match_scripts.append((re.compile(patt), script))
+                self.__match_scripts.append((patt, script))
+
+        # Patterns are only compiled again if they have changed.
+        self.__clipboard_matcher = get_multi_pattern_matcher(
+            tuple(sorted(set(patt for patt, _ in self.__match_scripts)))
+        )
+        self.__last_clipboard_match = ("", set())
 
     def match_clipboard(self, s: str) -> Iterator[Script]:
-        for regex, script in self.__match_scripts:
-            if re.search(regex, s):
+        matched_patterns = set(self.__clipboard_matcher.match(s))
+        for patt, script in self.__match_scripts:
+            if patt in matched_patterns:
                 yield script
 
+    def is_clipboard_matched(self, script: Script, s: str) -> bool:
+        """
+        Same as `script in self.match_clipboard(s)`, but the patterns are only
+        matched once for consecutive calls with the same text.
+        """
+        if self.__last_clipboard_match[0] != s:
+            self.__last_clipboard_match = (s, set(self.match_clipboard(s)))
+        return script in self.__last_clipboard_match[1]
+
     def refresh_all_scripts(
         self,
         on_progress: Optional[Callable[[], None]] = None,
@@ -307,62 +542,62 @@ class ScriptManager:
     ):
         begin_time = time.time()
 
+        # Start watching before walking the script directories so that no
+        # change can be missed in between.
+        self.start_watching_scripts()
+
         if self.reload_scripts(autorun=self.start_daemon, on_progress=on_progress):
-            # Register hotkeys
-            if on_register_hotkeys is not None:
-                hotkeys: Dict[str, Script] = {}
-                for script in self.scripts:
-                    hotkey = script.cfg["hotkey"]
-                    if hotkey:
-                        logging.debug("Hotkey: %s: %s" % (hotkey, script.name))
-                        hotkeys[hotkey] = script
-                on_register_hotkeys(hotkeys)
-
-            if self.start_daemon:
-                register_global_hotkeys(self.scripts)
-                self.update_clipboard_script_map()
+            self.__on_scripts_reloaded(on_register_hotkeys=on_register_hotkeys)
 
         self.sort_scripts()
-
-        logging.debug("Script refresh takes %.1f secs." % (time.time() - begin_time))
+        self.update_variable_names_in_background()
+
+        logging.debug(
+            "Script refresh takes %.1f secs (config cache hits: %d, misses: %d)."
+            % (
+                time.time() - begin_time,
+                script_config_cache_stats["hits"],
+                script_config_cache_stats["misses"],
+            )
+        )
 
         # Startup script should only be run once
         self.startup = False
 
-    def get_scheduled_scripts_run_time(self) -> Dict[Script, float]:
-        run_time: Dict[Script, float] = {}
-        for script in self.__scheduled_script:
-            if script.script_path in self.next_scheduled_script_run_time:
-                run_time[script] = self.next_scheduled_script_run_time[
-                    script.script_path
-                ]
-        return run_time
-
-    def get_scheduled_scripts_to_run(self) -> Iterator[Script]:
-        if not self.start_daemon:
+    def __on_scripts_reloaded(
+        self,
+        on_register_hotkeys: Optional[Callable[[Dict[str, Script]], None]] = None,
+    ):
+        # Register hotkeys
+        if on_register_hotkeys is not None:
+            hotkeys: Dict[str, Script] = {}
+            for script in self.scripts:
+                hotkey = script.cfg["hotkey"]
+                if hotkey:
+                    logging.debug("Hotkey: %s: %s" % (hotkey, script.name))
+                    hotkeys[hotkey] = script
+            on_register_hotkeys(hotkeys)
+
+        if self.start_daemon:
+            register_global_hotkeys(self.scripts)
+        self.update_clipboard_script_map()
+
+    def update_variable_names_in_background(self):
+        # Extract variable names of all scripts ahead of time, so that showing
+        # the variables of the selected script does not need to read the file.
+        self.__should_update_variable_names = True
+        if (
+            self.__variable_names_thread is not None
+            and self.__variable_names_thread.is_alive()
+        ):
             return
 
-        has_any_script_to_run = False
-        now = time.time()
-        for script in self.__scheduled_script:
-            run_every_n_seconds = script.cfg["runEveryNSec"]
-            if run_every_n_seconds:
-                if (
-                    script.script_path not in self.next_scheduled_script_run_time
-                    or now > self.next_scheduled_script_run_time[script.script_path]
-                ):
-                    if script.is_running():
-                        logging.warn("Script is still running, skip scheduled task.")
-                    else:
-                        logging.info(f"Run scheduled task: {script.name}")
-                        has_any_script_to_run = True
-                        yield script
-
-                    self.next_scheduled_script_run_time[
-                        script.script_path
-                    ] = time.time() + int(run_every_n_seconds)
-
-        if has_any_script_to_run:
-            # Save last scheduled script run time
-            config_file = _get_next_scheduled_script_run_time_file()
-            save_json(config_file, self.next_scheduled_script_run_time)
+        def update_variable_names_thread():
+            while self.__should_update_variable_names:
+                self.__should_update_variable_names = False
+                update_variable_names(list(self.scripts))
+
+        self.__variable_names_thread = threading.Thread(
+            target=update_variable_names_thread, daemon=True
+        )
+        self.__variable_names_thread.start()
@@ -0,0 +1,396 @@
+import heapq
+import json
+import logging
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from _script import Script, get_data_dir
+from _shutil import load_json
+from utils.cron import CronSchedule
+
+# Size of the thread pool that starts the scheduled scripts, due scripts wait
+# for a free slot. A background script gives up its slot once its process has
+# started, so that long-running ones do not block the others. A script never
+# runs concurrently with itself.
+MAX_CONCURRENT_SCHEDULED_SCRIPTS = 4
+
+# Scheduled scripts are started at least this many seconds apart, so that
+# scripts that are due at the same time, e.g. after the system resumes from
+# sleep, do not all start at once.
+MIN_SCHEDULED_SCRIPT_START_INTERVAL_SECS = 2.0
+
+# A run that is late by more than this was missed, because the system was
+# asleep or the daemon was not running, and `schedule.catchUp` decides what to
+# do with it:
+#   "skip": do not run it, wait for the next scheduled time.
+#   "once": run it once, no matter how many runs were missed.
+#   "all": run it once for each missed run, up to `MAX_CATCH_UP_RUNS` times.
+MISSED_RUN_GRACE_SECS = 60.0
+MAX_CATCH_UP_RUNS = 10
+
+# Each run is delayed by a random amount of up to this fraction of the interval
+# (capped at `MAX_SCHEDULE_JITTER_SECS`), so that scripts with the same
+# interval drift apart instead of always starting together.
+SCHEDULE_JITTER_RATIO = 0.05
+MAX_SCHEDULE_JITTER_SECS = 30.0
+
+# The scheduler thread wakes up at least this often, because the monotonic
+# clock used for waiting does not advance while the system is suspended.
+MAX_SCHEDULER_SLEEP_SECS = 60.0
+
+RUN_HISTORY_SIZE = 200
+
+
+def get_next_scheduled_script_run_time_file() -> str:
+    return os.path.join(get_data_dir(), "next_scheduled_script_run_time.json")
+
+
+class ScheduledScriptRun(NamedTuple):
+    script_path: str
+    name: str
+    start_time: float
+    duration: float
+    # None if the script could not be started.
+    exit_code: Optional[int]
+    error: Optional[str] = None
+
+
+class ScriptScheduler:
+    """
+    Run the scripts that have `schedule` (cron expression) or `runEveryNSec`
+    set in the background.
+
+    Due times are kept in a min-heap and a dedicated thread sleeps until the
+    earliest one, so that scheduling does not depend on the UI loop and costs
+    nothing between deadlines. Due scripts are queued, started one at a time
+    and run in a bounded thread pool.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__cond = threading.Condition(self.__lock)
+
+        # Script path -> next run time (unix time), persisted across restarts.
+        self.__next_run_time: Dict[str, float] = load_json(
+            get_next_scheduled_script_run_time_file(), default={}
+        )
+        self.__scripts: Dict[str, Script] = {}
+        self.__cron_schedules: Dict[str, CronSchedule] = {}
+        # (next run time, script path), stale entries are skipped when popped.
+        self.__heap: List[Tuple[float, str]] = []
+        # Scripts that are queued or running.
+        self.__running: Set[str] = set()
+        # Scripts waiting to be started, and the number of missed runs of each
+        # script to catch up on after the current one.
+        self.__start_queue: Deque[Script] = deque()
+        self.__pending_runs: Dict[str, int] = {}
+        self.__last_start_time = 0.0
+        self.__history: Deque[ScheduledScriptRun] = deque(maxlen=RUN_HISTORY_SIZE)
+
+        self.__executor: Optional[ThreadPoolExecutor] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__stopped = False
+
+    def start(self):
+        if self.__thread is not None:
+            raise Exception("Script scheduler is already started.")
+
+        self.__executor = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_SCHEDULED_SCRIPTS,
+            thread_name_prefix="scheduled_script",
+        )
+        self.__thread = threading.Thread(target=self.__scheduler_thread, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__executor is not None:
+            # Scripts that have not been started yet are dropped.
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+            self.__executor = None
+
+    def update_script(self, script: Script):
+        """Add, update or remove the schedule of the (re)loaded script."""
+        if not script.cfg["schedule"] and not script.cfg["runEveryNSec"]:
+            self.remove_script(script)
+            return
+
+        path = script.script_path
+        cron: Optional[CronSchedule] = None
+        next_run_time = self.__next_run_time.get(path)
+        if script.cfg["schedule"]:
+            try:
+                # YAML values can be of any type, e.g. `schedule: 5`.
+                if not isinstance(script.cfg["schedule"], str):
+                    raise ValueError(
+                        f'Invalid cron expression: {script.cfg["schedule"]!r}'
+                    )
+                cron = CronSchedule(script.cfg["schedule"])
+                if next_run_time is None or not cron.matches(next_run_time):
+                    # New or changed schedule.
+                    next_run_time = cron.get_next_time(time.time())
+            except ValueError as ex:
+                logging.error(f"Cannot schedule script {script.name}: {ex}")
+                self.remove_script(script)
+                return
+        else:
+            try:
+                interval = float(script.cfg["runEveryNSec"])
+            except (TypeError, ValueError):
+                interval = 0
+            if not interval > 0:
+                logging.error(
+                    f"Cannot schedule script {script.name}: Invalid runEveryNSec:"
+                    f' {script.cfg["runEveryNSec"]!r}'
+                )
+                self.remove_script(script)
+                return
+
+            if next_run_time is None:
+                # Never run before, run it as soon as possible.
+                next_run_time = time.time()
+
+        with self.__cond:
+            self.__scripts[path] = script
+            if cron is not None:
+                self.__cron_schedules[path] = cron
+            else:
+                self.__cron_schedules.pop(path, None)
+            self.__next_run_time[path] = next_run_time
+            heapq.heappush(self.__heap, (next_run_time, path))
+            self.__cond.notify()
+
+    def remove_script(self, script: Script):
+        with self.__cond:
+            self.__scripts.pop(script.script_path, None)
+            self.__cron_schedules.pop(script.script_path, None)
+            self.__pending_runs.pop(script.script_path, None)
+
+    def clear(self):
+        with self.__cond:
+            self.__scripts.clear()
+            self.__cron_schedules.clear()
+            self.__heap.clear()
+            self.__pending_runs.clear()
+
+    def get_scheduled_scripts_run_time(self) -> Dict[Script, float]:
+        with self.__lock:
+            return {
+                script: self.__next_run_time[path]
+                for path, script in self.__scripts.items()
+                if path in self.__next_run_time
+            }
+
+    def is_script_running(self, script: Script) -> bool:
+        with self.__lock:
+            return script.script_path in self.__running
+
+    def get_run_history(self) -> List[ScheduledScriptRun]:
+        """Returns the most recent runs first."""
+        with self.__lock:
+            return list(reversed(self.__history))
+
+    def get_last_run(self, script: Script) -> Optional[ScheduledScriptRun]:
+        with self.__lock:
+            for run in reversed(self.__history):
+                if run.script_path == script.script_path:
+                    return run
+        return None
+
+    def __get_next_run_time(self, script: Script, now: float) -> float:
+        cron = self.__cron_schedules.get(script.script_path)
+        if cron is not None:
+            return cron.get_next_time(now)
+
+        interval = float(script.cfg["runEveryNSec"])
+        jitter = min(interval * SCHEDULE_JITTER_RATIO, MAX_SCHEDULE_JITTER_SECS)
+        return now + interval + random.uniform(0, jitter)
+
+    def __get_num_runs(self, script: Script, run_time: float, now: float) -> int:
+        """Number of times to run the script that was due at `run_time`."""
+        if now - run_time <= MISSED_RUN_GRACE_SECS:
+            return 1
+
+        catch_up = script.cfg["schedule.catchUp"]
+        if catch_up == "skip":
+            logging.info(f"Skip missed scheduled task: {script.name}")
+            return 0
+        elif catch_up == "all":
+            cron = self.__cron_schedules.get(script.script_path)
+            if cron is None:
+                interval = float(script.cfg["runEveryNSec"])
+                return min(int((now - run_time) / interval) + 1, MAX_CATCH_UP_RUNS)
+
+            num_runs = 1
+            while num_runs < MAX_CATCH_UP_RUNS:
+                run_time = cron.get_next_time(run_time)
+                if run_time > now:
+                    break
+                num_runs += 1
+            return num_runs
+        else:
+            if catch_up != "once":
+                logging.warning(
+                    f'Invalid schedule.catchUp "{catch_up}", use "once": {script.name}'
+                )
+            return 1
+
+    def __queue_due_scripts(self, now: float):
+        while self.__heap and self.__heap[0][0] <= now:
+            run_time, path = heapq.heappop(self.__heap)
+            script = self.__scripts.get(path)
+            if script is None or self.__next_run_time.get(path) != run_time:
+                continue  # removed or rescheduled
+
+            try:
+                num_runs = self.__get_num_runs(script, run_time, now)
+                self.__next_run_time[path] = self.__get_next_run_time(script, now)
+            except ValueError as ex:
+                logging.error(f"Cannot schedule script {script.name}: {ex}")
+                del self.__scripts[path]
+                continue
+            heapq.heappush(self.__heap, (self.__next_run_time[path], path))
+
+            if num_runs == 0:
+                continue
+            elif path in self.__running or script.is_running():
+                logging.warning(
+                    f"Script is still running, skip scheduled task: {script.name}"
+                )
+            else:
+                self.__running.add(path)
+                self.__pending_runs[path] = num_runs - 1
+                self.__start_queue.append(script)
+
+    def __pop_script_to_start(self) -> Tuple[Optional[Script], float]:
+        """
+        Returns the next queued script if it can be started now, and otherwise
+        the number of seconds to wait before the next one can be started.
+        """
+        while self.__start_queue:
+            delay = (
+                self.__last_start_time
+                + MIN_SCHEDULED_SCRIPT_START_INTERVAL_SECS
+                - time.monotonic()
+            )
+            if delay > 0:
+                return None, delay
+
+            script = self.__start_queue.popleft()
+            if script.script_path not in self.__scripts:
+                self.__running.discard(script.script_path)  # removed
+                continue
+
+            self.__last_start_time = time.monotonic()
+            return script, 0
+        return None, MAX_SCHEDULER_SLEEP_SECS
+
+    def __scheduler_thread(self):
+        while True:
+            with self.__cond:
+                if self.__stopped:
+                    return
+
+                now = time.time()
+                next_run_time: Optional[Dict[str, float]] = None
+                if self.__heap and self.__heap[0][0] <= now:
+                    self.__queue_due_scripts(now)
+                    next_run_time = self.__next_run_time.copy()
+
+                script, timeout = self.__pop_script_to_start()
+                if next_run_time is None and script is None:
+                    if self.__heap:
+                        timeout = min(timeout, self.__heap[0][0] - now)
+                    self.__cond.wait(min(timeout, MAX_SCHEDULER_SLEEP_SECS))
+                    continue
+
+            if next_run_time is not None:
+                self.__save_next_run_time(next_run_time)
+
+            if script is not None:
+                assert self.__executor is not None
+                logging.info(f"Run scheduled task: {script.name}")
+                self.__executor.submit(self.__run_script, script)
+
+    def __save_next_run_time(self, next_run_time: Dict[str, float]):
+        # Write to a temp file first and atomically replace the old file, so
+        # that a crash never leaves a partially written file behind.
+        file = get_next_scheduled_script_run_time_file()
+        tmp_file = file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(next_run_time, f, indent=2, sort_keys=True)
+            os.replace(tmp_file, file)
+        except OSError as ex:
+            logging.warning(f"Failed to save next scheduled script run time: {ex}")
+
+    def __run_script(self, script: Script):
+        start_time = time.time()
+        exit_code: Optional[int] = None
+        error: Optional[str] = None
+        ps = script.ps
+        try:
+            success = script.execute(
+                args=[],
+                close_on_exit=True,
+                restart_instance=False,
+                new_window=False,
+                background=True,
+            )
+            if script.ps is not None and script.ps is not ps:
+                # Background scripts are not waited for by `execute()`, wait
+                # for them without holding the pool slot.
+                threading.Thread(
+                    target=self.__wait_for_script,
+                    args=(script, script.ps, start_time),
+                    daemon=True,
+                ).start()
+                return
+            exit_code = 0 if success else 1
+        except Exception as ex:
+            logging.error(f"Error on running scheduled script: {ex}")
+            error = str(ex)
+
+        self.__finish_run(script, start_time, exit_code, error)
+
+    def __wait_for_script(
+        self, script: Script, ps: subprocess.Popen, start_time: float
+    ):
+        self.__finish_run(script, start_time, ps.wait(), None)
+
+    def __finish_run(
+        self,
+        script: Script,
+        start_time: float,
+        exit_code: Optional[int],
+        error: Optional[str],
+    ):
+        run = ScheduledScriptRun(
+            script_path=script.script_path,
+            name=script.name,
+            start_time=start_time,
+            duration=time.time() - start_time,
+            exit_code=exit_code,
+            error=error,
+        )
+        with self.__cond:
+            self.__history.append(run)
+            if self.__pending_runs.get(script.script_path, 0) > 0:
+                # Catch up on the next missed run.
+                self.__pending_runs[script.script_path] -= 1
+                self.__start_queue.append(script)
+                self.__cond.notify()
+            else:
+                self.__pending_runs.pop(script.script_path, None)
+                self.__running.discard(script.script_path)
@@ -1,50 +1,265 @@
+import asyncio
+import bisect
+import email.utils
+import io
 import json
 import logging
 import os
 import subprocess
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from typing import Optional
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
 from urllib.parse import unquote
 
 from _script import get_data_dir, get_my_script_root
+from utils.httputils import (
+    get_byte_range,
+    get_etag,
+    get_gzipped_file,
+    guess_content_type,
+    is_compressible,
+    is_not_modified,
+)
 
 HOST_NAME = "127.0.0.1"
 
+# Maximum number of `/system` commands that run at the same time, further
+# requests wait for a slot.
+MAX_CONCURRENT_SUBPROCESSES = 4
+
+# Idle keep-alive connections are closed after this many seconds.
+KEEP_ALIVE_TIMEOUT_SECS = 60
+
+# When the server is stopped, running commands are killed and connection
+# handlers that have not finished after this many seconds are cancelled.
+CLOSE_TIMEOUT_SECS = 2.0
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Text files within this size range are gzipped if the client accepts it.
+GZIP_MIN_SIZE = 1024
+GZIP_MAX_SIZE = 8 * 1024 * 1024
+
+# Upper bounds (in milliseconds) of the buckets of the latency histograms.
+_LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000]
+
+
+class _EndpointStats:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_LATENCY_BUCKETS_MS) + 1)
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, secs: float, ok: bool):
+        self.counts[bisect.bisect_left(_LATENCY_BUCKETS_MS, secs * 1000)] += 1
+        self.total += secs
+        self.max = max(self.max, secs)
+        if not ok:
+            self.errors += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        n = sum(self.counts)
+        buckets = {
+            (
+                f"<={_LATENCY_BUCKETS_MS[i]}ms"
+                if i < len(_LATENCY_BUCKETS_MS)
+                else f">{_LATENCY_BUCKETS_MS[-1]}ms"
+            ): count
+            for i, count in enumerate(self.counts)
+            if count > 0
+        }
+        return {
+            "count": n,
+            "errors": self.errors,
+            "avgMs": self.total / n * 1000 if n > 0 else 0.0,
+            "maxMs": self.max * 1000,
+            "buckets": buckets,
+        }
+
+
+_endpoint_stats: Dict[str, _EndpointStats] = {}
+_endpoint_stats_lock = threading.Lock()
+
+
+def _get_endpoint_name(method: str, path: str) -> str:
+    if path.startswith("/fs/"):
+        path = "/fs/"
+    elif path not in (
+        "/userscriptlib.js",
+        "/metrics",
+        "/system",
+        "/load-file",
+        "/save-file",
+    ):
+        path = "invalid"
+    return f"{method} {path}"
+
+
+def _add_endpoint_latency(endpoint: str, secs: float, ok: bool):
+    with _endpoint_stats_lock:
+        if endpoint not in _endpoint_stats:
+            _endpoint_stats[endpoint] = _EndpointStats()
+        _endpoint_stats[endpoint].add(secs, ok)
+
+
+def get_server_metrics() -> Dict[str, Any]:
+    """Returns the latency counters of all endpoints."""
+    with _endpoint_stats_lock:
+        return {
+            name: stats.to_dict() for name, stats in sorted(_endpoint_stats.items())
+        }
+
+
+class _FileResponse(NamedTuple):
+    status: HTTPStatus
+    headers: List[Tuple[str, str]]
+    # Gzipped content, or None if `length` bytes of the file starting at
+    # `offset` should be sent.
+    body: Optional[bytes]
+    offset: int
+    length: int
+
+
+def _prepare_file_response(
+    path: str, f: BinaryIO, get_header: Callable[[str], Optional[str]]
+) -> _FileResponse:
+    """
+    Handle conditional and range requests for the opened file `f`. Files are
+    revalidated on every request, so that changes show up right away while
+    unchanged files are not downloaded again.
+    """
+    st = os.fstat(f.fileno())
+    etag = get_etag(st)
+    headers = [
+        ("Cache-Control", "no-cache"),
+        ("ETag", etag),
+        ("Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True)),
+    ]
+    if is_not_modified(get_header, etag, st.st_mtime):
+        return _FileResponse(HTTPStatus.NOT_MODIFIED, headers, b"", 0, 0)
+
+    content_type = guess_content_type(path)
+    headers += [("Content-Type", content_type), ("Accept-Ranges", "bytes")]
+
+    byte_range = get_header("Range")
+    if_range = get_header("If-Range")
+    if byte_range is not None and (if_range is None or if_range == etag):
+        try:
+            r = get_byte_range(byte_range, st.st_size)
+        except ValueError:
+            pass  # invalid ranges are ignored
+        else:
+            if r is None:
+                headers.append(("Content-Range", "bytes */%d" % st.st_size))
+                return _FileResponse(
+                    HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, headers, b"", 0, 0
+                )
+
+            first, last = r
+            headers += [
+                ("Content-Range", "bytes %d-%d/%d" % (first, last, st.st_size)),
+                ("Content-Length", str(last - first + 1)),
+            ]
+            return _FileResponse(
+                HTTPStatus.PARTIAL_CONTENT, headers, None, first, last - first + 1
+            )
+
+    if (
+        is_compressible(content_type)
+        and GZIP_MIN_SIZE <= st.st_size <= GZIP_MAX_SIZE
+        and "gzip" in (get_header("Accept-Encoding") or "")
+    ):
+        body = get_gzipped_file(path, st.st_mtime_ns, st.st_size)
+        # The gzipped variant needs its own entity tag.
+        headers[1] = ("ETag", etag[:-1] + '-gz"')
+        headers += [
+            ("Content-Encoding", "gzip"),
+            ("Vary", "Accept-Encoding"),
+            ("Content-Length", str(len(body))),
+        ]
+        return _FileResponse(HTTPStatus.OK, headers, body, 0, 0)
+
+    headers.append(("Content-Length", str(st.st_size)))
+    return _FileResponse(HTTPStatus.OK, headers, None, 0, st.st_size)
+
+
+def _get_userscriptlib_path() -> str:
+    return os.path.join(
+        get_my_script_root(), "js", "userscriptlib", "dist", "userscriptlib.js"
+    )
+
 
 class MyHTTPRequestHandler(BaseHTTPRequestHandler):
     def _serve_file(self, path):
         with open(path, "rb") as f:
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
+            response = _prepare_file_response(path, f, self.headers.get)
+            self.send_response(response.status)
+            for name, value in response.headers:
+                self.send_header(name, value)
+            self._cacheable = True
             self.end_headers()
-            self.wfile.write(f.read())
+
+            if response.body is not None:
+                self.wfile.write(response.body)
+            else:
+                f.seek(response.offset)
+                remaining = response.length
+                while remaining > 0:
+                    data = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
 
     def do_GET(self):
+        start_time = time.perf_counter()
+        ok = False
         try:
             if self.path.startswith("/fs/"):
                 file_path = self.path.removeprefix("/fs/")
                 file_path = unquote(file_path)
-                self._serve_file(file_path)
+                try:
+                    self._serve_file(file_path)
+                except FileNotFoundError:
+                    self.send_error(404, f"File not found: {file_path}")
 
             elif self.path == "/userscriptlib.js":
-                self._serve_file(
-                    os.path.join(
-                        get_my_script_root(),
-                        "js",
-                        "userscriptlib",
-                        "dist",
-                        "userscriptlib.js",
-                    )
-                )
+                self._serve_file(_get_userscriptlib_path())
+
+            elif self.path == "/metrics":
+                self.send_json(get_server_metrics())
 
             else:
                 raise Exception(f"Invalid path: {self.path}")
 
+            ok = True
         except Exception as ex:
             self.send_error(500, str(ex))
+        finally:
+            _add_endpoint_latency(
+                _get_endpoint_name("GET", self.path),
+                time.perf_counter() - start_time,
+                ok=ok,
+            )
 
     def do_POST(self):
+        start_time = time.perf_counter()
+        ok = False
         try:
             if self.path == "/system":
                 data = self.get_req_data()
@@ -74,8 +289,16 @@ class MyHTTPRequestHandler(BaseHTTPRequestHandler):
 
             else:
                 return self.send_response(500)
+
+            ok = True
         except Exception:
             logging.exception("")
+        finally:
+            _add_endpoint_latency(
+                _get_endpoint_name("POST", self.path),
+                time.perf_counter() - start_time,
+                ok=ok,
+            )
 
     def send_json(self, data):
         self.send_response(200)
@@ -89,9 +312,11 @@ class MyHTTPRequestHandler(BaseHTTPRequestHandler):
         return data
 
     def end_headers(self):
-        self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
-        self.send_header("Pragma", "no-cache")
-        self.send_header("Expires", "0")
+        # Files are sent with validators instead, see `_prepare_file_response()`.
+        if not getattr(self, "_cacheable", False):
+            self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
+            self.send_header("Pragma", "no-cache")
+            self.send_header("Expires", "0")
         self.send_header("Access-Control-Allow-Origin", "*")
         super().end_headers()
 
@@ -99,14 +324,378 @@ class MyHTTPRequestHandler(BaseHTTPRequestHandler):
         return
 
 
+class _HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = "") -> None:
+        super().__init__(message if message else status.phrase)
+        self.status = status
+
+
+class _Request:
+    def __init__(
+        self, method: str, path: str, version: str, headers: Dict[str, str]
+    ) -> None:
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers  # header names are lowercase
+        self.body = b""
+
+    def get_json(self) -> Any:
+        return json.loads(self.body.decode("utf-8"))
+
+    def is_keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        else:
+            return connection != "close"
+
+
+class _Response:
+    def __init__(self, writer: asyncio.StreamWriter, request: _Request) -> None:
+        self.writer = writer
+        self.request = request
+        self.keep_alive = request.is_keep_alive()
+        self.headers_sent = False
+        self.__chunked = False
+
+    def __get_head(self, status: HTTPStatus, headers: List[Tuple[str, str]]) -> bytes:
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        for name, value in headers:
+            lines.append(f"{name}: {value}")
+        if not any(name == "Cache-Control" for name, _ in headers):
+            lines += [
+                "Cache-Control: no-cache, no-store, must-revalidate",
+                "Pragma: no-cache",
+                "Expires: 0",
+            ]
+        lines += [
+            "Access-Control-Allow-Origin: *",
+            "Connection: keep-alive" if self.keep_alive else "Connection: close",
+        ]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    def send_headers(
+        self,
+        status: HTTPStatus,
+        content_type: str,
+        content_length: Optional[int] = None,
+    ):
+        """
+        If `content_length` is None, the body is streamed with the chunked
+        transfer encoding, or until the connection is closed for HTTP/1.0.
+        """
+        headers = [("Content-Type", content_type)]
+        if content_length is not None:
+            headers.append(("Content-Length", str(content_length)))
+        elif self.request.version == "HTTP/1.0":
+            self.keep_alive = False
+        else:
+            headers.append(("Transfer-Encoding", "chunked"))
+            self.__chunked = True
+        self.writer.write(self.__get_head(status, headers))
+        self.headers_sent = True
+
+    def send_file_headers(self, status: HTTPStatus, headers: List[Tuple[str, str]]):
+        self.writer.write(self.__get_head(status, headers))
+        self.headers_sent = True
+
+    def send(self, status: HTTPStatus, content_type: str, body: bytes):
+        self.send_headers(status, content_type, content_length=len(body))
+        self.writer.write(body)
+
+    def send_json(self, data: Any):
+        self.send(
+            HTTPStatus.OK,
+            "application/json; charset=utf-8",
+            json.dumps(data).encode("utf-8"),
+        )
+
+    async def write_chunk(self, data: bytes):
+        if not data:
+            return
+        if self.__chunked:
+            self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        else:
+            self.writer.write(data)
+        await self.writer.drain()
+
+    def end_chunks(self):
+        if self.__chunked:
+            self.writer.write(b"0\r\n\r\n")
+
+
+class _AsyncHTTPServer:
+    """
+    Minimal HTTP/1.1 server based on asyncio streams that serves the same
+    endpoints as `MyHTTPRequestHandler`. Connections are kept alive, files are
+    sent with `sendfile()` where available, and the output of `/system`
+    commands is streamed while they are running.
+    """
+
+    def __init__(self) -> None:
+        self.__subprocess_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUBPROCESSES)
+        # Reading the output of a command blocks a thread, so that commands are
+        # started the same way as `subprocess.check_output()` on all platforms.
+        self.__subprocess_executor = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_SUBPROCESSES
+        )
+        self.__writers: Set[asyncio.StreamWriter] = set()
+        self.__handler_tasks: Set[asyncio.Task] = set()
+        self.__processes: Set[subprocess.Popen] = set()
+        self.__closing = False
+
+    async def close(self):
+        # Close idle keep-alive connections as well, and kill the running
+        # commands so that their handlers finish.
+        self.__closing = True
+        for writer in list(self.__writers):
+            writer.close()
+        for ps in list(self.__processes):
+            ps.kill()
+
+        if self.__handler_tasks:
+            _, pending = await asyncio.wait(
+                list(self.__handler_tasks), timeout=CLOSE_TIMEOUT_SECS
+            )
+            # E.g. blocked on a client that does not read the response.
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.__subprocess_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        task = asyncio.current_task()
+        assert task is not None
+        self.__handler_tasks.add(task)
+        self.__writers.add(writer)
+        try:
+            while True:
+                request = await self.__read_request(reader, writer)
+                if request is None:
+                    break
+
+                response = _Response(writer, request)
+                await self.__handle_request(request, response)
+                await writer.drain()
+                if not response.keep_alive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logging.exception("")
+        finally:
+            self.__writers.discard(writer)
+            self.__handler_tasks.discard(task)
+            writer.close()
+
+    async def __read_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> Optional[_Request]:
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), timeout=KEEP_ALIVE_TIMEOUT_SECS
+            )
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+        except asyncio.LimitOverrunError:
+            status = HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+            writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n\r\n".encode())
+            return None
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, version = lines[0].split(" ")
+        except ValueError:
+            return None
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        request = _Request(method, path, version, headers)
+        content_length = int(headers.get("content-length", "0"))
+        if content_length > 0:
+            request.body = await reader.readexactly(content_length)
+        return request
+
+    async def __handle_request(self, request: _Request, response: _Response):
+        start_time = time.perf_counter()
+        ok = False
+        try:
+            if request.method == "GET":
+                await self.__do_get(request, response)
+            elif request.method == "POST":
+                await self.__do_post(request, response)
+            else:
+                raise _HTTPError(HTTPStatus.NOT_IMPLEMENTED)
+            ok = True
+
+        except Exception as ex:
+            if not isinstance(ex, _HTTPError) and not isinstance(ex, ConnectionError):
+                logging.exception("")
+            if response.headers_sent:
+                # The response cannot be fixed up, let the client know by
+                # closing the connection before the response is complete.
+                response.keep_alive = False
+                return
+            response.send(
+                (
+                    ex.status
+                    if isinstance(ex, _HTTPError)
+                    else HTTPStatus.INTERNAL_SERVER_ERROR
+                ),
+                "text/plain; charset=utf-8",
+                str(ex).encode("utf-8"),
+            )
+
+        finally:
+            _add_endpoint_latency(
+                _get_endpoint_name(request.method, request.path),
+                time.perf_counter() - start_time,
+                ok=ok,
+            )
+
+    async def __do_get(self, request: _Request, response: _Response):
+        if request.path.startswith("/fs/"):
+            await self.__send_file(
+                unquote(request.path.removeprefix("/fs/")), request, response
+            )
+
+        elif request.path == "/userscriptlib.js":
+            await self.__send_file(_get_userscriptlib_path(), request, response)
+
+        elif request.path == "/metrics":
+            response.send_json(get_server_metrics())
+
+        else:
+            raise _HTTPError(HTTPStatus.NOT_FOUND, f"Invalid path: {request.path}")
+
+    async def __do_post(self, request: _Request, response: _Response):
+        if request.path == "/system":
+            await self.__run_command(request.get_json()["args"], response)
+
+        elif request.path == "/load-file":
+            req = request.get_json()
+            file_path = os.path.join(get_data_dir(), f"{req['file']}")
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            response.send_json({"success": True, "content": content})
+
+        elif request.path == "/save-file":
+            req = request.get_json()
+            file_path = os.path.join(get_data_dir(), f"{req['file']}")
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(req["content"])
+            response.send_json({"success": True, "filePath": file_path})
+
+        else:
+            raise _HTTPError(HTTPStatus.NOT_FOUND, f"Invalid path: {request.path}")
+
+    async def __send_file(self, path: str, request: _Request, response: _Response):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise _HTTPError(HTTPStatus.NOT_FOUND, f"File not found: {path}")
+
+        with f:
+            file_response = _prepare_file_response(
+                path, f, lambda name: request.headers.get(name.lower())
+            )
+            response.send_file_headers(file_response.status, file_response.headers)
+            if file_response.body is not None:
+                response.writer.write(file_response.body)
+            elif file_response.length > 0:
+                await response.writer.drain()
+                # Falls back to reading the file in chunks if the transport or
+                # the platform does not support `sendfile()`.
+                await asyncio.get_running_loop().sendfile(
+                    response.writer.transport,
+                    f,
+                    file_response.offset,
+                    file_response.length,
+                )
+
+    async def __run_command(self, args, response: _Response):
+        loop = asyncio.get_running_loop()
+        async with self.__subprocess_semaphore:
+            if self.__closing:
+                raise _HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is closing.")
+
+            ps = subprocess.Popen(args, stdout=subprocess.PIPE)
+            self.__processes.add(ps)
+            try:
+                # Buffered since `bufsize` is not 0.
+                stdout = cast(io.BufferedReader, ps.stdout)
+                response.send_headers(HTTPStatus.OK, "text/plain; charset=UTF-8")
+                while True:
+                    data = await loop.run_in_executor(
+                        self.__subprocess_executor, stdout.read1, STREAM_CHUNK_SIZE
+                    )
+                    if not data:
+                        break
+                    await response.write_chunk(data)
+
+                returncode = await loop.run_in_executor(
+                    self.__subprocess_executor, ps.wait
+                )
+                if self.__closing:
+                    raise ConnectionAbortedError("Server is closing.")
+                if returncode != 0:
+                    raise subprocess.CalledProcessError(returncode, args)
+                logging.info("%s: exit code: %d" % (args, returncode))
+                response.end_chunks()
+
+            finally:
+                self.__processes.discard(ps)
+                if ps.poll() is None:
+                    ps.kill()
+                    ps.wait()
+                stdout.close()
+
+
 class ScriptServer:
-    def __init__(self, port=4312) -> None:
+    def __init__(self, port=4312, use_asyncio=True) -> None:
         self.port = port
+        self.use_asyncio = use_asyncio
         self.__httpd: Optional[ThreadingHTTPServer] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__stop_event: Optional[asyncio.Event] = None
         self.__lock = threading.Lock()
         self.__server_thread: Optional[threading.Thread] = None
 
+    async def _serve_async(self):
+        server = _AsyncHTTPServer()
+        stop_event = asyncio.Event()
+        tcp_server = await asyncio.start_server(
+            server.handle_connection, HOST_NAME, self.port
+        )
+        with self.__lock:
+            self.__loop = asyncio.get_running_loop()
+            self.__stop_event = stop_event
+
+        logging.info("API server started at: http://%s:%s" % (HOST_NAME, self.port))
+        await stop_event.wait()
+
+        tcp_server.close()
+        await server.close()
+        await tcp_server.wait_closed()
+        with self.__lock:
+            self.__loop = None
+            self.__stop_event = None
+
+        logging.info("API server stopped.")
+
     def _server_main(self):
+        if self.use_asyncio:
+            asyncio.run(self._serve_async())
+            return
+
         httpd = ThreadingHTTPServer((HOST_NAME, self.port), MyHTTPRequestHandler)
         with self.__lock:
             self.__httpd = httpd
@@ -130,11 +719,17 @@ class ScriptServer:
     def stop_server(self, join_thread=True):
         with self.__lock:
             httpd = self.__httpd
+            loop = self.__loop
+            stop_event = self.__stop_event
 
-        if httpd is None or self.__server_thread is None:
+        if (httpd is None and loop is None) or self.__server_thread is None:
             raise Exception("API server is not started.")
         logging.debug("Stopping API server...")
-        httpd.shutdown()
+        if loop is not None and stop_event is not None:
+            loop.call_soon_threadsafe(stop_event.set)
+        else:
+            assert httpd is not None
+            httpd.shutdown()
 
         if join_thread:
             self.join_server_thread()
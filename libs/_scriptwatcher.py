@@ -0,0 +1,150 @@
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+from _script import should_ignore_script_dir
+from utils.inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_IGNORED,
+    IN_ISDIR,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    Inotify,
+)
+
+_WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+) | IN_DELETE_SELF
+
+
+class ScriptWatcher:
+    """
+    Watch script directories with inotify and collect the paths that have been
+    changed, so that scripts can be reloaded incrementally instead of walking
+    all script directories periodically.
+    """
+
+    def __init__(self):
+        self.__inotify: Optional[Inotify] = None
+        self.__wd_to_dir: Dict[int, str] = {}
+        self.__dir_to_wd: Dict[str, int] = {}
+
+    @staticmethod
+    def is_supported() -> bool:
+        return Inotify.is_supported()
+
+    def is_started(self) -> bool:
+        return self.__inotify is not None
+
+    def start(self, directories: List[str]) -> bool:
+        if self.is_started():
+            raise Exception("Script watcher is already started.")
+
+        if not ScriptWatcher.is_supported():
+            return False
+
+        try:
+            self.__inotify = Inotify()
+        except OSError as ex:
+            logging.warning(str(ex))
+            return False
+
+        try:
+            for directory in directories:
+                self.__add_watch_recursive(directory)
+        except OSError as ex:
+            # Most likely `fs.inotify.max_user_watches` has been exceeded.
+            logging.warning(f"Failed to watch script directories: {ex}")
+            self.stop()
+            return False
+
+        logging.debug("Watching %d script directories." % len(self.__dir_to_wd))
+        return True
+
+    def stop(self):
+        if self.__inotify is not None:
+            self.__inotify.close()
+            self.__inotify = None
+        self.__wd_to_dir.clear()
+        self.__dir_to_wd.clear()
+
+    def __add_watch(self, dir: str):
+        assert self.__inotify is not None
+        wd = self.__inotify.add_watch(dir, _WATCH_MASK)
+        if wd is None:
+            return  # directory has been removed in the meantime
+
+        self.__wd_to_dir[wd] = dir
+        self.__dir_to_wd[dir] = wd
+
+    def __add_watch_recursive(self, directory: str):
+        for root, dirs, _ in os.walk(directory, topdown=True):
+            dirs[:] = [d for d in dirs if not should_ignore_script_dir(root, d)]
+            self.__add_watch(root)
+
+    def __remove_watch_recursive(self, directory: str):
+        assert self.__inotify is not None
+        prefix = directory + os.path.sep
+        for dir in [
+            d for d in self.__dir_to_wd if d == directory or d.startswith(prefix)
+        ]:
+            wd = self.__dir_to_wd.pop(dir)
+            del self.__wd_to_dir[wd]
+            self.__inotify.rm_watch(wd)
+
+    def read_changes(self) -> Optional[Set[str]]:
+        """
+        Returns the paths that have been created, modified, removed or renamed
+        since the last call without blocking. Returns None if some events were
+        lost and all script directories need to be rescanned.
+        """
+        changes: Set[str] = set()
+        if self.__inotify is None:
+            return changes
+
+        overflowed = False
+        for wd, mask, name in self.__inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify event queue overflowed.")
+                # Drain the remaining events, everything will be rescanned.
+                overflowed = True
+                continue
+
+            dir = self.__wd_to_dir.get(wd)
+            if dir is None:
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                # The watch is removed by the kernel automatically.
+                if mask & IN_IGNORED:
+                    self.__wd_to_dir.pop(wd, None)
+                    if self.__dir_to_wd.get(dir) == wd:
+                        del self.__dir_to_wd[dir]
+                continue
+
+            path = os.path.join(dir, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if not should_ignore_script_dir(dir, name):
+                        try:
+                            self.__add_watch_recursive(path)
+                        except OSError as ex:
+                            # Most likely `fs.inotify.max_user_watches` has
+                            # been exceeded. Stop watching, so that the full
+                            # reload starts watching again or falls back to
+                            # polling.
+                            logging.warning(f"Failed to watch {path}: {ex}")
+                            self.stop()
+                            return None
+                elif mask & IN_MOVED_FROM:
+                    # Watches follow the renamed directory, remove them so
+                    # that stale paths are never reported.
+                    self.__remove_watch_recursive(path)
+
+            changes.add(path)
+
+        return None if overflowed else changes
@@ -1,16 +1,10 @@
-import ctypes
-import datetime
 import glob
-import inspect
 import json
-import locale
 import logging
 import os
-import platform
 import re
 import shutil
 import signal
-import socket
 import subprocess
 import sys
 import tempfile
@@ -19,11 +13,9 @@ import time
 import unicodedata
 from collections import OrderedDict
 from functools import lru_cache
-from pathlib import Path
 from time import sleep
 from typing import Dict, List, Optional, Union
 
-import yaml
 from utils.printc import printc
 
 logger = logging.getLogger(__name__)
@@ -38,6 +30,8 @@ TITLE_MATCH_MODE_DEFAULT = TITLE_MATCH_MODE_REGEX
 
 
 def _activate_window_win(hwnd):
+    import ctypes
+
     # Define the WINDOWPLACEMENT structure
     class WINDOWPLACEMENT(ctypes.Structure):
         _fields_ = [
@@ -72,6 +66,7 @@ def _activate_window_win(hwnd):
 
 def control_window_by_name(name, cmd="activate", match_mode=TITLE_MATCH_MODE_DEFAULT):
     if sys.platform == "win32":
+        import ctypes
         from ctypes.wintypes import BOOL, HWND, LPARAM
 
         user32 = ctypes.windll.user32
@@ -167,6 +162,8 @@ def get_ahk_lib_path() -> str:
 
 @lru_cache(maxsize=None)
 def get_ahk_exe(uia=True) -> str:
+    import ctypes
+
     if sys.platform != "win32":
         raise Exception("unsupported platform: %s" % sys.platform)
 
@@ -191,10 +188,14 @@ def get_ahk_exe(uia=True) -> str:
 
 
 def get_home_path():
+    from pathlib import Path
+
     return str(Path.home())
 
 
 def write_temp_file(text: str, file_path: str):
+    import locale
+
     name, ext = os.path.splitext(file_path)
     if file_path.startswith("."):
         name = ""
@@ -448,6 +449,8 @@ def run_in_background(cmd):
     # the SetConsoleMode Windows API with the ENABLE_VIRTUAL_TERMINAL_PROCESSING
     # flag set.
     if sys.platform == "win32":
+        import ctypes
+
         kernel32 = ctypes.windll.kernel32
         kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
@@ -563,6 +566,8 @@ def copy(src, dst, overwrite=False):
 
 def run_elevated(args: Union[List[str], str], wait=True, show_terminal_window=True):
     if sys.platform == "win32":
+        import ctypes
+
         import win32con
         from win32com.shell import shellcon
         from win32com.shell.shell import ShellExecuteEx
@@ -635,6 +640,8 @@ def is_in_termux():
 
 
 def is_in_wsl() -> bool:
+    import platform
+
     return "microsoft" in platform.uname().release.lower()
 
 
@@ -859,6 +866,8 @@ def prepend_to_path(paths: Union[str, List[str]], env: Optional[Dict[str, str]]
 
 
 def get_cur_time_str():
+    import datetime
+
     return datetime.datetime.now().strftime("%y%m%d%H%M%S")
 
 
@@ -945,10 +954,14 @@ def unzip(file, to=None):
 
 
 def get_time_str():
+    import datetime
+
     return datetime.datetime.now().strftime("%y%m%d%H%M%S")
 
 
 def get_date_str():
+    import datetime
+
     return datetime.datetime.now().strftime("%y%m%d")
 
 
@@ -1018,6 +1031,8 @@ def try_import(module_name, pkg_name=None):
 
 
 def get_ip_addresses():
+    import socket
+
     return [
         info[4][0]
         for info in socket.getaddrinfo(socket.gethostname(), None)
@@ -1115,6 +1130,7 @@ def wait_until_file_modified(f):
 
 
 def shell_execute(args):
+    import ctypes
     from ctypes import c_char_p, c_int, c_ulong, c_void_p
     from ctypes.wintypes import BOOL, DWORD, HANDLE, HINSTANCE, HKEY, HWND
 
@@ -1492,6 +1508,8 @@ def kill_proc(ps):
 def send_ctrl_c(ps):
     if ps.poll() is None:
         if sys.platform == "win32":
+            import ctypes
+
             try:
                 ctypes.windll.kernel32.GenerateConsoleCtrlEvent(0, 0)
                 ps.wait()
@@ -1549,6 +1567,8 @@ _menu_items: List[MenuItem] = []
 
 
 def menu_item(*, key=None, name=None):
+    import inspect
+
     def decorator(func):
         nonlocal name
         if name is None:
@@ -1569,6 +1589,8 @@ def menu_loop(
     unique_key=False,
     all_modules=False,
 ):
+    import inspect
+
     if all_modules:
         menu_items = _menu_items
     else:
@@ -1664,6 +1686,8 @@ def file_is_old(src, dest):
 
 
 def format_time(sec):
+    import datetime
+
     td = datetime.timedelta(seconds=sec)
     return "%02d:%02d:%02d,%03d" % (
         td.seconds // 3600,
@@ -1688,11 +1712,15 @@ def timing(f):
 
 
 def load_yaml(file: str):
+    import yaml
+
     with open(file, "r", encoding="utf-8") as f:
         return yaml.load(f.read(), Loader=yaml.FullLoader)
 
 
 def save_yaml(data, file: str):
+    import yaml
+
     with open(file, "w", encoding="utf-8", newline="\n") as f:
         yaml.dump(data, f, default_flow_style=False, allow_unicode=True)
 
@@ -1775,6 +1803,8 @@ def pause():
 
 def keep_awake():
     if sys.platform == "win32":
+        import ctypes
+
         ES_CONTINUOUS = 0x80000000
         ES_SYSTEM_REQUIRED = 0x00000001
         ES_DISPLAY_REQUIRED = 0x00000002
@@ -1825,6 +1855,12 @@ def run_at_startup(name, cmdline):
 
 class IgnoreSigInt(object):
     def __enter__(self):
+        # Signal handlers can only be set in the main thread, which is also the
+        # only thread that receives SIGINT.
+        self.original_handler = None
+        if threading.current_thread() is not threading.main_thread():
+            return self
+
         self.original_handler = signal.getsignal(signal.SIGINT)
 
         def handler(signum, frame):
@@ -1834,7 +1870,8 @@ class IgnoreSigInt(object):
         return self
 
     def __exit__(self, type, value, tb):
-        signal.signal(signal.SIGINT, self.original_handler)
+        if self.original_handler is not None:
+            signal.signal(signal.SIGINT, self.original_handler)
 
 
 def get_hotkey_abbr(hotkey: str):
@@ -1,7 +1,36 @@
 import logging
+import os
 import re
 import subprocess
-from typing import Callable, List, Optional
+from functools import lru_cache
+from types import CodeType
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+_DELIMITER = re.compile(r"{{(.*?)}}", re.DOTALL)
+
+# (template file, file locator) -> (mtime, template)
+_template_file_cache: Dict[Tuple[str, Optional[Callable]], Tuple[float, Any]] = {}
+
+
+@lru_cache(maxsize=256)
+def _compile_tokens(text: str) -> Tuple[Tuple[bool, Union[str, CodeType]], ...]:
+    tokens: List[Tuple[bool, Union[str, CodeType]]] = []
+    for index, token in enumerate(_DELIMITER.split(text)):
+        if index % 2 == 0:
+            # plain string
+            if token:
+                tokens.append((False, token))
+        else:
+            # code block, compiled once so that it is not parsed on every render.
+            # Like `eval()`, leading spaces and tabs are ignored.
+            try:
+                tokens.append(
+                    (True, compile(token.lstrip(" \t"), "<template>", "eval"))
+                )
+            except SyntaxError:
+                # Let `eval()` raise the error when the template is rendered.
+                tokens.append((True, token))
+    return tuple(tokens)
 
 
 class Template:
@@ -10,21 +39,12 @@ class Template:
     def __init__(
         self, text, file_locator: Optional[Callable[[str], Optional[str]]] = None
     ):
-        self.delimiter = re.compile(r"{{(.*?)}}", re.DOTALL)
+        self.delimiter = _DELIMITER
         self.tokens = self.compile(text)
         self.file_locator = file_locator
 
     def compile(self, text):
-        tokens = []
-        for index, token in enumerate(self.delimiter.split(text)):
-            if index % 2 == 0:
-                # plain string
-                if token:
-                    tokens.append((False, token))
-            else:
-                # code block
-                tokens.append((True, token))
-        return tokens
+        return _compile_tokens(text)
 
     def render(
         self, context=None, undefined_names: Optional[List[str]] = None, **kwargs
@@ -48,9 +68,7 @@ class Template:
 
             if self.file_locator:
                 file = self.file_locator(file)
-            with open(file, "r", encoding="utf-8") as f:
-                s = f.read()
-            return Template(s, file_locator=self.file_locator).render(
+            return load_template_file(file, file_locator=self.file_locator).render(
                 context={**global_context, **context},
                 undefined_names=undefined_names,
                 **kwargs,
@@ -90,14 +108,33 @@ class Template:
     __call__ = render
 
 
+def load_template_file(
+    file: str, file_locator: Optional[Callable[[str], Optional[str]]] = None
+) -> Template:
+    """Returns the compiled template, which is cached until the file is modified."""
+    # Relative paths refer to different files after a chdir.
+    file = os.path.abspath(file)
+    mtime = os.path.getmtime(file)
+    key = (file, file_locator)
+    cached = _template_file_cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(file, "r", encoding="utf-8") as f:
+        template = Template(f.read(), file_locator=file_locator)
+    _template_file_cache[key] = (mtime, template)
+    return template
+
+
 def render_template_file(
     template_file,
     output_file,
     context=None,
     undefined_names: Optional[List[str]] = None,
 ):
-    with open(template_file, "r", encoding="utf-8") as f:
-        s = Template(f.read()).render(context, undefined_names=undefined_names)
+    s = load_template_file(template_file).render(
+        context, undefined_names=undefined_names
+    )
 
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(s)
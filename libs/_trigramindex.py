@@ -0,0 +1,366 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Union
+
+from _script import get_all_scripts, get_data_dir
+
+# Bump the version whenever the layout of the index file changes, so that stale
+# index files are discarded instead of being misinterpreted.
+TRIGRAM_INDEX_VERSION = 1
+
+# Larger files are not indexed and are always returned as candidates.
+MAX_INDEXED_FILE_SIZE = 16 * 1024 * 1024
+
+# The last two segments are merged unless the former has this many times more
+# postings than the latter, which keeps the number of segments logarithmic
+# while each posting is only rewritten a few times. All segments are merged
+# when more than half of the indexed files have been changed or removed.
+SEGMENT_MERGE_FACTOR = 4
+
+
+# Sorted unsigned 32-bit integers, built in memory or memory-mapped from a
+# segment file.
+_UIntArray = Union["array[int]", memoryview]
+
+
+def get_script_trigram_index_dir() -> str:
+    return os.path.join(get_data_dir(), "script_trigram_index")
+
+
+def get_trigrams(data: bytes) -> Set[int]:
+    return {a << 16 | b << 8 | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+
+class _Segment:
+    """
+    Immutable inverted index: the postings of `keys[i]` (sorted trigrams) are
+    `ids[offsets[i] : offsets[i + 1]]` (sorted file ids).
+
+    Saved segments are memory-mapped, so that loading the index does not need
+    to read all postings.
+    """
+
+    def __init__(
+        self,
+        keys: _UIntArray,
+        offsets: _UIntArray,
+        ids: _UIntArray,
+        name: Optional[str] = None,
+    ):
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+        self.name = name  # file name of the segment, None if not saved yet
+
+    @staticmethod
+    def build(postings: Dict[int, List[int]]) -> "_Segment":
+        keys = array("I", sorted(postings.keys()))
+        offsets = array("I", [0])
+        ids = array("I")
+        for key in keys:
+            ids.extend(postings[key])
+            offsets.append(len(ids))
+        return _Segment(keys, offsets, ids)
+
+    @staticmethod
+    def load(file: str, num_keys: int, num_ids: int) -> "_Segment":
+        with open(file, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) != (num_keys * 2 + 1 + num_ids) * 4:
+            raise ValueError("Invalid segment size: %s" % file)
+
+        data = memoryview(mm).cast("I")
+        return _Segment(
+            keys=data[:num_keys],
+            offsets=data[num_keys : num_keys * 2 + 1],
+            ids=data[num_keys * 2 + 1 :],
+            name=os.path.basename(file),
+        )
+
+    def save(self, file: str):
+        with open(file, "wb") as f:
+            for a in (self.keys, self.offsets, self.ids):
+                f.write(a)
+        self.name = os.path.basename(file)
+
+    def get_postings(self, trigram: int) -> Optional[Sequence[int]]:
+        i = bisect_left(self.keys, trigram)
+        if i == len(self.keys) or self.keys[i] != trigram:
+            return None
+        return self.ids[self.offsets[i] : self.offsets[i + 1]]
+
+
+class TrigramIndex:
+    """
+    Persistent trigram index over file contents that lives in the data dir.
+
+    A file can only contain a string if it contains all trigrams (3-byte
+    substrings) of the string, so the index narrows down the files that need to
+    be scanned. Files are re-indexed when their mtime or size changes. Changes
+    are written as new segment files, and a file that has changed or been
+    removed keeps its old postings until segments are merged, with its id
+    marked as dead.
+    """
+
+    def __init__(self, index_dir: Optional[str] = None):
+        self.index_dir = index_dir if index_dir else get_script_trigram_index_dir()
+
+        # File id -> [path, mtime, size], or None if the file id is dead.
+        self.__files: List[Optional[List]] = []
+        self.__path_to_id: Dict[str, int] = {}
+        self.__segments: List[_Segment] = []
+        self.__dirty = False
+
+        self.load()
+
+    def __get_manifest_file(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    def load(self):
+        try:
+            with open(self.__get_manifest_file(), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return
+
+        if (
+            manifest.get("version") != TRIGRAM_INDEX_VERSION
+            or manifest.get("byteorder") != sys.byteorder
+        ):
+            logging.info("Trigram index version mismatch, rebuilding.")
+            return
+
+        segments: List[_Segment] = []
+        try:
+            for name, num_keys, num_ids in manifest["segments"]:
+                segments.append(
+                    _Segment.load(os.path.join(self.index_dir, name), num_keys, num_ids)
+                )
+        except (OSError, ValueError) as ex:
+            # The segment may have been merged by another process in the meantime.
+            logging.warning(f"Failed to load trigram index, rebuilding: {ex}")
+            return
+
+        self.__files = manifest["files"]
+        self.__path_to_id = {
+            file[0]: i for i, file in enumerate(self.__files) if file is not None
+        }
+        self.__segments = segments
+
+    def save(self):
+        if not self.__dirty:
+            return
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        for segment in self.__segments:
+            if segment.name is None:
+                segment.save(
+                    os.path.join(
+                        self.index_dir, "%d-%d.seg" % (os.getpid(), time.time_ns())
+                    )
+                )
+
+        # Write to a temp file first and atomically replace the manifest, so
+        # that a crash never leaves a partially written index behind.
+        manifest_file = self.__get_manifest_file()
+        tmp_file = manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": TRIGRAM_INDEX_VERSION,
+                    "byteorder": sys.byteorder,
+                    "files": self.__files,
+                    "segments": [
+                        [s.name, len(s.keys), len(s.ids)] for s in self.__segments
+                    ],
+                },
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_file, manifest_file)
+        self.__dirty = False
+
+        # Remove the segments that have been merged.
+        names = set(s.name for s in self.__segments)
+        for file in glob.glob(os.path.join(self.index_dir, "*.seg")):
+            if os.path.basename(file) not in names:
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass  # still mapped by another process on Windows
+
+    def update(self, files: Iterable[str]):
+        """
+        Synchronize the index with `files`: index new and modified files and
+        forget about the files that are no longer in the list.
+        """
+        visited: Set[str] = set()
+        new_postings: Dict[int, List[int]] = {}
+        for file in files:
+            if file in visited:
+                continue
+            visited.add(file)
+
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+
+            file_id = self.__path_to_id.get(file)
+            if file_id is not None:
+                _, mtime, size = self.__files[file_id]  # type: ignore
+                if mtime == st.st_mtime and size == st.st_size:
+                    continue
+                self.__files[file_id] = None
+                del self.__path_to_id[file]
+                self.__dirty = True
+
+            trigrams: Set[int] = set()
+            if st.st_size <= MAX_INDEXED_FILE_SIZE:
+                try:
+                    with open(file, "rb") as f:
+                        trigrams = get_trigrams(f.read())
+                except OSError:
+                    continue
+
+            file_id = len(self.__files)
+            self.__files.append([file, st.st_mtime, st.st_size])
+            self.__path_to_id[file] = file_id
+            for trigram in trigrams:
+                if trigram in new_postings:
+                    new_postings[trigram].append(file_id)
+                else:
+                    new_postings[trigram] = [file_id]
+            self.__dirty = True
+
+        for file in list(self.__path_to_id.keys()):
+            if file not in visited:
+                self.__files[self.__path_to_id.pop(file)] = None
+                self.__dirty = True
+
+        if new_postings:
+            self.__segments.append(_Segment.build(new_postings))
+
+        num_dead = len(self.__files) - len(self.__path_to_id)
+        if num_dead > len(self.__path_to_id):
+            self.__merge_segments(0, renumber=True)
+        else:
+            segments = self.__segments
+            while (
+                len(segments) >= 2
+                and len(segments[-2].ids) < len(segments[-1].ids) * SEGMENT_MERGE_FACTOR
+            ):
+                self.__merge_segments(len(segments) - 2, renumber=False)
+
+    def __merge_segments(self, start: int, renumber: bool):
+        """
+        Merge `self.__segments[start:]` into a single segment and drop the
+        postings of dead files. If `renumber` is True, the live files are
+        renumbered so that dead file ids can be forgotten.
+        """
+        remap = array("i", range(len(self.__files)))
+        files: List[Optional[List]] = []
+        for i, file in enumerate(self.__files):
+            if file is None:
+                remap[i] = -1
+            elif renumber:
+                remap[i] = len(files)
+                files.append(file)
+
+        postings: Dict[int, List[int]] = {}
+        for segment in self.__segments[start:]:
+            keys, offsets, ids = segment.keys, segment.offsets, segment.ids
+            for i, key in enumerate(keys):
+                new_ids = [
+                    remap[id]
+                    for id in ids[offsets[i] : offsets[i + 1]]
+                    if remap[id] >= 0
+                ]
+                if new_ids:
+                    if key in postings:
+                        # Segments are appended in file id order.
+                        postings[key].extend(new_ids)
+                    else:
+                        postings[key] = new_ids
+
+        if renumber:
+            self.__files = files
+            self.__path_to_id = {
+                file[0]: i for i, file in enumerate(files)  # type: ignore
+            }
+        del self.__segments[start:]
+        if postings:
+            self.__segments.append(_Segment.build(postings))
+        self.__dirty = True
+
+    def find_files(self, s: str) -> Set[str]:
+        """
+        Returns the indexed files that may contain `s`. Files that are not
+        returned are guaranteed not to contain it.
+        """
+        trigrams = get_trigrams(s.encode("utf-8"))
+        if not trigrams:
+            return set(self.__path_to_id.keys())
+
+        file_ids: Set[int] = set()
+        for segment in self.__segments:
+            file_ids.update(_find_file_ids(segment, trigrams))
+
+        result: Set[str] = set()
+        for file_id in file_ids:
+            file = self.__files[file_id]
+            if file is not None:
+                result.add(file[0])
+
+        # Large files are not indexed.
+        for file in self.__files:
+            if file is not None and file[2] > MAX_INDEXED_FILE_SIZE:
+                result.add(file[0])
+
+        return result
+
+
+def _find_file_ids(segment: _Segment, trigrams: Set[int]) -> Set[int]:
+    postings_list: List[Sequence[int]] = []
+    for trigram in trigrams:
+        postings = segment.get_postings(trigram)
+        if postings is None:
+            return set()
+        postings_list.append(postings)
+
+    # Start with the rarest trigram to keep the intermediate sets small.
+    postings_list.sort(key=len)
+    file_ids = set(postings_list[0])
+    for postings in postings_list[1:]:
+        file_ids.intersection_update(postings)
+        if not file_ids:
+            break
+    return file_ids
+
+
+def find_scripts_containing(s: str, files: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Returns the scripts that may contain `s`, in the same order as
+    `get_all_scripts()`. The index is updated incrementally before querying.
+    """
+    if files is None:
+        files = get_all_scripts()
+    files = list(files)
+
+    index = TrigramIndex()
+    index.update(files)
+    try:
+        index.save()
+    except OSError as ex:
+        logging.warning(f"Failed to save trigram index: {ex}")
+
+    candidates = index.find_files(s)
+    return [file for file in files if file in candidates]
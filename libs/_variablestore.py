@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from _filelock import FileLock
+
+# Writes issued within this time window are batched into a single file write.
+WRITE_BEHIND_DELAY_SECS = 0.1
+
+
+class VariableStore:
+    """
+    Process-local cache of a JSON variable file.
+
+    The parsed file is kept in memory and only read again when its mtime
+    changes, i.e. when it has been written by another process. Writes are
+    queued and flushed by a writer thread shortly after, so that a burst of
+    updates results in a single atomic file write.
+    """
+
+    def __init__(self, file: str, write_delay: float = WRITE_BEHIND_DELAY_SECS):
+        self.__file = file
+        self.__write_delay = write_delay
+        self.__lock = threading.Lock()
+        self.__variables: Dict[str, str] = {}
+        self.__mtime: Optional[float] = None
+        self.__pending: Dict[str, str] = {}
+        self.__writer: Optional[threading.Thread] = None
+
+    def __load_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.__file)
+        except FileNotFoundError:
+            self.__variables = {}
+            self.__mtime = None
+            return
+
+        if mtime != self.__mtime:
+            try:
+                with open(self.__file, "r", encoding="utf-8") as f:
+                    self.__variables = json.load(f)
+                self.__mtime = mtime
+            except json.decoder.JSONDecodeError:
+                logging.warning(f"Failed to parse variable file: {self.__file}")
+
+    def get_all(self) -> Dict[str, str]:
+        with self.__lock:
+            self.__load_if_changed()
+            return {**self.__variables, **self.__pending}
+
+    def get(self, name: str) -> Optional[str]:
+        with self.__lock:
+            if name in self.__pending:
+                return self.__pending[name]
+
+            self.__load_if_changed()
+            return self.__variables.get(name)
+
+    def update(self, variables: Dict[str, str]):
+        with self.__lock:
+            self.__pending.update(variables)
+            if self.__writer is None:
+                # The writer thread is not a daemon thread, so that pending
+                # writes are never lost when the process exits.
+                self.__writer = threading.Thread(target=self.__writer_main)
+                self.__writer.start()
+
+    def __writer_main(self):
+        while True:
+            time.sleep(self.__write_delay)
+            self.flush()
+
+            with self.__lock:
+                if not self.__pending:
+                    self.__writer = None
+                    return
+
+    def flush(self):
+        with FileLock("access_variable"):
+            with self.__lock:
+                if not self.__pending:
+                    return
+
+                # Merge with the changes made by other processes.
+                self.__load_if_changed()
+                self.__variables.update(self.__pending)
+                self.__pending.clear()
+                data = self.__variables.copy()
+
+            # Replace the file atomically so that readers never see a partially
+            # written file.
+            tmp_file = self.__file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_file, self.__file)
+
+            with self.__lock:
+                self.__mtime = os.path.getmtime(self.__file)
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+from typing import List, Set
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+_MONTH_NAMES = [
+    "jan",
+    "feb",
+    "mar",
+    "apr",
+    "may",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "oct",
+    "nov",
+    "dec",
+]
+_WEEKDAY_NAMES = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+# Give up searching for the next matching time after this many days, e.g. for
+# "0 0 30 2 *" which never matches.
+_MAX_SEARCH_DAYS = 366 * 5
+
+
+def _parse_value(s: str, names: List[str], offset: int) -> int:
+    s = s.lower()
+    if s in names:
+        return names.index(s) + offset
+    return int(s)
+
+
+def _parse_field(
+    field: str, min_val: int, max_val: int, names: List[str] = [], offset: int = 0
+) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.split(","):
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"Invalid step: {step}")
+        else:
+            step = 1
+
+        if part == "*":
+            start, end = min_val, max_val
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = _parse_value(a, names, offset), _parse_value(b, names, offset)
+        else:
+            start = _parse_value(part, names, offset)
+            # "a/n" means from a to the max value with step n.
+            end = max_val if step > 1 else start
+
+        if start < min_val or end > max_val or start > end:
+            raise ValueError(f"Value out of range: {part}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    Standard 5-field cron expression: minute, hour, day of month, month and
+    day of week, evaluated in local time. Lists, ranges, steps, month and
+    weekday names and aliases like "@daily" are supported.
+    """
+
+    def __init__(self, expr: str) -> None:
+        self.expr = expr
+        fields = _ALIASES.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f'Invalid cron expression: "{expr}"')
+
+        try:
+            self.minutes = _parse_field(fields[0], 0, 59)
+            self.hours = _parse_field(fields[1], 0, 23)
+            self.days = _parse_field(fields[2], 1, 31)
+            self.months = _parse_field(fields[3], 1, 12, _MONTH_NAMES, offset=1)
+            weekdays = _parse_field(fields[4], 0, 7, _WEEKDAY_NAMES)
+        except ValueError as ex:
+            raise ValueError(f'Invalid cron expression: "{expr}": {ex}')
+
+        # Both 0 and 7 are Sunday.
+        if 7 in weekdays:
+            weekdays.discard(7)
+            weekdays.add(0)
+        self.weekdays = weekdays
+
+        # If both day fields are restricted, a day matches if either matches.
+        self.__days_restricted = not fields[2].startswith("*")
+        self.__weekdays_restricted = not fields[4].startswith("*")
+
+    def __match_day(self, t: datetime) -> bool:
+        day_match = t.day in self.days
+        weekday_match = (t.weekday() + 1) % 7 in self.weekdays
+        if self.__days_restricted and self.__weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def matches(self, ts: float) -> bool:
+        t = datetime.fromtimestamp(ts)
+        return (
+            t.second == 0
+            and t.minute in self.minutes
+            and t.hour in self.hours
+            and t.month in self.months
+            and self.__match_day(t)
+        )
+
+    def get_next_time(self, after: float) -> float:
+        """Returns the first matching time (unix time) later than `after`."""
+        t = datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+        t += timedelta(minutes=1)
+        end = t + timedelta(days=_MAX_SEARCH_DAYS)
+        while t < end:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self.__match_day(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t.timestamp()
+
+        raise ValueError(f'Cron expression never matches: "{self.expr}"')
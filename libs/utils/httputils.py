@@ -0,0 +1,131 @@
+import email.utils
+import gzip
+import mimetypes
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+# Copied from https://github.com/danvk/RangeHTTPServer/tree/ff4277417c6c8ea2435399659c25a172dbdfd24f
+
+
+def copy_byte_range(infile, outfile, start=None, stop=None, bufsize=16 * 1024):
+    """Like shutil.copyfileobj, but only copy a range of the streams.
+    Both start and stop are inclusive.
+    """
+    if start is not None:
+        infile.seek(start)
+    while 1:
+        to_read = min(bufsize, stop + 1 - infile.tell() if stop else bufsize)
+        buf = infile.read(to_read)
+        if not buf:
+            break
+        outfile.write(buf)
+
+
+BYTE_RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)?$")
+
+
+def parse_byte_range(byte_range):
+    """Returns the two numbers in 'bytes=123-456' or throws ValueError.
+    The last number or both numbers may be None.
+    """
+    if byte_range.strip() == "":
+        return None, None
+
+    m = BYTE_RANGE_RE.match(byte_range)
+    if not m:
+        raise ValueError("Invalid byte range %s" % byte_range)
+
+    first, last = [int(x) if x else None for x in m.groups()]
+    if last is not None and first is not None and last < first:
+        raise ValueError("Invalid byte range %s" % byte_range)
+    return first, last
+
+
+_SUFFIX_BYTE_RANGE_RE = re.compile(r"bytes=-(\d+)$")
+
+
+def get_byte_range(byte_range: str, file_len: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the inclusive range of bytes to send for the `Range` header, or
+    None if the range cannot be satisfied. Unlike `parse_byte_range()`, suffix
+    ranges like 'bytes=-500' are supported as well. Throws ValueError if the
+    header is invalid.
+    """
+    m = _SUFFIX_BYTE_RANGE_RE.match(byte_range.strip())
+    if m:
+        suffix_len = int(m.group(1))
+        if suffix_len == 0 or file_len == 0:
+            return None
+        return max(0, file_len - suffix_len), file_len - 1
+
+    first, last = parse_byte_range(byte_range)
+    if first is None:
+        raise ValueError("Invalid byte range %s" % byte_range)
+    if first >= file_len:
+        return None
+    if last is None or last >= file_len:
+        last = file_len - 1
+    return first, last
+
+
+# Same as `scripts/r/http_server.py`, so that browsers can play them.
+_EXTRA_CONTENT_TYPES = {".mkv": "video/webm"}
+
+
+def guess_content_type(path: str, default="text/plain") -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _EXTRA_CONTENT_TYPES:
+        return _EXTRA_CONTENT_TYPES[ext]
+
+    content_type, _ = mimetypes.guess_type(path)
+    if content_type is None:
+        return default
+    if content_type.startswith("text/") or content_type in (
+        "application/javascript",
+        "application/json",
+    ):
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith("text/") or content_type.startswith(
+        ("application/javascript", "application/json", "application/xml")
+    )
+
+
+def get_etag(st: os.stat_result) -> str:
+    return '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+
+
+def is_not_modified(
+    get_header: Callable[[str], Optional[str]], etag: str, mtime: float
+) -> bool:
+    """
+    Whether the client's cached copy is still valid according to the
+    `If-None-Match` or `If-Modified-Since` request headers.
+    """
+    if_none_match = get_header("If-None-Match")
+    if if_none_match is not None:
+        # Weak comparison, the gzipped variant has its own suffix.
+        etags = [x.strip().removeprefix("W/") for x in if_none_match.split(",")]
+        return "*" in etags or etag in etags or etag[:-1] + '-gz"' in etags
+
+    if_modified_since = get_header("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+
+    return False
+
+
+@lru_cache(maxsize=32)
+def get_gzipped_file(path: str, mtime_ns: int, size: int) -> bytes:
+    """Returns the gzipped content of the file, cached per file version."""
+    with open(path, "rb") as f:
+        return gzip.compress(f.read(), compresslevel=6, mtime=0)
@@ -0,0 +1,90 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+from typing import List, NamedTuple, Optional
+
+# See also: https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyEvent(NamedTuple):
+    wd: int
+    mask: int
+    name: str
+
+
+class Inotify:
+    """Minimal non-blocking inotify wrapper based on ctypes."""
+
+    def __init__(self):
+        self.__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1() failed: %s" % os.strerror(err))
+
+    @staticmethod
+    def is_supported() -> bool:
+        return sys.platform == "linux" and ctypes.util.find_library("c") is not None
+
+    def fileno(self) -> int:
+        return self.__fd
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def add_watch(self, path: str, mask: int) -> Optional[int]:
+        """
+        Returns the watch descriptor, or None if the path does not exist.
+        """
+        wd = self.__libc.inotify_add_watch(
+            self.__fd, os.fsencode(path), ctypes.c_uint32(mask)
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT or err == errno.ENOTDIR:
+                return None
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self.__libc.inotify_rm_watch(self.__fd, wd)
+
+    def read_events(self) -> List[InotifyEvent]:
+        """Returns all pending events without blocking."""
+        events: List[InotifyEvent] = []
+        while True:
+            try:
+                buf = os.read(self.__fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(buf[offset : offset + name_len].rstrip(b"\0"))
+                offset += name_len
+                events.append(InotifyEvent(wd=wd, mask=mask, name=name))
+
+        return events
@@ -5,6 +5,7 @@ import os
 import re
 import sys
 import time
+from functools import lru_cache
 from typing import (
     Any,
     Callable,
@@ -15,6 +16,10 @@ from typing import (
     NamedTuple,
     Optional,
     OrderedDict,
+    Protocol,
+    Sequence,
+    Set,
+    Tuple,
     TypeVar,
     Union,
 )
@@ -25,6 +30,12 @@ from utils.clip import get_clip, set_clip
 
 GUTTER_SIZE = 1
 
+# Matching items in a huge list is split into time slices of this length.
+MATCH_TIME_SLICE_SECS = 0.05
+
+# Maximum number of item texts whose highlight color is cached.
+ITEM_COLOR_CACHE_SIZE = 10000
+
 
 def _is_backspace_key(ch: Union[int, str]):
     return (
@@ -52,22 +63,34 @@ class _Command:
             return self.name
 
 
+@lru_cache(maxsize=64)
+def _get_fuzzy_keywords(patt: str) -> Tuple[str, ...]:
+    return tuple(x for x in patt.lower().split(" ") if x)
+
+
+@lru_cache(maxsize=64)
+def _compile_regex(patt: str) -> Optional[re.Pattern]:
+    try:
+        return re.compile(patt, re.IGNORECASE)
+    except re.error:
+        return None
+
+
 def _match_fuzzy(item: Any, patt: str) -> bool:
-    patt = patt.lower()
-    if not patt:
+    keywords = _get_fuzzy_keywords(patt)
+    if not keywords:
         return True
     else:
-        return all([(x in str(item).lower()) for x in patt.split(" ")])
+        s = str(item).lower()
+        return all(x in s for x in keywords)
 
 
 def _match_regex(item: Any, patt: str) -> bool:
     if not patt:
         return True
     else:
-        try:
-            return re.search(patt, str(item), re.IGNORECASE) is not None
-        except re.error:
-            return False
+        regex = _compile_regex(patt)
+        return regex is not None and regex.search(str(item)) is not None
 
 
 def _match(item: Any, patt: str, fuzzy_match: bool) -> bool:
@@ -77,6 +100,248 @@ def _match(item: Any, patt: str, fuzzy_match: bool) -> bool:
         return _match_regex(item, patt)
 
 
+def _score_fuzzy(s: str, keywords: Tuple[str, ...]) -> int:
+    # Similar to fzf: prefer keywords that match at the beginning of a word,
+    # then earlier matches, then shorter items.
+    score = 0
+    for keyword in keywords:
+        pos = s.find(keyword)
+        if pos == 0 or not s[pos - 1].isalnum():
+            score += 100
+        score -= min(pos, 50)
+    return score * 1000 - min(len(s), 999)
+
+
+def _score_regex(s: str, regex: re.Pattern) -> int:
+    m = regex.search(s)
+    assert m is not None
+    score = -min(m.start(), 50) - min(m.end() - m.start(), 50)
+    if m.start() == 0 or not s[m.start() - 1].isalnum():
+        score += 100
+    return score * 1000 - min(len(s), 999)
+
+
+class _ItemMatcher:
+    """
+    Match items against the search pattern, keeping the string of each item
+    so that it is not computed again on every keystroke. When the new pattern
+    is narrower than the previous one, only the previously matched items are
+    tested again.
+
+    Items may only be appended to the matched list. `invalidate()` must be
+    called when items are removed, replaced or reordered in place.
+
+    Matching can be time-sliced: `start()` begins a pass that is advanced by
+    `resume()` in chunks, so that a huge item list never blocks the UI.
+    """
+
+    CHUNK_SIZE = 10000
+
+    def __init__(self, fuzzy_match: bool, rank: bool = False):
+        self.__fuzzy_match = fuzzy_match
+        self.__rank = rank
+
+        # Item strings, lowered in fuzzy mode, of the items being matched. The
+        # strings are computed lazily while matching.
+        self.__keys: List[str] = []
+        self.__items: Optional["MenuItems[Any]"] = None
+
+        # Result of the last completed pass.
+        self.__last_patt: Optional[str] = None
+        self.__last_item_count = 0
+        self.__last_indices: List[int] = []
+
+        # The pass in progress.
+        self.__patt: Optional[str] = None
+        self.__test: Optional[Callable[[str], bool]] = None
+        self.__score: Optional[Callable[[str], int]] = None
+        self.__item_count = 0
+        self.__candidates: List[Sequence[int]] = []
+        self.__candidate_pos = 0
+        self.__num_candidates = 0
+        self.__num_tested = 0
+        self.__indices: List[int] = []
+
+    def invalidate(self):
+        """Must be called when the string of an existing item has changed."""
+        self.__keys.clear()
+        self.__items = None
+        self.__last_patt = None
+        self.__last_item_count = 0
+        self.__last_indices = []
+
+        # Abort the pass in progress.
+        self.__patt = None
+        self.__item_count = 0
+        self.__candidates = []
+        self.__indices = []
+
+    def __update_items(self, items: "MenuItems[Any]"):
+        # Items beyond the item count of the last pass have been appended. The
+        # list is not compared, which would cost O(n) on every keystroke, only
+        # a replaced or shrunk list is detected.
+        if items is not self.__items or len(items) < max(
+            self.__item_count, self.__last_item_count
+        ):
+            self.invalidate()
+            self.__items = items
+
+    def __update_keys(self, end: int):
+        keys = self.__keys
+        if len(keys) < end:
+            items = self.__items
+            assert items is not None
+            new_items = (items[i] for i in range(len(keys), end))
+            if self.__fuzzy_match:
+                keys.extend(str(item).lower() for item in new_items)
+            else:
+                keys.extend(str(item) for item in new_items)
+
+    def __is_narrower(self, patt: str) -> bool:
+        # Whether the items matching `patt` are a subset of the items matching
+        # the last pattern.
+        if self.__last_patt is None:
+            return False
+        elif patt == self.__last_patt:
+            return True
+        elif self.__fuzzy_match:
+            keywords = _get_fuzzy_keywords(patt)
+            return all(
+                any(x in y for y in keywords)
+                for x in _get_fuzzy_keywords(self.__last_patt)
+            )
+        else:
+            return False
+
+    def is_matching(self) -> bool:
+        return self.__patt is not None
+
+    def get_progress(self) -> Tuple[int, int]:
+        """Returns the number of tested items and the number of items to test."""
+        return self.__num_tested, self.__num_candidates
+
+    def start(self, items: "MenuItems[Any]", patt: str):
+        """
+        Start a new pass, which aborts the pass in progress. If the pattern is
+        unchanged and items have only been appended, the pass in progress is
+        continued instead.
+        """
+        self.__update_items(items)
+        if self.__patt is not None and self.__patt == patt:
+            self.__add_candidates(range(self.__item_count, len(items)))
+            self.__item_count = len(items)
+            return
+
+        indices: List[int] = []
+        if patt == self.__last_patt:
+            # Only match the items appended since the last pass.
+            # Copied, since the last result must stay unchanged until this pass
+            # is done. A narrower pattern would test the items appended to it
+            # twice.
+            indices = self.__last_indices.copy()
+            candidates: List[Sequence[int]] = [
+                range(self.__last_item_count, len(items))
+            ]
+        elif self.__is_narrower(patt):
+            candidates = [
+                self.__last_indices,
+                range(self.__last_item_count, len(items)),
+            ]
+        else:
+            candidates = [range(len(items))]
+
+        self.__test = None
+        self.__score = None
+        if self.__fuzzy_match:
+            keywords = _get_fuzzy_keywords(patt)
+            if keywords:
+                self.__test = lambda s: all(x in s for x in keywords)
+                self.__score = lambda s: _score_fuzzy(s, keywords)
+        elif patt:
+            regex = _compile_regex(patt)
+            if regex is not None:
+                search = regex.search
+                self.__test = lambda s: search(s) is not None
+                self.__score = lambda s: _score_regex(s, regex)
+            else:
+                self.__test = lambda s: False
+
+        self.__patt = patt
+        self.__item_count = len(items)
+        self.__candidates = []
+        self.__candidate_pos = 0
+        self.__num_candidates = 0
+        self.__num_tested = 0
+        self.__indices = indices
+        for c in candidates:
+            self.__add_candidates(c)
+
+    def __add_candidates(self, candidates: Sequence[int]):
+        if len(candidates) > 0:
+            self.__candidates.append(candidates)
+            self.__num_candidates += len(candidates)
+
+    def resume(self, timeout: Optional[float] = None) -> bool:
+        """
+        Continue the pass in progress until it is done or `timeout` seconds
+        have elapsed. Returns true if the pass is done.
+        """
+        start_time = time.time()
+        test = self.__test
+        keys = self.__keys
+        while self.__candidates:
+            candidates = self.__candidates[0]
+            begin = self.__candidate_pos
+            end = min(begin + _ItemMatcher.CHUNK_SIZE, len(candidates))
+            chunk = candidates[begin:end]
+            self.__update_keys(chunk[-1] + 1)
+
+            if test is None:
+                self.__indices.extend(chunk)
+            else:
+                self.__indices.extend(i for i in chunk if test(keys[i]))
+
+            self.__num_tested += end - begin
+            if end < len(candidates):
+                self.__candidate_pos = end
+            else:
+                self.__candidates.pop(0)
+                self.__candidate_pos = 0
+
+            if timeout is not None and time.time() - start_time >= timeout:
+                break
+
+        if self.__candidates:
+            return False
+
+        self.__last_patt = self.__patt
+        self.__last_item_count = self.__item_count
+        self.__last_indices = self.__indices
+        self.__patt = None
+        return True
+
+    def get_indices(self) -> List[int]:
+        """
+        Returns the indices of the matched items. While a pass is in progress,
+        the items matched so far are returned.
+        """
+        if self.__patt is not None:
+            return self.__indices.copy()
+        elif self.__rank and self.__score is not None:
+            # Sorting is stable, items with the same score keep their order.
+            score = self.__score
+            keys = self.__keys
+            return sorted(self.__last_indices, key=lambda i: -score(keys[i]))
+        else:
+            return self.__last_indices.copy()
+
+    def match(self, items: List[Any], patt: str) -> List[int]:
+        """Returns the indices of the matched items."""
+        self.start(items, patt)
+        self.resume()
+        return self.get_indices()
+
+
 class _InputWidget:
     def __init__(self, prompt="", text="", ascii_only=False):
         self.prompt = prompt
@@ -158,12 +423,47 @@ class _InputWidget:
             self._on_char(ch)
 
     def _on_char(self, ch: str):
-        if not self.ascii_only or (self.ascii_only and re.match("[\x00-\x7F]", ch)):
+        if not self.ascii_only or (self.ascii_only and re.match("[\x00-\x7f]", ch)):
             self.text = self.text[: self.caret_pos] + ch + self.text[self.caret_pos :]
             self.caret_pos += 1
 
 
 T = TypeVar("T")
+T_co = TypeVar("T_co", covariant=True)
+
+
+class MenuItems(Protocol[T_co]):
+    """
+    Items of a menu, either a list or a read-only sequence that can be cleared
+    such as `MappedLines`. Only lists support appending items.
+    """
+
+    def __len__(self) -> int: ...
+
+    def __getitem__(self, i: int) -> T_co: ...
+
+    def __iter__(self) -> Iterator[T_co]: ...
+
+    def clear(self) -> None: ...
+
+
+class MenuItemMatcher(Protocol):
+    """
+    Matches the items of a menu against the search pattern in passes that
+    are advanced in time slices, see `_ItemMatcher`.
+    """
+
+    def invalidate(self) -> None: ...
+
+    def is_matching(self) -> bool: ...
+
+    def get_progress(self) -> Tuple[int, int]: ...
+
+    def start(self, items: MenuItems[Any], patt: str) -> None: ...
+
+    def resume(self, timeout: Optional[float] = None) -> bool: ...
+
+    def get_indices(self) -> Sequence[int]: ...
 
 
 class Menu(Generic[T]):
@@ -193,7 +493,7 @@ class Menu(Generic[T]):
         close_on_selection=True,
         debug=False,
         history: Optional[str] = None,
-        items: Optional[List[T]] = None,
+        items: Optional["MenuItems[T]"] = None,
         prompt="",
         text="",
         on_item_selected: Optional[Callable[[T], None]] = None,
@@ -205,8 +505,9 @@ class Menu(Generic[T]):
         wrap_text=False,
         search_mode=True,
         line_number=True,
+        rank_matches=False,
     ):
-        self.items: List[T] = items if items is not None else []
+        self.items: MenuItems[T] = items if items is not None else []
         self.last_key_pressed_timestamp: float = 0.0
         self.prev_key: Union[int, str] = -1
         self.is_cancelled: bool = False
@@ -221,7 +522,7 @@ class Menu(Generic[T]):
         self._last_input: Optional[str] = None
         self._last_item_count = 0
         self._last_selected_item: Optional[T] = None
-        self._matched_item_indices: List[int] = []
+        self._matched_item_indices: Sequence[int] = []
         self._message: Optional[str] = None
         self._on_item_selected = on_item_selected
         self._requested_selected_row: int = -1
@@ -233,6 +534,8 @@ class Menu(Generic[T]):
         self.__search_mode = search_mode
         self.__search_on_enter: bool = search_on_enter
         self.__fuzzy_search = fuzzy_search
+        self.__rank_matches = rank_matches
+        self.__matcher = self._create_item_matcher()
 
         self.__scroll_y: int = 0
         self.__num_rendered_items: int = 0
@@ -256,6 +559,21 @@ class Menu(Generic[T]):
         # trigger the initial draw.
         self.__should_update_screen = True
 
+        # Rows drawn and rows left untouched since the last frame.
+        self.__last_stdscr = None
+        self.__drawn_rows: Set[int] = set()
+        self.__kept_rows: Set[int] = set()
+        self.__input_last_y = 0
+        # Row of each rendered item -> (item state, draw result), which is used
+        # to skip the items that are unchanged since the last frame.
+        self.__rendered_items: Dict[int, Tuple[Any, "Menu.DrawTextResult"]] = {}
+        self.__last_rendered_items: Dict[int, Tuple[Any, "Menu.DrawTextResult"]] = {}
+
+        # Compiled highlight patterns and the color of each item text.
+        self.__highlight_key: Optional[Tuple[Tuple[str, str], ...]] = None
+        self.__highlight_patts: List[Tuple[re.Pattern, str]] = []
+        self.__item_color_cache: Dict[str, str] = {}
+
         # History
         self.history = history
         if history:
@@ -311,6 +629,9 @@ class Menu(Generic[T]):
 
         return os.path.join(get_data_dir(), "%s_history.json" % slugify(self.history))
 
+    def _create_item_matcher(self) -> MenuItemMatcher:
+        return _ItemMatcher(fuzzy_match=self.__fuzzy_search, rank=self.__rank_matches)
+
     def match_item(self, patt: str, item: T) -> bool:
         s = str(item)
         return _match(s, patt, fuzzy_match=self.__fuzzy_search)
@@ -324,12 +645,17 @@ class Menu(Generic[T]):
     def append_item(self, item: T):
         last_line_selected = self.__selected_row_end == len(self.get_item_indices()) - 1
 
+        assert isinstance(self.items, list)
         self.items.append(item)
+        if self.__search_mode and self.__matcher.is_matching():
+            # The item will be matched by the pass in progress.
+            return
         self._last_item_count = len(self.items)
 
         # Scroll to bottom if last line is selected
         if self.__search_mode:
             if self.match_item(self.get_input(), item):
+                assert isinstance(self._matched_item_indices, list)
                 self._matched_item_indices.append(self._last_item_count - 1)
                 if last_line_selected:
                     self.__selected_row_begin = self.__selected_row_end = (
@@ -343,10 +669,36 @@ class Menu(Generic[T]):
             )
             self.update_screen()
 
+    def append_items(self, items: List[T]):
+        """
+        Append a batch of items, which are matched in one pass and drawn in one
+        screen update.
+        """
+        if not items:
+            return
+
+        last_line_selected = self.__selected_row_end == len(self.get_item_indices()) - 1
+        assert isinstance(self.items, list)
+        self.items.extend(items)
+        if self.__search_mode:
+            self.update_matched_items()
+
+        # Scroll to bottom if last line is selected
+        if last_line_selected:
+            self.__selected_row_begin = self.__selected_row_end = max(
+                0, len(self.get_item_indices()) - 1
+            )
+        self.update_screen()
+
+    def is_matching_items(self) -> bool:
+        """Whether matching items is in progress, see `process_events()`."""
+        return self.__matcher.is_matching()
+
     def clear_items(self):
         self.items.clear()
+        self.__matcher.invalidate()
         self._last_item_count = 0
-        self._matched_item_indices.clear()
+        self._matched_item_indices = []
         self.__selected_row_begin = 0
         self.__selected_row_end = 0
         self.update_screen()
@@ -452,24 +804,81 @@ class Menu(Generic[T]):
     def _update_screen(self):
         assert Menu.stdscr is not None
 
+        last_size = (self._height, self._width)
         self._height, self._width = Menu.stdscr.getmaxyx()  # type: ignore
 
-        if sys.platform == "win32":
-            Menu.stdscr.clear()
+        if (
+            sys.platform == "win32"
+            or Menu.should_update_screen
+            or Menu.stdscr is not self.__last_stdscr
+            or (self._height, self._width) != last_size
+        ):
+            if sys.platform == "win32":
+                Menu.stdscr.clear()
+            else:
+                # Use erase instead of clear to prevent flickering
+                Menu.stdscr.erase()
+            self.__last_stdscr = Menu.stdscr
+            self.__last_rendered_items.clear()
+            # Every row is blank, none of them needs to be cleared.
+            self.__drawn_rows = set(range(self._height))
         else:
-            # Use erase instead of clear to prevent flickering
-            Menu.stdscr.erase()
+            # Only repaint the rows whose content has changed.
+            self.__drawn_rows = set()
+        self.__kept_rows = set()
+        self.__rendered_items = {}
+
         self.on_update_screen(item_y_max=self._height - 1)
+
+        # Clear the rows that have not been drawn in this frame.
+        for y in range(self._height):
+            if y not in self.__drawn_rows and y not in self.__kept_rows:
+                self.__clear_row(y)
+        self.__last_rendered_items = self.__rendered_items
+
         Menu.stdscr.refresh()
 
+    def __clear_row(self, y: int):
+        assert Menu.stdscr is not None
+        try:
+            Menu.stdscr.move(y, 0)
+            Menu.stdscr.clrtoeol()
+        except curses.error:
+            pass
+
+    def __prepare_row(self, y: int):
+        # Clear the row before it is drawn for the first time in this frame.
+        if y not in self.__drawn_rows and y not in self.__kept_rows:
+            self.__clear_row(y)
+            self.__drawn_rows.add(y)
+
     def update_matched_items(self):
         assert self.__search_mode
 
-        self._matched_item_indices.clear()
-        for i, item in enumerate(self.items):
-            if self.match_item(self.get_input(), item):
-                self._matched_item_indices.append(i)
+        patt = self.get_input()
+        if type(self).match_item is Menu.match_item:
+            # Match for a short while and continue in `process_events()` if
+            # there are too many items, so that input is never blocked.
+            self.__matcher.start(self.items, patt)
+            self.__matcher.resume(timeout=MATCH_TIME_SLICE_SECS)
+            self.__update_matched_item_indices()
+        else:
+            # Subclasses may match items by other means than the item string.
+            self._matched_item_indices = [
+                i for i, item in enumerate(self.items) if self.match_item(patt, item)
+            ]
+            self.__clamp_selected_rows()
 
+        self._last_input = self.get_input()
+        self._last_item_count = len(self.items)
+        self.__last_match_time = time.time()
+        self.__should_update_matched_items = False
+
+    def __update_matched_item_indices(self):
+        self._matched_item_indices = self.__matcher.get_indices()
+        self.__clamp_selected_rows()
+
+    def __clamp_selected_rows(self):
         num_matched_items = len(self._matched_item_indices)
         if num_matched_items > 0:
             self.__selected_row_begin = min(
@@ -482,11 +891,6 @@ class Menu(Generic[T]):
             self.__selected_row_begin = 0
             self.__selected_row_end = 0
         self._check_if_item_selection_changed()
-
-        self._last_input = self.get_input()
-        self._last_item_count = len(self.items)
-        self.__last_match_time = time.time()
-        self.__should_update_matched_items = False
         self.__should_update_screen = True
 
     def reset_selection(self):
@@ -498,6 +902,7 @@ class Menu(Generic[T]):
         self._check_if_item_selection_changed()
 
     def refresh(self):
+        self.__matcher.invalidate()
         self.__should_update_matched_items = True
 
     # Returns false if we should exit main loop for the current window
@@ -507,11 +912,6 @@ class Menu(Generic[T]):
         if self._closed:
             return False
 
-        if timeout_ms > 0:
-            Menu.stdscr.timeout(timeout_ms)
-        else:
-            Menu.stdscr.timeout(0)
-
         if self.__search_mode:
             if self.__should_update_matched_items or (
                 time.time() > self.__last_match_time + 0.1
@@ -524,6 +924,28 @@ class Menu(Generic[T]):
                 )
             ):
                 self.update_matched_items()
+            elif self.__matcher.is_matching():
+                self.__matcher.resume(timeout=MATCH_TIME_SLICE_SECS)
+                self.__update_matched_item_indices()
+
+        # Do not wait for input while matching is in progress.
+        if timeout_ms > 0 and not self.__matcher.is_matching():
+            if (
+                self.__search_mode
+                and not self.__search_on_enter
+                and self._last_input != self.get_input()
+            ):
+                # Wake up in time to match the pending input.
+                timeout_ms = max(
+                    1,
+                    min(
+                        timeout_ms,
+                        int((self.__last_match_time + 0.1 - time.time()) * 1000) + 1,
+                    ),
+                )
+            Menu.stdscr.timeout(timeout_ms)
+        else:
+            Menu.stdscr.timeout(0)
 
         # Update item selection
         if self._requested_selected_row >= 0:
@@ -824,6 +1246,7 @@ class Menu(Generic[T]):
             )
 
         s = s[scroll_x:]
+        self.__prepare_row(row)
 
         # Draw left arrow
         if scroll_x > 0:
@@ -860,6 +1283,7 @@ class Menu(Generic[T]):
                     break
                 elif y > last_y:
                     x = col
+                    self.__prepare_row(y)
             else:
                 if y > last_y:
                     if i < len(s) - 1:
@@ -885,11 +1309,23 @@ class Menu(Generic[T]):
         assert Menu.stdscr is not None
 
         # Render input widget
+        for y in range(self.__input_last_y + 1):
+            self.__prepare_row(y)
         draw_input_result = self._input.draw_input(
             Menu.stdscr,
             0,
             show_enter_symbol=self.__should_trigger_search(),
         )
+        if draw_input_result.last_y > self.__input_last_y:
+            # The input has grown into rows that have not been cleared.
+            for y in range(self.__input_last_y + 1, draw_input_result.last_y + 1):
+                self.__prepare_row(y)
+            draw_input_result = self._input.draw_input(
+                Menu.stdscr,
+                0,
+                show_enter_symbol=self.__should_trigger_search(),
+            )
+        self.__input_last_y = draw_input_result.last_y
 
         # Get matched scripts
         item_y = draw_input_result.last_y + 2
@@ -906,6 +1342,7 @@ class Menu(Generic[T]):
         matched_item_index = self.__scroll_y
 
         item_indices = self.get_item_indices()
+        self.__update_highlight_patts()
 
         if self.__line_number and len(item_indices) > 0:
             line_number_width = len(str(item_indices[-1] + 1))
@@ -929,25 +1366,50 @@ class Menu(Generic[T]):
                 color = itm.__dict__["color"]
             else:
                 # Highlight text by regex
-                color = "white"
-                if self._highlight is not None:
-                    for patt, c in self._highlight.items():
-                        if re.search(patt, item_text):
-                            color = c
+                color = self.__get_highlight_color(item_text)
 
-            # Draw item
-            draw_text_result = self.draw_text(
-                item_y,
-                line_number_width + GUTTER_SIZE,
+            # Skip the item if it has been drawn at the same row in the last
+            # frame.
+            item_state = (
+                item_index,
                 item_text,
-                wrap_text=self.__wrap_text,
-                color=color,
-                scroll_x=self.__scroll_x,
-                bold=is_item_selected,
+                color,
+                is_item_selected,
+                line_number_width,
+                self.__scroll_x,
+                self.__wrap_text,
             )
+            last_rendered_item = self.__last_rendered_items.get(item_y)
+            if (
+                last_rendered_item is not None
+                and last_rendered_item[0] == item_state
+                and not any(
+                    y in self.__drawn_rows
+                    for y in range(item_y, last_rendered_item[1].last_y + 1)
+                )
+            ):
+                draw_text_result = last_rendered_item[1]
+                self.__kept_rows.update(range(item_y, draw_text_result.last_y + 1))
+                self.__rendered_items[item_y] = last_rendered_item
+                should_draw_item = False
+            else:
+                should_draw_item = True
+
+            # Draw item
+            if should_draw_item:
+                draw_text_result = self.draw_text(
+                    item_y,
+                    line_number_width + GUTTER_SIZE,
+                    item_text,
+                    wrap_text=self.__wrap_text,
+                    color=color,
+                    scroll_x=self.__scroll_x,
+                    bold=is_item_selected,
+                )
+                self.__rendered_items[item_y] = (item_state, draw_text_result)
 
             # Draw line number
-            if self.__line_number:
+            if self.__line_number and should_draw_item:
                 line_number = f"{item_index + 1}"
                 line_number_text = f"{line_number}"
                 line_number_color = "WHITE" if is_item_selected else "white"
@@ -1001,12 +1463,37 @@ class Menu(Generic[T]):
         except curses.error:
             pass
 
+    def __update_highlight_patts(self):
+        # The highlight map can be modified in place, so compare its content.
+        key = tuple(self._highlight.items()) if self._highlight is not None else ()
+        if key != self.__highlight_key:
+            self.__highlight_key = key
+            self.__highlight_patts = [(re.compile(patt), c) for patt, c in key]
+            self.__item_color_cache.clear()
+
+    def __get_highlight_color(self, item_text: str) -> str:
+        color = self.__item_color_cache.get(item_text)
+        if color is None:
+            # The last matched pattern takes precedence.
+            color = "white"
+            for patt, c in reversed(self.__highlight_patts):
+                if patt.search(item_text):
+                    color = c
+                    break
+
+            if len(self.__item_color_cache) >= ITEM_COLOR_CACHE_SIZE:
+                self.__item_color_cache.clear()
+            self.__item_color_cache[item_text] = color
+        return color
+
     def get_status_bar_text(self) -> str:
         columns: List[str] = []
         if self.__multi_select_mode:
             columns.append("multi_select_mode")
         if self._message:
             columns.append(self._message)
+        if self.__matcher.is_matching():
+            columns.append("matching %d/%d" % self.__matcher.get_progress())
         return " | ".join(columns)
 
     def get_selected_item(self, ignore_cancellation=False) -> Optional[T]:
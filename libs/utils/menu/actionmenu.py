@@ -66,6 +66,7 @@ class ActionMenu(Menu[_Action]):
             self.__on_action(action)
 
     def __add_action(self, action: _Action):
+        assert isinstance(self.items, list)
         self.items.append(action)
         self.add_command(
             lambda action=action: self.__on_action(action),
@@ -147,6 +147,9 @@ class DictEditMenu(Menu[_KeyValuePair]):
             self.set_message(f"copied: {value}")
 
     def __notify_dict_updated(self):
+        # The item strings show the values, match them again.
+        self.refresh()
+
         if self.on_dict_update:
             self.on_dict_update(self.dict_)
         if self.on_dict_history_update:
@@ -172,6 +175,7 @@ class DictEditMenu(Menu[_KeyValuePair]):
         kvps = sorted(kvps, key=lambda x: x[1], reverse=True)
 
         # Update items
+        assert isinstance(self.items, list)
         self.items.clear()
         for key, _ in kvps:
             self.items.append(
@@ -1,12 +1,34 @@
 import json
+import logging
 import os
+import select
+import sys
 import time
 from collections import OrderedDict
-from typing import List, Optional
+from typing import BinaryIO, List, Optional, Union
 
-from . import Menu
+from utils.inotify import (
+    IN_ATTRIB,
+    IN_CREATE,
+    IN_DELETE_SELF,
+    IN_MODIFY,
+    IN_MOVE_SELF,
+    IN_MOVED_TO,
+    Inotify,
+)
+
+from . import Menu, MenuItemMatcher
+from .mappedlines import MappedLines, MappedLinesMatcher
 from .textinput import TextInput
 
+# Files larger than this are memory-mapped instead of being read into memory.
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+# New data is read in blocks of this size, and the lines read within
+# BATCH_SECS are appended to the menu at once.
+READ_BLOCK_SIZE = 1024 * 1024
+BATCH_SECS = 0.05
+
 
 class _SelectPresetMenu(Menu[str]):
     def __init__(self, preset_dir: str):
@@ -32,7 +54,11 @@ class LogViewerMenu(Menu[str]):
     ):
         self.__file = file
         self.__file_name = os.path.basename(file)
-        self.__lines: List[str] = []
+        self.__lines: Union[List[str], MappedLines]
+        if os.path.isfile(file) and os.path.getsize(file) >= LARGE_FILE_SIZE:
+            self.__lines = MappedLines(file)
+        else:
+            self.__lines = []
         self.preset_dir = (
             preset_dir
             if preset_dir
@@ -100,9 +126,19 @@ class LogViewerMenu(Menu[str]):
         self.update_screen()
 
     def sort(self):
+        if isinstance(self.__lines, MappedLines):
+            self.set_message("sort is not supported for large files")
+            return
+
         self.__lines.sort()
         self.refresh()
 
+    def _create_item_matcher(self) -> MenuItemMatcher:
+        if isinstance(self.__lines, MappedLines):
+            return MappedLinesMatcher()
+        else:
+            return super()._create_item_matcher()
+
     def on_enter_pressed(self):
         if self.search_by_input():
             return
@@ -118,23 +154,132 @@ class LogViewerMenu(Menu[str]):
         return " | ".join(cols)
 
     def on_created(self):
-        last_update = 0.0
-        last_file_size = 0
-        with open(self.__file, "r", encoding="utf-8", errors="replace") as f:
+        inotify: Optional[Inotify] = None
+        if Inotify.is_supported():
+            try:
+                inotify = Inotify()
+            except OSError as ex:
+                logging.warning(str(ex))
+
+        try:
+            if isinstance(self.__lines, MappedLines):
+                self.__follow_mapped_file(self.__lines, inotify)
+            else:
+                self.__follow_file(inotify)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def __watch_file(self, inotify: Optional[Inotify]):
+        if inotify is None:
+            return
+        try:
+            # Watch the directory as well to find out when the file is
+            # re-created after it has been rotated.
+            inotify.add_watch(
+                self.__file, IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF
+            )
+            inotify.add_watch(
+                os.path.dirname(os.path.abspath(self.__file)), IN_CREATE | IN_MOVED_TO
+            )
+        except OSError as ex:
+            logging.warning(f"Failed to watch file: {ex}")
+
+    def __wait_for_changes(self, inotify: Optional[Inotify]):
+        if self.is_matching_items():
+            self.process_events()
+        elif inotify is None:
+            self.process_events(timeout_ms=1000)
+        else:
+            # Wait for either a key press or a change to the file.
+            ready, _, _ = select.select([sys.stdin, inotify.fileno()], [], [], 1.0)
+            if inotify.fileno() in ready:
+                inotify.read_events()
+            self.process_events()
+
+    def __is_rotated(self, f: BinaryIO) -> bool:
+        try:
+            return os.stat(self.__file).st_ino != os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def __follow_file(self, inotify: Optional[Inotify]):
+        self.__watch_file(inotify)
+        f = open(self.__file, "rb")
+        try:
+            pending = b""
             while not self._closed:
-                line = f.readline()
-                if line == "":
-                    self.process_events(timeout_ms=1000)
-                    file_size = os.path.getsize(self.__file)
-                    if file_size < last_file_size:
-                        f.seek(0)
-                        self.clear_items()
-                    last_file_size = file_size
-
-                else:
-                    self.append_item(line.rstrip("\n"))
-
-                    now = time.time()
-                    if now - last_update > 0.1:
-                        last_update = now
-                        self.process_events()
+                # Read new data in large blocks and append complete lines in one
+                # batch, which is matched and drawn at once.
+                lines: List[str] = []
+                batch_end_time = time.time() + BATCH_SECS
+                while time.time() < batch_end_time:
+                    data = f.read(READ_BLOCK_SIZE)
+                    if not data:
+                        break
+
+                    data = pending + data
+                    i = data.rfind(b"\n")
+                    if i < 0:
+                        pending = data
+                        continue
+                    pending = data[i + 1 :]
+                    lines.extend(_split_lines(data[: i + 1]))
+
+                if lines:
+                    self.append_items(lines)
+                    self.process_events()
+                    continue
+
+                # At the end of the file
+                if pending:
+                    # Show the line that has not been terminated yet.
+                    self.append_items(_split_lines(pending))
+                    pending = b""
+
+                if os.fstat(f.fileno()).st_size < f.tell():
+                    # The file has been truncated.
+                    f.seek(0)
+                    self.clear_items()
+                    continue
+
+                if self.__is_rotated(f):
+                    # Continue with the new file, all data in the old file has
+                    # been read.
+                    f.close()
+                    f = open(self.__file, "rb")
+                    self.__watch_file(inotify)
+                    continue
+
+                self.__wait_for_changes(inotify)
+        finally:
+            f.close()
+
+    def __follow_mapped_file(self, lines: MappedLines, inotify: Optional[Inotify]):
+        self.__watch_file(inotify)
+        last_file_size = 0
+        while not self._closed:
+            # Index the file in chunks so that the lines indexed so far are
+            # shown while a huge file is being loaded.
+            if lines.update():
+                self.process_events()
+            else:
+                self.__wait_for_changes(inotify)
+
+            file_size = lines.get_file_size()
+            if file_size < last_file_size:
+                self.clear_items()
+            last_file_size = file_size
+
+
+def _split_lines(data: bytes) -> List[str]:
+    # Same as reading the file in text mode with universal newlines.
+    lines = (
+        data.decode("utf-8", errors="replace")
+        .replace("\r\n", "\n")
+        .replace("\r", "\n")
+        .split("\n")
+    )
+    if lines[-1] == "":
+        lines.pop()
+    return lines
@@ -0,0 +1,540 @@
+import bisect
+import logging
+import mmap
+import os
+import re
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from itertools import accumulate, islice, repeat
+from operator import add
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from . import MenuItems
+
+# Maximum number of bytes indexed in one go.
+INDEX_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Number of bytes searched in one go, case-insensitive regex search is slow.
+SEARCH_CHUNK_BYTES = 1024 * 1024
+
+# Large searches are split into shards of this size, which are searched by a
+# pool of processes in parallel.
+SEARCH_SHARD_BYTES = 8 * 1024 * 1024
+SEARCH_PROCESSES = os.cpu_count() or 1
+
+
+class MappedLines(Sequence[str]):
+    """
+    Read-only list of the lines of a file, which is mapped into memory instead
+    of being read. Only the offset of each line is kept, lines are decoded when
+    they are accessed.
+
+    The file can grow while it is mapped, call `update()` to index the new
+    lines. Note that truncating the file in place while it is mapped may crash
+    the process (SIGBUS) when the removed part is accessed, so this is meant
+    for large files that are mostly appended to.
+    """
+
+    def __init__(self, file: str):
+        self.__f = open(file, "rb")
+        self.__mm: Optional[mmap.mmap] = None
+        self.__mapped_size = 0
+
+        # Start offset of each complete line, followed by the offset after the
+        # last complete line.
+        self.__offsets = array("Q", [0])
+
+    def close(self):
+        if self.__mm is not None:
+            self.__mm.close()
+            self.__mm = None
+        self.__mapped_size = 0
+        self.__f.close()
+
+    def __remap(self, size: int):
+        if self.__mm is not None:
+            self.__mm.close()
+            self.__mm = None
+        # Empty files cannot be mapped.
+        if size > 0:
+            self.__mm = mmap.mmap(self.__f.fileno(), size, access=mmap.ACCESS_READ)
+        self.__mapped_size = size
+
+    def get_file_size(self) -> int:
+        return os.fstat(self.__f.fileno()).st_size
+
+    def get_indexed_size(self) -> int:
+        """Returns the number of bytes in the file that have been indexed."""
+        return self.__offsets[-1]
+
+    def update(self, max_bytes: int = INDEX_CHUNK_BYTES) -> bool:
+        """
+        Index the lines that have been appended to the file, at most
+        `max_bytes` at a time. Returns true if there are more bytes to index.
+        """
+        size = self.get_file_size()
+        if size != self.__mapped_size:
+            self.__remap(size)
+
+        begin = self.__offsets[-1]
+        if size <= begin:
+            # Nothing to do, or the file has been truncated and `clear()` has to
+            # be called.
+            return False
+        assert self.__mm is not None
+
+        # Only complete lines are indexed.
+        end = min(size, begin + max_bytes)
+        newline = self.__mm.rfind(b"\n", begin, end)
+        if newline < 0:
+            newline = self.__mm.find(b"\n", end)
+            if newline < 0:
+                return False
+
+        # Accumulating the line lengths in C is much faster than looking for
+        # each newline in Python.
+        line_lengths = map(len, self.__mm[begin:newline].split(b"\n"))
+        self.__offsets.extend(
+            islice(
+                accumulate(map(add, line_lengths, repeat(1)), initial=begin),
+                1,
+                None,
+            )
+        )
+        return newline + 1 < size
+
+    def clear(self):
+        """
+        Forget all lines indexed so far, so that only the lines appended from
+        now on are listed. If the file has been truncated, start over from the
+        beginning of the file.
+        """
+        size = self.get_file_size()
+        self.__remap(size)
+        end = self.__offsets[-1]
+        self.__offsets = array("Q", [end if end <= size else 0])
+
+    def get_complete_line_count(self) -> int:
+        return len(self.__offsets) - 1
+
+    def __get_partial_line_range(self) -> Optional[Tuple[int, int]]:
+        # The last line is listed even if it is not terminated by a newline.
+        begin = self.__offsets[-1]
+        if begin < self.__mapped_size and self.__mm is not None:
+            if self.__mm.find(b"\n", begin) < 0:
+                return begin, self.__mapped_size
+        return None
+
+    def __len__(self) -> int:
+        n = len(self.__offsets) - 1
+        if self.__get_partial_line_range() is not None:
+            n += 1
+        return n
+
+    def get_line_range(self, i: int) -> Tuple[int, int]:
+        """
+        Returns the begin and end offset of the line, excluding the line
+        ending.
+        """
+        if i < len(self.__offsets) - 1:
+            begin, end = self.__offsets[i], self.__offsets[i + 1] - 1
+        else:
+            r = self.__get_partial_line_range()
+            if r is None:
+                raise IndexError("line index out of range")
+            begin, end = r
+
+        assert self.__mm is not None
+        if end > begin and self.__mm[end - 1] == 0x0D:  # "\r"
+            end -= 1
+        return begin, end
+
+    def find_line(self, offset: int, begin: int = 0) -> int:
+        """
+        Returns the index of the first complete line starting at or after the
+        offset, or the number of complete lines if there is none.
+        """
+        return bisect.bisect_left(
+            self.__offsets, offset, begin, len(self.__offsets) - 1
+        )
+
+    def get_bytes(self, i: int) -> bytes:
+        begin, end = self.get_line_range(i)
+        assert self.__mm is not None
+        return self.__mm[begin:end]
+
+    def __getitem__(self, i: Union[int, slice]):  # type: ignore
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+            if i < 0:
+                raise IndexError("line index out of range")
+        return self.get_bytes(i).decode("utf-8", errors="replace")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def search(self, regex: "re.Pattern[bytes]", begin: int, end: int) -> List[int]:
+        """
+        Returns the indices of the lines in [begin, end) that match the regex.
+        The regex runs over the mapped bytes, so lines are not decoded.
+        """
+        num_complete_lines = len(self.__offsets) - 1
+        if begin >= end:
+            return []
+        assert self.__mm is not None
+
+        indices = _search_lines(
+            self.__mm, self.__offsets, regex, begin, min(end, num_complete_lines)
+        )
+        if end > num_complete_lines:
+            line_begin, line_end = self.get_line_range(num_complete_lines)
+            if regex.search(self.__mm, line_begin, line_end):
+                indices.append(num_complete_lines)
+        return indices
+
+    def get_search_shard(self, begin: int, max_bytes: int) -> Tuple[int, int, int]:
+        """
+        Returns a range of complete lines starting from `begin` that spans at
+        most about `max_bytes`, as (end line, begin offset, end offset).
+        """
+        begin_offset = self.__offsets[begin]
+        end = max(begin + 1, self.find_line(begin_offset + max_bytes, begin))
+        end = min(end, len(self.__offsets) - 1)
+        return end, begin_offset, self.__offsets[end]
+
+    def get_file_id(self) -> Tuple[str, int]:
+        st = os.fstat(self.__f.fileno())
+        return self.__f.name, st.st_ino
+
+
+def _get_line_end(buf, offsets: Sequence[int], i: int) -> int:
+    # End offset of a complete line, excluding the line ending.
+    end = offsets[i + 1] - 1
+    if end > offsets[i] and buf[end - 1] == 0x0D:  # "\r"
+        end -= 1
+    return end
+
+
+def _search_lines(
+    buf, offsets: Sequence[int], regex: "re.Pattern[bytes]", begin: int, end: int
+) -> List[int]:
+    # Returns the indices of the complete lines in [begin, end) that match the
+    # regex, where `offsets` holds the start offset of each line followed by
+    # the offset after the last line.
+    indices: List[int] = []
+    if begin >= end:
+        return indices
+
+    search = regex.search
+    if b"$" in regex.pattern:
+        # "$" does not match before "\r\n", so search line by line.
+        for i in range(begin, end):
+            if search(buf, offsets[i], _get_line_end(buf, offsets, i)):
+                indices.append(i)
+        return indices
+
+    bisect_right = bisect.bisect_right
+    pos = offsets[begin]
+    endpos = _get_line_end(buf, offsets, end - 1)
+    i = begin
+    while pos <= endpos:
+        m = search(buf, pos, endpos)
+        if m is None:
+            break
+
+        i = bisect_right(offsets, m.start(), i, end) - 1
+        if m.end() < offsets[i + 1] - 2:
+            # The match ends before the line ending.
+            indices.append(i)
+        else:
+            line_end = _get_line_end(buf, offsets, i)
+            if m.end() <= line_end or search(buf, offsets[i], line_end):
+                indices.append(i)
+
+        i += 1
+        if i >= end:
+            break
+        # Continue with the next line.
+        pos = offsets[i]
+
+    return indices
+
+
+# Mapped files in a search worker process: file -> (inode, mapped file).
+_worker_mapped_files: Dict[str, Tuple[int, mmap.mmap]] = {}
+
+
+def _search_shard(
+    file_id: Tuple[str, int],
+    pattern: bytes,
+    flags: int,
+    begin_offset: int,
+    end_offset: int,
+    first_line: int,
+) -> "array[int]":
+    # Runs in a search worker process. Returns the indices of the lines in the
+    # shard that match the regex.
+    file, inode = file_id
+    mapped = _worker_mapped_files.get(file)
+    if mapped is None or mapped[0] != inode or len(mapped[1]) < end_offset:
+        if mapped is not None:
+            mapped[1].close()
+            del _worker_mapped_files[file]
+        with open(file, "rb") as f:
+            if os.fstat(f.fileno()).st_ino != inode:
+                raise FileNotFoundError(f"File has been replaced: {file}")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < end_offset:
+            raise EOFError(f"File has been truncated: {file}")
+        mapped = (inode, mm)
+        _worker_mapped_files[file] = mapped
+
+    mm = mapped[1]
+    offsets = array(
+        "Q",
+        accumulate(
+            map(
+                add, map(len, mm[begin_offset : end_offset - 1].split(b"\n")), repeat(1)
+            ),
+            initial=begin_offset,
+        ),
+    )
+    regex = re.compile(pattern, flags)
+    return array(
+        "Q",
+        (
+            first_line + i
+            for i in _search_lines(mm, offsets, regex, 0, len(offsets) - 1)
+        ),
+    )
+
+
+_search_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_search_pool() -> Optional[ProcessPoolExecutor]:
+    global _search_pool
+    if _search_pool is None and SEARCH_PROCESSES > 1:
+        try:
+            _search_pool = ProcessPoolExecutor(max_workers=SEARCH_PROCESSES)
+        except (NotImplementedError, OSError) as ex:
+            logging.warning(f"Cannot search in parallel: {ex}")
+    return _search_pool
+
+
+class MappedLinesMatcher:
+    """
+    Match the lines of `MappedLines` against a regex directly over the mapped
+    bytes. The regex is case-insensitive for ASCII characters only.
+
+    Large ranges of lines are split into shards, which are searched by a pool
+    of processes. Results are merged in order as soon as they arrive.
+    """
+
+    def __init__(self):
+        # Result of the last completed pass.
+        self.__last_patt: Optional[str] = None
+        self.__last_line_count = 0
+        self.__last_indices: "array[int]" = array("Q")
+
+        # The pass in progress.
+        self.__lines: Optional[MappedLines] = None
+        self.__patt: Optional[str] = None
+        self.__regex: Optional["re.Pattern[bytes]"] = None
+        self.__begin = 0
+        self.__next = 0
+        self.__end = 0
+        self.__indices: "array[int]" = array("Q")
+
+        # Shards that are being searched in other processes, in line order:
+        # (future, end line of the shard).
+        self.__pending_shards: Deque[Tuple[Future, int]] = deque()
+        self.__next_shard = 0
+
+    def __cancel_pending_shards(self):
+        for future, _ in self.__pending_shards:
+            future.cancel()
+        self.__pending_shards.clear()
+
+    def invalidate(self):
+        self.__cancel_pending_shards()
+        self.__last_patt = None
+        self.__last_line_count = 0
+        self.__last_indices = array("Q")
+        self.__patt = None
+        self.__indices = array("Q")
+
+    def is_matching(self) -> bool:
+        return self.__patt is not None
+
+    def get_progress(self) -> Tuple[int, int]:
+        return self.__next - self.__begin, self.__end - self.__begin
+
+    def start(self, items: MenuItems[Any], patt: str):
+        assert isinstance(items, MappedLines)
+        self.__lines = items
+
+        if self.__patt is not None and self.__patt == patt:
+            # Continue the pass in progress including the new lines.
+            self.__end = len(items)
+            return
+
+        self.__cancel_pending_shards()
+        if patt == self.__last_patt:
+            # Only match the lines that have been appended since the last pass.
+            # The last line may have been incomplete, so match it again.
+            indices = self.__last_indices
+            begin = self.__last_line_count
+            while indices and indices[-1] >= begin:
+                indices.pop()
+        else:
+            indices = array("Q")
+            begin = 0
+
+        self.__regex = None
+        if patt:
+            try:
+                self.__regex = re.compile(
+                    patt.encode("utf-8"), re.IGNORECASE | re.MULTILINE
+                )
+            except re.error:
+                begin = len(items)  # match nothing
+
+        self.__patt = patt
+        self.__begin = self.__next = self.__next_shard = begin
+        self.__end = len(items)
+        self.__indices = indices
+
+    def __submit_shards(self):
+        assert self.__lines is not None
+        assert self.__regex is not None
+
+        pool = _get_search_pool()
+        if pool is None:
+            return
+
+        end = min(self.__end, self.__lines.get_complete_line_count())
+        if self.__next_shard >= end:
+            return
+        if (
+            not self.__pending_shards
+            and self.__lines.get_line_range(end - 1)[1]
+            - self.__lines.get_line_range(self.__next_shard)[0]
+            < SEARCH_SHARD_BYTES
+        ):
+            # Not worth searching in parallel, e.g. lines appended in follow
+            # mode.
+            return
+
+        file_id = self.__lines.get_file_id()
+        while (
+            self.__next_shard < end
+            and len(self.__pending_shards) < SEARCH_PROCESSES * 2
+        ):
+            shard_end, begin_offset, end_offset = self.__lines.get_search_shard(
+                self.__next_shard, SEARCH_SHARD_BYTES
+            )
+            shard_end = min(shard_end, end)
+            future = pool.submit(
+                _search_shard,
+                file_id,
+                self.__regex.pattern,
+                self.__regex.flags,
+                begin_offset,
+                end_offset,
+                self.__next_shard,
+            )
+            self.__pending_shards.append((future, shard_end))
+            self.__next_shard = shard_end
+
+    def __search(self, begin: int, end: int):
+        # Search in this process.
+        assert self.__lines is not None
+        assert self.__regex is not None
+        self.__indices.extend(self.__lines.search(self.__regex, begin, end))
+        self.__next = end
+
+    def resume(self, timeout: Optional[float] = None) -> bool:
+        assert self.__lines is not None
+        start_time = time.time()
+        while self.__next < self.__end:
+            if self.__regex is None:
+                self.__next = self.__end
+                break
+
+            if self.__next == self.__next_shard:
+                self.__submit_shards()
+
+            if self.__pending_shards:
+                # Merge the results of the shards in order.
+                future, shard_end = self.__pending_shards[0]
+                try:
+                    shard_indices = future.result(
+                        timeout=(
+                            None
+                            if timeout is None
+                            else max(0, start_time + timeout - time.time())
+                        )
+                    )
+                except FutureTimeoutError:
+                    break
+                except Exception as ex:
+                    # e.g. the file has been replaced or a worker has died.
+                    logging.warning(f"Failed to search shard: {ex}")
+                    shard_indices = None
+
+                self.__pending_shards.popleft()
+                if shard_indices is None:
+                    self.__search(self.__next, shard_end)
+                else:
+                    self.__indices.extend(shard_indices)
+                    self.__next = shard_end
+            else:
+                # Search about SEARCH_CHUNK_BYTES at a time.
+                offset = self.__lines.get_line_range(self.__next)[0]
+                end = max(
+                    self.__next + 1,
+                    min(
+                        self.__end,
+                        self.__lines.find_line(
+                            offset + SEARCH_CHUNK_BYTES, self.__next
+                        ),
+                    ),
+                )
+                self.__search(self.__next, end)
+                self.__next_shard = self.__next
+
+            if timeout is not None and time.time() - start_time >= timeout:
+                break
+
+        if self.__next < self.__end:
+            return False
+
+        self.__last_patt = self.__patt
+        self.__last_line_count = self.__lines.get_complete_line_count()
+        self.__last_indices = self.__indices
+        self.__patt = None
+        return True
+
+    def get_indices(self) -> Sequence[int]:
+        # The indices are not copied since there can be millions of them. The
+        # menu does not modify them.
+        if self.__lines is None:
+            return []
+        elif self.__patt is not None:
+            if self.__regex is None:
+                return range(self.__next)
+            else:
+                return self.__indices
+        elif self.__last_patt == "":
+            # Avoid a huge list of indices when nothing is filtered.
+            return range(len(self.__lines))
+        else:
+            return self.__last_indices
@@ -0,0 +1,43 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(patt: str) -> Optional["re.Pattern[str]"]:
+    """Compiles the pattern once, returns None if it is invalid."""
+    try:
+        return re.compile(patt)
+    except re.error as ex:
+        logging.warning(f'Invalid regex "{patt}": {ex}')
+        return None
+
+
+class MultiPatternMatcher:
+    """
+    Finds all patterns that match a text in one pass over the distinct
+    patterns, each of them compiled once.
+
+    Combining the patterns into a single alternation or lookahead pattern does
+    not pay off with `re`: it tries every branch at every position and loses
+    the literal prefix search of the individual patterns, which makes it many
+    times slower for texts that do not match.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.__regexes: List[Tuple[str, "re.Pattern[str]"]] = []
+        for patt in dict.fromkeys(patterns):
+            regex = compile_pattern(patt)
+            if regex is not None:
+                self.__regexes.append((patt, regex))
+
+    def match(self, text: str) -> List[str]:
+        """Returns the patterns that match the text."""
+        return [patt for patt, regex in self.__regexes if regex.search(text)]
+
+
+@lru_cache(maxsize=8)
+def get_multi_pattern_matcher(patterns: Tuple[str, ...]) -> MultiPatternMatcher:
+    """Returns the matcher for the patterns, reused while they do not change."""
+    return MultiPatternMatcher(patterns)
@@ -1,4 +1,3 @@
-import ctypes
 import sys
 
 _console_color_initialized = False
@@ -27,6 +26,8 @@ def printc(msg, color="yellow", end="\n"):
     global _console_color_initialized
     if not _console_color_initialized:
         if sys.platform == "win32":
+            import ctypes
+
             kernel32 = ctypes.windll.kernel32
             kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
         _console_color_initialized = True
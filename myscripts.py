@@ -7,6 +7,7 @@ import os
 import platform
 import re
 import shutil
+import subprocess
 import sys
 import threading
 import time
@@ -17,6 +18,7 @@ MYSCRIPT_ROOT = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(MYSCRIPT_ROOT, "libs"))
 sys.path.append(os.path.join(MYSCRIPT_ROOT, "bin"))
 
+from _bulkedit import get_last_bulk_edit_summary, undo_last_bulk_edit
 from _ext import (
     copy_script_path_to_clipboard,
     create_new_script,
@@ -36,7 +38,10 @@ from _script import (
     try_reload_scripts_autorun,
     update_variables,
 )
+from _filelock import dump_lock_stats
+from _scriptlauncher import start_launcher_service
 from _scriptmanager import ScriptManager, execute_script
+from _scriptscheduler import ScheduledScriptRun, ScriptScheduler
 from _scriptserver import ScriptServer
 from _shutil import (
     append_to_path_global,
@@ -64,6 +69,7 @@ KEY_CODE_CTRL_ENTER_WIN = 529
 
 
 script_server: Optional[ScriptServer] = None
+launcher_service: Optional[subprocess.Popen] = None
 
 
 def format_key_value_pairs(kvp):
@@ -122,12 +128,15 @@ class VariableEditMenu(DictEditMenu):
         update_variables(d)
 
 
-def restart_program():
+def restart_program(script_manager: ScriptManager):
     if script_server is not None:
         script_server.stop_server()
+    script_manager.scheduler.stop()
 
     for t in threading.enumerate():
-        if t is not threading.main_thread():
+        # Daemon threads, e.g. those waiting for background scripts, do not
+        # survive `exec()` and need not be waited for.
+        if t is not threading.main_thread() and not t.daemon:
             logging.debug(f"Waiting {t} to exit...")
             t.join()
 
@@ -138,10 +147,20 @@ def restart_program():
     )
 
 
+def _format_scheduled_script_run(run: ScheduledScriptRun) -> str:
+    if run.exit_code is None:
+        return f"{run.duration:.1f}s error: {run.error}"
+    else:
+        return f"{run.duration:.1f}s exit {run.exit_code}"
+
+
 class _ScheduledScript:
-    def __init__(self, script: Script, scheduled_time: float) -> None:
+    def __init__(
+        self, script: Script, scheduled_time: float, scheduler: ScriptScheduler
+    ) -> None:
         self.script = script
         self.scheduled_time = scheduled_time
+        self.scheduler = scheduler
 
     def __str__(self) -> str:
         script_log_file = self.script.get_script_log_file()
@@ -150,16 +169,51 @@ class _ScheduledScript:
         else:
             last_line = None
 
-        return f"{time_diff_str(self.scheduled_time):<10} : {os.path.basename(self.script.script_path):<24} : {last_line}"
+        if self.scheduler.is_script_running(self.script):
+            last_run = "running"
+        else:
+            run = self.scheduler.get_last_run(self.script)
+            last_run = _format_scheduled_script_run(run) if run else ""
+
+        return f"{time_diff_str(self.scheduled_time):<10} : {os.path.basename(self.script.script_path):<24} : {last_run:<12} : {last_line}"
+
+
+class _ScheduledScriptRunItem:
+    def __init__(self, run: ScheduledScriptRun) -> None:
+        self.run = run
+
+    def __str__(self) -> str:
+        start_time = time.strftime(
+            "%m-%d %H:%M:%S", time.localtime(self.run.start_time)
+        )
+        return f"{start_time} : {os.path.basename(self.run.script_path):<24} : {_format_scheduled_script_run(self.run)}"
+
+
+class _ScheduledScriptRunHistoryMenu(Menu[_ScheduledScriptRunItem]):
+    def __init__(self, scheduler: ScriptScheduler):
+        super().__init__(
+            items=[_ScheduledScriptRunItem(run) for run in scheduler.get_run_history()],
+            prompt=": scheduled script runs:",
+        )
 
 
 class _ScheduledScriptMenu(Menu[_ScheduledScript]):
     def __init__(self, script_manager: ScriptManager):
+        self.scheduler = script_manager.scheduler
         items = [
-            _ScheduledScript(script=script, scheduled_time=scheduled_time)
-            for script, scheduled_time in script_manager.get_scheduled_scripts_run_time().items()
+            _ScheduledScript(
+                script=script, scheduled_time=scheduled_time, scheduler=self.scheduler
+            )
+            for script, scheduled_time in sorted(
+                self.scheduler.get_scheduled_scripts_run_time().items(),
+                key=lambda x: x[1],
+            )
         ]
         super().__init__(items=items, prompt=": scheduled scripts:")
+        self.add_command(self._show_run_history, hotkey="alt+h")
+
+    def _show_run_history(self):
+        _ScheduledScriptRunHistoryMenu(scheduler=self.scheduler).exec()
 
     def on_idle(self):
         self.update_screen()
@@ -195,6 +249,7 @@ class _MyScriptMenu(Menu[Script]):
         self.add_command(self._copy_cmdline, hotkey="ctrl+y")
         self.add_command(self._copy_script_path, hotkey="alt+y")
         self.add_command(self._delete_file)
+        self.add_command(self._dump_lock_stats)
         self.add_command(self._duplicate_script, hotkey="ctrl+d")
         self.add_command(self._edit_script_settings, hotkey="ctrl+s")
         self.add_command(self._edit_script, hotkey="ctrl+e")
@@ -206,10 +261,11 @@ class _MyScriptMenu(Menu[Script]):
         self.add_command(self._reload, hotkey="alt+l")
         self.add_command(self._rename_script_and_replace_all)
         self.add_command(self._rename_script)
+        self.add_command(self._undo_rename_script)
         self.add_command(self._set_cmdline_args)
 
     def _reload(self):
-        self.call_func_without_curses(lambda: restart_program())
+        self.call_func_without_curses(lambda: restart_program(self.script_manager))
 
     def _next_scheduled_script(self):
         _ScheduledScriptMenu(script_manager=self.script_manager).exec()
@@ -232,33 +288,29 @@ class _MyScriptMenu(Menu[Script]):
 
             self._reload_scripts()
 
+    def _dump_lock_stats(self):
+        dump_lock_stats()
+        self.set_message("file lock stats are written to the log.")
+
     def on_main_loop(self):
         # Reload scripts
         now = time.time()
-        if (
+        if self.script_manager.is_watching_scripts():
+            # Only apply changes reported by the script watcher.
+            if self.script_manager.process_script_changes(
+                on_register_hotkeys=self._on_register_hotkeys
+            ):
+                self.refresh()
+
+        elif (
             now - self.last_key_pressed_timestamp > REFRESH_INTERVAL_SECS
             and now - self.last_refresh_time > REFRESH_INTERVAL_SECS
         ):
+            # Fall back to polling if no script watcher is available.
             self._reload_scripts()
 
-        for script in self.script_manager.get_scheduled_scripts_to_run():
-
-            def exec_script():
-                script.execute(
-                    args=[],
-                    close_on_exit=True,
-                    restart_instance=False,
-                    new_window=False,
-                    background=True,
-                )
-
-            try:
-                self.call_func_without_curses(exec_script)
-            except Exception as ex:
-                logging.error(f"Error on running scheduled script: {ex}")
-
     def match_item(self, keyword: str, script: Script) -> bool:
-        if script.match_pattern(keyword):
+        if self.script_manager.is_clipboard_matched(script, keyword):
             return True
         else:
             return super().match_item(keyword, script)
@@ -388,11 +440,18 @@ class _MyScriptMenu(Menu[Script]):
         script_path = self.get_selected_script_path()
         if script_path:
             self.set_message("searching scripts to rename...")
-            if rename_script(
-                script_path,
-                on_progress=on_progress,
-                replace_all_occurrence=replace_all_occurrence,
-            ):
+            try:
+                renamed = rename_script(
+                    script_path,
+                    on_progress=on_progress,
+                    replace_all_occurrence=replace_all_occurrence,
+                )
+            except Exception as ex:
+                # e.g. an interrupted rename cannot be recovered.
+                self.set_message(str(ex))
+                self.clear_input()
+                return
+            if renamed:
                 self._reload_scripts()
             self.set_message()
         self.clear_input()
@@ -402,6 +461,18 @@ class _MyScriptMenu(Menu[Script]):
             replace_all_occurrence=True,
         )
 
+    def _undo_rename_script(self):
+        summary = get_last_bulk_edit_summary()
+        if summary is None:
+            self.set_message("nothing to undo.")
+        elif confirm(f"Undo last rename ({summary})?"):
+            try:
+                undo_last_bulk_edit()
+            except Exception as ex:
+                self.set_message(str(ex))
+                return
+            self._reload_scripts()
+
     def _edit_script(self):
         script_path = self.get_selected_script_path()
         if script_path:
@@ -444,7 +515,9 @@ class _MyScriptMenu(Menu[Script]):
         self.clear_input()
 
     def on_idle(self):
-        try_reload_scripts_autorun(self.script_manager.scripts_autorun)
+        # Autorun scripts are reloaded by the script watcher if available.
+        if not self.script_manager.is_watching_scripts():
+            try_reload_scripts_autorun(self.script_manager.scripts_autorun)
 
     def on_item_selection_changed(self, script: Optional[Script]):
         text = self.get_input()
@@ -524,6 +597,7 @@ class _MyScriptMenu(Menu[Script]):
 
 def _main(no_gui=False):
     global script_server
+    global launcher_service
 
     start_daemon = not is_instance_running()
     logging.debug(f"start_daemon: {start_daemon}")
@@ -548,6 +622,9 @@ def _main(no_gui=False):
         script_server = ScriptServer()
         script_server.start_server()
 
+        # Let `start_script.py` and `run_script.py` skip the interpreter startup.
+        launcher_service = start_launcher_service()
+
     script_manager = ScriptManager(start_daemon=start_daemon, startup=args.startup)
 
     run_script_and_quit = args.cmd == "r" or args.cmd == "run"
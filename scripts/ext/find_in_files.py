@@ -1,13 +1,39 @@
+import argparse
+import base64
 import glob
+import json
 import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
 import time
-from typing import Iterable, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from _editor import open_code_editor
 from _script import get_relative_script_path
+from _trigramindex import find_scripts_containing
 from utils.menu import Menu
 from utils.menu.textinput import TextInput
 
+RG_FILES_PER_PROCESS = 1000
+
+# The result menu handles input and shows the lines matched so far at least
+# this often while searching.
+POLL_SECS = 0.05
+
 
 class _MatchedLine:
     def __init__(
@@ -22,26 +48,165 @@ class _MatchedLine:
         return f"{self.relative_path}:{self.line_no}:{self.line}"
 
 
-def _find_matched_lines(
+def _get_line_searcher(
+    s: str, regex: bool, ignore_case: bool
+) -> Tuple[Callable[[Any, int], int], bool]:
+    """
+    Returns `(search, encoded)`: `search(text, pos)` returns the position of
+    the next match in `text`, or -1. If `encoded` is True, `text` is the raw
+    file content in bytes, otherwise it is the decoded string.
+    """
+    if not regex and not ignore_case:
+        needle = s.encode("utf-8")
+        return (lambda text, pos: text.find(needle, pos)), True
+
+    patt = re.compile(
+        s if regex else re.escape(s),
+        flags=re.MULTILINE | (re.IGNORECASE if ignore_case else 0),
+    )
+
+    def search(text: str, pos: int) -> int:
+        match = patt.search(text, pos)
+        return match.start() if match else -1
+
+    return search, False
+
+
+def _search_file(
+    file: str, search: Callable[[Any, int], int], encoded: bool
+) -> List[_MatchedLine]:
+    try:
+        with open(file, "rb") as f:
+            data = f.read()
+    except OSError:
+        return []
+
+    if encoded:
+        text = data
+    else:
+        # So that `$` also matches at the end of lines ending with "\r\n".
+        text = data.decode("utf-8", errors="replace").replace("\r\n", "\n")
+    newline = b"\n" if encoded else "\n"
+
+    result: List[_MatchedLine] = []
+    line_no = 1
+    line_start = 0
+    pos = search(text, 0)
+    while pos >= 0:
+        # Count the lines incrementally from the last matched line.
+        start = text.rfind(newline, 0, pos) + 1
+        line_no += text.count(newline, line_start, start)
+        line_start = start
+        end = text.find(newline, pos)
+        if end < 0:
+            end = len(text)
+
+        line = text[start:end]
+        if encoded:
+            # Only the matched lines are decoded.
+            line = line.decode("utf-8", errors="replace")
+        result.append(
+            _MatchedLine(
+                relative_path=get_relative_script_path(file),
+                full_path=file,
+                line_no=line_no,
+                line=line.rstrip("\r"),
+            )
+        )
+
+        if end == len(text):
+            break
+        pos = search(text, end + 1)
+
+    return result
+
+
+def _find_matched_lines_parallel(
     s: str,
     files: Iterable[str],
+    regex: bool,
+    ignore_case: bool,
+    stop: Optional[threading.Event],
 ) -> Iterator[_MatchedLine]:
-    for i, file in enumerate(files):
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                lines = f.read().splitlines()
+    search, encoded = _get_line_searcher(s, regex=regex, ignore_case=ignore_case)
+
+    def search_file(file: str) -> List[_MatchedLine]:
+        if stop is not None and stop.is_set():
+            return []
+        return _search_file(file, search, encoded)
+
+    executor = ThreadPoolExecutor()
+    try:
+        # Results are yielded in the same order as `files` as soon as they are
+        # available.
+        for lines in executor.map(search_file, files):
+            yield from lines
+    finally:
+        # Do not wait for the remaining files if the search is abandoned.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _find_matched_lines_ripgrep(
+    s: str,
+    files: Iterable[str],
+    regex: bool,
+    ignore_case: bool,
+    stop: Optional[threading.Event],
+) -> Iterator[_MatchedLine]:
+    args = ["rg", "--json", "--no-config", "--no-messages", "--crlf"]
+    if not regex:
+        args.append("--fixed-strings")
+    if ignore_case:
+        args.append("--ignore-case")
+    args += ["--regexp", s, "--"]
+
+    files = list(files)
+    # Pass files in batches to stay below the command line length limit.
+    for i in range(0, len(files), RG_FILES_PER_PROCESS):
+        if stop is not None and stop.is_set():
+            return
+        with subprocess.Popen(
+            args + files[i : i + RG_FILES_PER_PROCESS],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ) as ps:
+            assert ps.stdout is not None
+            for line in ps.stdout:
+                message = json.loads(line)
+                if message["type"] != "match":
+                    continue
+
+                data = message["data"]
+                file = _get_rg_text(data["path"])
+                yield _MatchedLine(
+                    relative_path=get_relative_script_path(file),
+                    full_path=file,
+                    line_no=data["line_number"],
+                    line=_get_rg_text(data["lines"]).rstrip("\r\n"),
+                )
+
 
-            for i, line in enumerate(lines):
-                if s in line:
-                    yield _MatchedLine(
-                        relative_path=get_relative_script_path(file),
-                        full_path=file,
-                        line_no=i + 1,
-                        line=lines[i],
-                    )
+def _get_rg_text(data: Dict[str, str]) -> str:
+    # Non UTF-8 data is base64 encoded by ripgrep.
+    if "text" in data:
+        return data["text"]
+    else:
+        return base64.b64decode(data["bytes"]).decode("utf-8", errors="replace")
 
-        except UnicodeDecodeError:
-            pass
+
+def _find_matched_lines(
+    s: str,
+    files: Iterable[str],
+    regex=False,
+    ignore_case=False,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[_MatchedLine]:
+    """Searches the files until all are searched or `stop` is set."""
+    if shutil.which("rg"):
+        find = _find_matched_lines_ripgrep
+    else:
+        find = _find_matched_lines_parallel
+    return find(s, files, regex=regex, ignore_case=ignore_case, stop=stop)
 
 
 class _FindResultMenu(Menu[_MatchedLine]):
@@ -49,32 +214,96 @@ class _FindResultMenu(Menu[_MatchedLine]):
         self,
         keyword: str,
         files: Iterable[str],
+        regex=False,
+        ignore_case=False,
     ):
         self.__find_result: List[_MatchedLine] = []
         self.__keyword = keyword
         self.__files = files
+        self.__regex = regex
+        self.__ignore_case = ignore_case
         super().__init__(prompt="Result:", items=self.__find_result)
 
+    def __search(
+        self,
+        result_queue: "queue.Queue[Union[_MatchedLine, Exception, None]]",
+        stop: threading.Event,
+    ):
+        # Runs in a background thread, so that the menu stays responsive while
+        # no lines are matched.
+        try:
+            for line in _find_matched_lines(
+                self.__keyword,
+                files=self.__files,
+                regex=self.__regex,
+                ignore_case=self.__ignore_case,
+                stop=stop,
+            ):
+                if stop.is_set():
+                    return
+                result_queue.put(line)
+        except Exception as ex:
+            result_queue.put(ex)
+        finally:
+            result_queue.put(None)
+
     def on_created(self):
-        last_time = 0.0
+        result_queue: "queue.Queue[Union[_MatchedLine, Exception, None]]" = (
+            queue.Queue()
+        )
+        stop = threading.Event()
+        threading.Thread(
+            target=self.__search, args=(result_queue, stop), daemon=True
+        ).start()
 
-        for line in _find_matched_lines(self.__keyword, files=self.__files):
-            now = time.time()
-            self.__find_result.append(line)
-            if now - last_time > 0.1:
-                last_time = now
-                self.process_events()
-                self.set_message("searching...")
+        self.set_message("searching...")
+        try:
+            searching = True
+            while searching:
+                # Collect the lines matched within a time slice, and append
+                # them to the menu at once.
+                pending_lines: List[_MatchedLine] = []
+                end_time = time.time() + POLL_SECS
+                try:
+                    while searching:
+                        result = result_queue.get(
+                            timeout=max(0, end_time - time.time())
+                        )
+                        if result is None:
+                            searching = False
+                        elif isinstance(result, Exception):
+                            raise result
+                        else:
+                            pending_lines.append(result)
+                except queue.Empty:
+                    pass
+
+                self.append_items(pending_lines)
+                if not self.process_events():
+                    return
+        finally:
+            stop.set()
 
         self.set_message(None)
 
 
-def find_in_files(files: Iterable[str], history_file: Optional[str] = None):
+def find_in_files(
+    files: Iterable[str],
+    history_file: Optional[str] = None,
+    use_index=False,
+    regex=False,
+    ignore_case=False,
+):
     text_input = TextInput(history_file=history_file)
     keyword = text_input.request_input()
 
     if keyword:
-        find_result_menu = _FindResultMenu(keyword, files=files)
+        if use_index and not regex and not ignore_case:
+            # Only scan the files that may contain the keyword.
+            files = find_scripts_containing(keyword, files=files)
+        find_result_menu = _FindResultMenu(
+            keyword, files=files, regex=regex, ignore_case=ignore_case
+        )
         find_result_menu.exec()
         selected_line = find_result_menu.get_selected_item()
         if selected_line is not None:
@@ -82,10 +311,17 @@ def find_in_files(files: Iterable[str], history_file: Optional[str] = None):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--regex", action="store_true")
+    parser.add_argument("-i", "--ignore-case", action="store_true")
+    args = parser.parse_args()
+
     find_in_files(
         files=(
             file
             for file in glob.glob(os.path.join(os.getcwd(), "**", "*"), recursive=True)
             if os.path.isfile(file)
-        )
+        ),
+        regex=args.regex,
+        ignore_case=args.ignore_case,
     )
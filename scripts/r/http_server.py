@@ -1,9 +1,9 @@
 import http.server
 import os
-import re
 from http.server import ThreadingHTTPServer
 
 from _shutil import get_ip_addresses
+from utils.httputils import copy_byte_range, parse_byte_range
 
 PORT = 8000
 
@@ -14,43 +14,6 @@ for ip in get_ip_addresses():
     print("http://%s:%i" % (ip, PORT))
 
 
-# Copied from https://github.com/danvk/RangeHTTPServer/tree/ff4277417c6c8ea2435399659c25a172dbdfd24f
-
-
-def copy_byte_range(infile, outfile, start=None, stop=None, bufsize=16 * 1024):
-    """Like shutil.copyfileobj, but only copy a range of the streams.
-    Both start and stop are inclusive.
-    """
-    if start is not None:
-        infile.seek(start)
-    while 1:
-        to_read = min(bufsize, stop + 1 - infile.tell() if stop else bufsize)
-        buf = infile.read(to_read)
-        if not buf:
-            break
-        outfile.write(buf)
-
-
-BYTE_RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)?$")
-
-
-def parse_byte_range(byte_range):
-    """Returns the two numbers in 'bytes=123-456' or throws ValueError.
-    The last number or both numbers may be None.
-    """
-    if byte_range.strip() == "":
-        return None, None
-
-    m = BYTE_RANGE_RE.match(byte_range)
-    if not m:
-        raise ValueError("Invalid byte range %s" % byte_range)
-
-    first, last = [x and int(x) for x in m.groups()]
-    if last and last < first:
-        raise ValueError("Invalid byte range %s" % byte_range)
-    return first, last
-
-
 class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Adds support for HTTP 'Range' requests to SimpleHTTPRequestHandler
     The approach is to:
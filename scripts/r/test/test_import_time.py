@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+import unittest
+from typing import Dict
+
+LIBS_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs")
+)
+
+# Best-of-N cumulative import time in milliseconds, measured by
+# `python -X importtime`.
+IMPORT_TIME_BUDGET_MS = {"_shutil": 60, "_script": 80}
+
+NUM_RUNS = 5
+
+# Modules that must only be imported on first use.
+LAZY_MODULES = [
+    "_android",
+    "_cpp",
+    "_editor",
+    "_pkgmanager",
+    "_template",
+    "ctypes",
+    "inspect",
+    "utils.clip",
+    "utils.menu",
+    "yaml",
+]
+
+
+def _get_import_times(module: str) -> Dict[str, int]:
+    """Returns the cumulative import time in microseconds of each module."""
+    env = os.environ.copy()
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # measure with cached bytecode
+    env["PYTHONPATH"] = LIBS_DIR
+    ps = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+
+    import_times: Dict[str, int] = {}
+    for line in ps.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+class TestImportTime(unittest.TestCase):
+    def test_lazy_imports(self):
+        for module in IMPORT_TIME_BUDGET_MS.keys():
+            import_times = _get_import_times(module)
+            for lazy_module in LAZY_MODULES:
+                if lazy_module == "ctypes" and sys.platform == "win32":
+                    continue
+                self.assertFalse(
+                    lazy_module in import_times,
+                    f"{lazy_module} should not be imported by `import {module}`",
+                )
+
+    def test_import_time_budget(self):
+        for module, budget_ms in IMPORT_TIME_BUDGET_MS.items():
+            _get_import_times(module)  # warm up the bytecode cache
+            best_ms = min(
+                _get_import_times(module)[module] / 1000 for _ in range(NUM_RUNS)
+            )
+            self.assertLessEqual(
+                best_ms,
+                budget_ms,
+                f"`import {module}` took {best_ms:.1f}ms, over the budget of {budget_ms}ms",
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
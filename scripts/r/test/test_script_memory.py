@@ -0,0 +1,151 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+from contextlib import ExitStack, contextmanager
+from typing import Iterator, List
+from unittest import mock
+
+sys.path.insert(
+    0,
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs")),
+)
+
+from _script import Script, ScriptDirectory, script_config_cache_stats  # noqa: E402
+from _scriptmanager import ScriptManager  # noqa: E402
+
+NUM_SCRIPTS = 10000
+
+# Every n-th script has its own config file.
+SCRIPT_CONFIG_RATIO = 10
+
+# Budgets for 10k scripts.
+MEMORY_BUDGET_MB = 8
+LOAD_TIME_BUDGET_SECS = 3.0
+
+# The index is kept in memory as well.
+MANAGER_MEMORY_BUDGET_MB = 20
+
+
+def _create_scripts(script_dir: str) -> List[str]:
+    files: List[str] = []
+    for i in range(NUM_SCRIPTS):
+        folder = os.path.join(script_dir, "folder%d" % (i % 100))
+        os.makedirs(folder, exist_ok=True)
+        file = os.path.join(folder, "script%d.sh" % i)
+        with open(file, "w") as f:
+            f.write("echo {{MESSAGE}}\n")
+        if i % SCRIPT_CONFIG_RATIO == 0:
+            with open(os.path.splitext(file)[0] + ".config.yaml", "w") as f:
+                f.write("hotkey: ctrl+%d\nbackground: true\n" % (i % 10))
+        files.append(file)
+    return files
+
+
+def _load_scripts(files: List[str]) -> List[Script]:
+    scripts = [Script(file) for file in files]
+    scripts.sort()
+    return scripts
+
+
+def _reload_scripts(script_manager: ScriptManager) -> float:
+    start_time = time.perf_counter()
+    script_manager.reload_scripts(autorun=False)
+    return time.perf_counter() - start_time
+
+
+@contextmanager
+def _use_dirs(script_dir: str, data_dir: str) -> Iterator[None]:
+    """Load scripts only from `script_dir` and keep the index in `data_dir`."""
+    with ExitStack() as stack:
+        for module in ("_script", "_scriptindex", "_scriptmanager"):
+            stack.enter_context(
+                mock.patch(
+                    f"{module}.get_script_directories",
+                    return_value=[ScriptDirectory(name="", path=script_dir)],
+                )
+            )
+        for module in ("_script", "_scriptindex", "_scriptmanager", "_scriptscheduler"):
+            stack.enter_context(
+                mock.patch(f"{module}.get_data_dir", return_value=data_dir)
+            )
+        yield
+
+
+class TestScriptMemory(unittest.TestCase):
+    def test_load_scripts(self):
+        with tempfile.TemporaryDirectory() as script_dir:
+            files = _create_scripts(script_dir)
+
+            # Cold load, config files are parsed.
+            start_time = time.perf_counter()
+            _load_scripts(files)
+            load_time = time.perf_counter() - start_time
+
+            # Reload, config files are cached.
+            start_time = time.perf_counter()
+            _load_scripts(files)
+            reload_time = time.perf_counter() - start_time
+
+            tracemalloc.start()
+            scripts = _load_scripts(files)
+            memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+            tracemalloc.stop()
+
+            print(
+                f"\n{NUM_SCRIPTS} scripts: loaded in {load_time:.2f}s,"
+                f" reloaded in {reload_time:.2f}s, {memory_mb:.1f}MB"
+                f" ({memory_mb * 1024 * 1024 / NUM_SCRIPTS:.0f}B per script)"
+            )
+
+            self.assertEqual(scripts[0].cfg["hotkey"], "")
+            self.assertEqual(
+                sum(1 for script in scripts if script.cfg["background"]),
+                NUM_SCRIPTS // SCRIPT_CONFIG_RATIO,
+            )
+            self.assertLessEqual(memory_mb, MEMORY_BUDGET_MB)
+            self.assertLessEqual(load_time, LOAD_TIME_BUDGET_SECS)
+
+    def test_reload_scripts_with_script_manager(self):
+        with ExitStack() as stack:
+            script_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            data_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            stack.enter_context(_use_dirs(script_dir, data_dir))
+            _create_scripts(script_dir)
+
+            # Cold start, scripts are loaded from the files and indexed.
+            load_time = _reload_scripts(ScriptManager(start_daemon=False))
+
+            # Restart, scripts are restored from the index without parsing
+            # their config files.
+            config_cache_misses = script_config_cache_stats["misses"]
+            restart_time = _reload_scripts(ScriptManager(start_daemon=False))
+            self.assertEqual(script_config_cache_stats["misses"], config_cache_misses)
+
+            tracemalloc.start()
+            script_manager = ScriptManager(start_daemon=False)
+            _reload_scripts(script_manager)
+            memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+            tracemalloc.stop()
+
+            print(
+                f"\n{NUM_SCRIPTS} scripts with ScriptManager: loaded in"
+                f" {load_time:.2f}s, restarted in {restart_time:.2f}s,"
+                f" {memory_mb:.1f}MB"
+            )
+
+            scripts = script_manager.scripts
+            self.assertEqual(len(scripts), NUM_SCRIPTS)
+            self.assertEqual(
+                sum(1 for script in scripts if script.cfg["background"]),
+                NUM_SCRIPTS // SCRIPT_CONFIG_RATIO,
+            )
+            self.assertLessEqual(memory_mb, MANAGER_MEMORY_BUDGET_MB)
+            self.assertLessEqual(load_time, LOAD_TIME_BUDGET_SECS)
+            self.assertLessEqual(restart_time, LOAD_TIME_BUDGET_SECS)
+
+
+if __name__ == "__main__":
+    unittest.main()